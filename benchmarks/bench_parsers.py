@@ -0,0 +1,510 @@
+import concurrent.futures
+import json
+import pathlib
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from types import SimpleNamespace
+
+import pandas
+
+import kfbatch.stat
+from kfbatch.acct import get_acct_summary_df
+from kfbatch.hostlist import build_hostlist_index, compress_hostlist, intersect_hostlist, iter_hostlist
+from kfbatch.stat import (
+    SCONTROL_NODE_KEYS,
+    _parse_key_value_fields,
+    _split_scontrol_node_blocks,
+    _topology_socket_free_cores,
+    apply_slurm_reservations,
+    build_reservation_calendar,
+    collect_uge_samples,
+    get_qstat_df,
+    get_qstat_xml_df,
+    get_scontrol_node_table,
+    get_slurm_partition_view,
+    get_squeue_job_counts,
+    get_squeue_json_user_df,
+    get_squeue_user_df,
+    get_user_df,
+    parse_command_stdout,
+    query_reservation_calendar,
+    submit_slurm_sources,
+)
+
+
+QSTAT_FIXTURES = [
+    "data/qstat1/qstatF.txt",
+    "data/qstat2/qstatF.txt",
+    "data/qstat3/qstatF.txt",
+    "data/qstat4/qstatF.txt",
+]
+
+
+def _read_lines(path):
+    with open(REPO_ROOT / path) as fh:
+        return fh.readlines()
+
+
+def _best_of(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_synthetic_qstat_lines(num_queue_instances, template_path=QSTAT_FIXTURES[0]):
+    template = _read_lines(template_path)
+    blocks = []
+    current = []
+    for line in template:
+        if line.startswith("---"):
+            if current:
+                blocks.append(current)
+            current = []
+            continue
+        if line.startswith("queuename"):
+            continue
+        current.append(line)
+    if current:
+        blocks.append(current)
+    blocks = [b for b in blocks if ("@" in b[0]) and (not b[0].startswith(" "))]
+    lines = [template[0]]
+    for i in range(num_queue_instances):
+        block = blocks[i % len(blocks)]
+        queue_name, node_name = block[0].split()[0].split("@", 1)
+        header = block[0].replace(node_name, "{}x{:06d}".format(node_name, i), 1)
+        lines.append("-" * 81 + "\n")
+        lines.append(header)
+        lines.extend(block[1:])
+    return lines
+
+
+def bench_qstat_fixtures():
+    print("get_qstat_df on bundled fixtures:")
+    for path in QSTAT_FIXTURES:
+        lines = _read_lines(path)
+        elapsed = _best_of(lambda: get_qstat_df(lines))
+        print("  {}: {:,} lines, {:.1f} ms".format(path, len(lines), elapsed * 1000))
+
+
+def bench_qstat_scaling(sizes=(5000, 10000, 25000, 50000)):
+    print("get_qstat_df on synthetic snapshots (linear scaling => constant us/instance):")
+    for size in sizes:
+        lines = make_synthetic_qstat_lines(size)
+        elapsed = _best_of(lambda: get_qstat_df(lines), repeat=1)
+        print("  {:,} queue instances, {:,} lines: {:.2f} s, {:.1f} us/instance".format(
+            size, len(lines), elapsed, elapsed / size * 1e6))
+
+
+def bench_qstat_xml_vs_text(path_text="data/qstat4/qstatF.txt", path_xml="data/qstat4/qstatF_xml.xml"):
+    print("qstat -F text path vs. qstat -F -xml path (same snapshot):")
+    text_lines = _read_lines(path_text)
+    xml_lines = _read_lines(path_xml)
+    elapsed_text = _best_of(lambda: (get_qstat_df(text_lines), get_user_df(text_lines)))
+    elapsed_xml = _best_of(lambda: get_qstat_xml_df(xml_lines))
+    num_bytes_text = sum(len(line) for line in text_lines)
+    num_bytes_xml = sum(len(line) for line in xml_lines)
+    print("  text: {:.1f} ms, {:.1f} MB/s".format(elapsed_text * 1000, num_bytes_text / elapsed_text / 1e6))
+    print("  xml:  {:.1f} ms, {:.1f} MB/s".format(elapsed_xml * 1000, num_bytes_xml / elapsed_xml / 1e6))
+
+
+def bench_uge_array_slots(num_jobs=200000):
+    print("get_user_df total_slots on {:,} synthetic UGE job rows:".format(num_jobs))
+    expressions = ["", "1", "1-100:1", "1,2,4-8:2", "108-10531:1", "47"]
+    lines = [
+        "  {} 0.25000 job user qw 02/11/2023 18:22:41 4 {}\n".format(20000000 + i, expressions[i % len(expressions)])
+        for i in range(num_jobs)
+    ]
+    elapsed = _best_of(lambda: get_user_df(lines), repeat=1)
+    print("  {:.2f} s, {:.2f} us/job".format(elapsed, elapsed / num_jobs * 1e6))
+
+
+def bench_uge_sample_merge(num_queue_instances=50000, niter=5):
+    print("collect_uge_samples merge cost over {} samples of {:,} queue instances:".format(niter, num_queue_instances))
+    df = get_qstat_df(make_synthetic_qstat_lines(num_queue_instances))
+    samples = []
+    for i in range(niter):
+        df_i = df.sample(frac=1.0, random_state=i).reset_index(drop=True)
+        df_i["ncore_available"] = (df_i["ncore_available"] - i).clip(lower=0)
+        samples.append(df_i)
+    args = SimpleNamespace(niter=niter)
+    elapsed = _best_of(lambda: collect_uge_samples(args, lambda i: (samples[i], None), ["queue_name", "node_name"]))
+    print("  {:.1f} ms total, {:.1f} ms/sample".format(elapsed * 1000, elapsed / niter * 1000))
+
+
+def bench_topology_sockets(num_nodes=50000):
+    print("Per-socket free cores from hl:m_topology_inuse for {:,} nodes:".format(num_nodes))
+    topologies = pandas.Series([
+        "S" + "C" * (i % 64) + "c" * (64 - i % 64) + "S" + "c" * (i % 32) + "C" * (64 - i % 32)
+        for i in range(num_nodes)
+    ])
+    elapsed = _best_of(lambda: _topology_socket_free_cores(topologies))
+    print("  {:.1f} ms, {:.2f} us/node".format(elapsed * 1000, elapsed / num_nodes * 1e6))
+
+
+def make_synthetic_squeue_lines(num_jobs, template_path="squeue_notrunc.txt"):
+    template = [line for line in _read_lines(template_path) if line.strip()!=""]
+    lines = []
+    for i in range(num_jobs):
+        # The bundled capture uses literal "\t" separators; emit real tabs as squeue does.
+        items = template[i % len(template)].rstrip("\n").split("\\t")
+        job_id = items[0]
+        if "_" in job_id:
+            job_id = "{}_{}".format(20000000 + i, job_id.split("_", 1)[1])
+        else:
+            job_id = str(20000000 + i)
+        if len(items)<11:
+            items = items[:7] + ["4", "8G", "1-00:00:00"] + items[7:]
+        lines.append("\t".join([job_id] + items[1:]) + "\n")
+    return lines
+
+
+def bench_squeue_scaling(sizes=(100000, 1000000)):
+    print("get_squeue_user_df on synthetic SLURM_SQUEUE_PARSE_FIELDS output:")
+    for size in sizes:
+        lines = make_synthetic_squeue_lines(size)
+        elapsed = _best_of(lambda: get_squeue_user_df(lines), repeat=1)
+        print("  {:,} jobs: {:.2f} s, {:.2f} us/job".format(size, elapsed, elapsed / size * 1e6))
+
+
+def make_synthetic_scontrol_node_lines(num_nodes, num_partition_per_node=4):
+    # Every node is in a cluster-wide partition plus a few overlapping ones.
+    lines = []
+    for i in range(num_nodes):
+        partitions = ["all"] + ["p{}".format((i + j) % 16) for j in range(num_partition_per_node - 1)]
+        lines.append(
+            "NodeName=n{:06d} Arch=x86_64 CoresPerSocket=32 CPUAlloc={} CPUEfctv=64 CPUTot=64 "
+            "RealMemory=512000 AllocMem={} FreeMem=400000 Sockets=2 State=MIXED Partitions={}\n".format(
+                i, i % 64, (i % 64) * 4000, ",".join(partitions)))
+    return lines
+
+
+def make_scaled_scontrol_node_lines(num_nodes, template_path="scontrol_show_node_o.txt"):
+    template = [line for line in _read_lines(template_path) if line.startswith("NodeName=")]
+    lines = []
+    for i in range(num_nodes):
+        line = template[i % len(template)]
+        node_name = line.split(None, 1)[0].split("=", 1)[1]
+        lines.append(line.replace("NodeName={} ".format(node_name), "NodeName={}x{:06d} ".format(node_name, i), 1))
+    return lines
+
+
+def _split_key_value_fields_by_space(line):
+    # The previous tokenizer, which truncated values containing spaces; kept for comparison.
+    params = {}
+    for item in line.split(" "):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            params[key] = value
+    return params
+
+
+def bench_scontrol_tokenizer(num_nodes=20000):
+    print("scontrol key=value tokenizer on scontrol_show_node_o.txt scaled to {:,} nodes:".format(num_nodes))
+    blocks = _split_scontrol_node_blocks(make_scaled_scontrol_node_lines(num_nodes))
+    for label, func in [
+        ("space split, all keys", lambda: [_split_key_value_fields_by_space(b) for b in blocks]),
+        ("key scan, all keys", lambda: [_parse_key_value_fields(b) for b in blocks]),
+        ("key scan, SCONTROL_NODE_KEYS", lambda: [_parse_key_value_fields(b, keys=SCONTROL_NODE_KEYS) for b in blocks]),
+    ]:
+        elapsed = _best_of(func)
+        print("  {}: {:.1f} ms, {:.2f} us/node".format(label, elapsed * 1000, elapsed / num_nodes * 1e6))
+    lines = make_scaled_scontrol_node_lines(num_nodes)
+    elapsed = _best_of(lambda: get_scontrol_node_table(lines))
+    print("  get_scontrol_node_table end to end: {:.1f} ms".format(elapsed * 1000))
+
+
+def bench_hostlist(num_nodes=50000, num_reserved=1000000):
+    # A reservation hostlist covering num_reserved names resolved against a node
+    # table of num_nodes, by expansion into a set vs. by range intersection.
+    node_names = ["a{:07d}".format(i) for i in range(0, 2 * num_nodes, 2)]
+    expr = "a[{:07d}-{:07d}],login1".format(0, num_reserved - 1)
+    print("hostlist {} against {:,} nodes:".format(expr, num_nodes))
+    elapsed = _best_of(lambda: set(iter_hostlist(expr)).intersection(node_names))
+    print("  expand and intersect: {:.1f} ms".format(elapsed * 1000))
+    index = build_hostlist_index(node_names)
+    elapsed = _best_of(lambda: intersect_hostlist(expr, index))
+    print("  range intersection on a prebuilt index: {:.1f} ms".format(elapsed * 1000))
+    elapsed = _best_of(lambda: intersect_hostlist(expr, build_hostlist_index(node_names)))
+    print("  range intersection including the index: {:.1f} ms".format(elapsed * 1000))
+    tied_names = ["a{:07d}".format(i) for i in range(num_nodes) if i % 1000 != 999]
+    elapsed = _best_of(lambda: compress_hostlist(tied_names))
+    txt = "  compress {:,} tied names: {:.1f} ms -> {:,} characters"
+    print(txt.format(len(tied_names), elapsed * 1000, len(compress_hostlist(tied_names))))
+
+
+def bench_slurm_node_table(num_nodes=20000, num_partition_per_node=4):
+    print("SLURM node table vs. (partition, node) rows, {:,} nodes in {} partitions each:".format(
+        num_nodes, num_partition_per_node))
+    lines = make_synthetic_scontrol_node_lines(num_nodes, num_partition_per_node)
+    node_table = get_scontrol_node_table(lines)
+    df_long = get_slurm_partition_view(node_table)
+    df_reservation = pandas.DataFrame({
+        "queue_name": ["p{}".format(i % 16) for i in range(0, num_nodes, 10)],
+        "node_name": ["n{:06d}".format(i) for i in range(0, num_nodes, 10)],
+        "reservation_name": "maint",
+        "reserved_cores": 8,
+        "reserved_mem_mb": 0,
+    })
+    for label, df in [("node table", node_table["df_node"]), ("partition rows", df_long)]:
+        num_bytes = df.memory_usage(deep=True).sum()
+        elapsed = _best_of(lambda: apply_slurm_reservations(df, df_reservation))
+        print("  {}: {:,} rows, {:.1f} MB, apply_slurm_reservations {:.1f} ms".format(
+            label, df.shape[0], num_bytes / 1e6, elapsed * 1000))
+    elapsed = _best_of(lambda: get_slurm_partition_view(node_table))
+    print("  get_slurm_partition_view: {:.1f} ms".format(elapsed * 1000))
+
+
+def bench_reservation_calendar(num_nodes=20000, num_reservation_per_node=10, walltimes_h=(0, 24, 168)):
+    # Rolling per-node reservations, one every 12 hours for 4 hours, queried for
+    # the capacity left to a job of each walltime.
+    now = 1800000000.0
+    num_rows = num_nodes * num_reservation_per_node
+    print("reservation calendar, {:,} nodes x {} reservations:".format(num_nodes, num_reservation_per_node))
+    df_reservation = pandas.DataFrame({
+        "node_name": ["n{:06d}".format(i % num_nodes) for i in range(num_rows)],
+        "reserved_cores": [8] * num_rows,
+        "reserved_mem_mb_effective": [8000] * num_rows,
+        "start_time": [now + 12 * 3600 * (i // num_nodes) for i in range(num_rows)],
+        "end_time": [now + 12 * 3600 * (i // num_nodes) + 4 * 3600 for i in range(num_rows)],
+        "is_active": [(i // num_nodes)==0 for i in range(num_rows)],
+    })
+    elapsed = _best_of(lambda: build_reservation_calendar(df_reservation, ["node_name"], now))
+    print("  build_reservation_calendar: {:.1f} ms".format(elapsed * 1000))
+    calendar = build_reservation_calendar(df_reservation, ["node_name"], now)
+    for walltime_h in walltimes_h:
+        elapsed = _best_of(lambda: query_reservation_calendar(calendar, now, now + walltime_h * 3600))
+        print("  query, walltime {} h: {:.1f} ms, {:.2f} us/node".format(walltime_h, elapsed * 1000, elapsed / num_nodes * 1e6))
+
+
+def bench_slurm_sources(latency_s=0.5):
+    # Each scheduler command is replaced by a fixture read that first sleeps
+    # for latency_s, standing in for a round trip to a loaded slurmctld.
+    fixtures = {
+        "squeue": "squeue_notrunc.txt",
+        "scontrol show partition": "scontrol_show_partition_o.txt",
+        "scontrol show node": "scontrol_show_node_o.txt",
+        "scontrol show reservation": None,
+        "sprio": None,
+    }
+    iter_command_stdout_lines = kfbatch.stat.iter_command_stdout_lines
+
+    def slow_iter_command_stdout_lines(command_str, **kwargs):
+        time.sleep(latency_s)
+        for prefix, path in fixtures.items():
+            if command_str.startswith(prefix):
+                return _read_lines(path) if path is not None else []
+        return None
+
+    args = SimpleNamespace(
+        stat_command="squeue", example_file="", out="", partition="", user="",
+        slurm_partition_command="scontrol show partition -o", slurm_partition_example_file="",
+        slurm_node_command="scontrol show node -o", slurm_node_example_file="",
+        slurm_reservation_command="scontrol show reservation", slurm_reservation_example_file="",
+        slurm_prio_command="sprio", slurm_prio_example_file="",
+    )
+    print("SLURM commands with {:.1f} s latency each:".format(latency_s))
+    kfbatch.stat.iter_command_stdout_lines = slow_iter_command_stdout_lines
+    try:
+        for label, max_workers in [("one after another", 1), ("concurrent", kfbatch.stat.SLURM_SOURCE_THREADS)]:
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                sources = submit_slurm_sources(args, executor, with_reservation=True, with_prio=True)
+                for future in sources.values():
+                    future.result()
+            print("  {}: {:.2f} s".format(label, time.perf_counter() - start))
+    finally:
+        kfbatch.stat.iter_command_stdout_lines = iter_command_stdout_lines
+
+
+def bench_squeue_memory(num_jobs=500000):
+    print("Resident size of the squeue job table for {:,} synthetic jobs:".format(num_jobs))
+    lines = make_synthetic_squeue_lines(num_jobs)
+    df_full = get_squeue_user_df(lines)
+    df_object = df_full.astype({col: object for col in df_full.columns if isinstance(df_full[col].dtype, pandas.CategoricalDtype)})
+    df_compact = get_squeue_user_df(lines, detail_columns=False)
+    for label, df in [("object columns", df_object), ("categorical, --out", df_full), ("categorical, compact", df_compact)]:
+        num_bytes = df.memory_usage(deep=True).sum()
+        elapsed = _best_of(lambda: (
+            df["state"].isin(["PD", "CF"]).sum(),
+            (df["user"] == "tanaka").sum(),
+            (df["partition"] == "epyc").sum(),
+        ))
+        print("  {}: {:.1f} MB, {:.1f} ms for state/user/partition masks".format(label, num_bytes / 1e6, elapsed * 1000))
+
+
+def bench_squeue_counts(num_jobs=1000000):
+    print("Job-count line from {:,} synthetic squeue rows, per-job table vs. streaming counters:".format(num_jobs))
+    lines = make_synthetic_squeue_lines(num_jobs)
+    for label, func in [
+        ("get_squeue_user_df", lambda: get_squeue_user_df(lines)),
+        ("get_squeue_job_counts", lambda: get_squeue_job_counts(iter(lines))),
+    ]:
+        elapsed = _best_of(func, repeat=1)
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  {}: {:.2f} s, peak {:.1f} MB".format(label, elapsed, peak / 1e6))
+
+
+def _iter_synthetic_squeue_json_lines(num_jobs, template_path="data/slurm_json/squeue.json"):
+    with open(REPO_ROOT / template_path) as fh:
+        jobs = json.load(fh)["jobs"]
+    yield '{\n  "jobs": [\n'
+    for i in range(num_jobs):
+        job = dict(jobs[i % len(jobs)])
+        job["job_id"] = 20000000 + i
+        text = json.dumps(job, indent=2)
+        if i < num_jobs - 1:
+            text += ","
+        for line in text.split("\n"):
+            yield "    " + line + "\n"
+    yield '  ],\n  "warnings": [],\n  "errors": []\n}\n'
+
+
+def bench_squeue_json(sizes=(10000, 50000)):
+    print("get_squeue_json_user_df streaming synthetic squeue --json output:")
+    for size in sizes:
+        num_bytes = sum(len(line) for line in _iter_synthetic_squeue_json_lines(size))
+        elapsed = _best_of(lambda: get_squeue_json_user_df(_iter_synthetic_squeue_json_lines(size)), repeat=1)
+        tracemalloc.start()
+        get_squeue_json_user_df(_iter_synthetic_squeue_json_lines(size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  {:,} jobs, {:.0f} MB of JSON: {:.2f} s, {:.1f} MB/s, peak {:.1f} MB".format(
+            size, num_bytes / 1e6, elapsed, num_bytes / elapsed / 1e6, peak / 1e6))
+
+
+def _iter_synthetic_qacct_lines(num_records):
+    for i in range(num_records):
+        yield "=" * 62 + "\n"
+        yield "qname        q{}.q\n".format(i % 8)
+        yield "hostname     node{:04d}\n".format(i % 1000)
+        yield "owner        user{}\n".format(i % 50)
+        yield "jobname      job{}\n".format(i)
+        yield "jobnumber    {}\n".format(1000000 + i)
+        yield "qsub_time    02/11/2023 10:00:00.000\n"
+        yield "start_time   02/11/2023 {:02d}:{:02d}:00.000\n".format(10 + i % 12, i % 60)
+        yield "end_time     02/11/2023 23:00:00.000\n"
+        yield "slots        {}\n".format(1 + i % 16)
+        yield "failed       0\n"
+        yield "exit_status  0\n"
+        yield "ru_wallclock 3600.000s\n"
+        yield "maxvmem      1.234GB\n"
+
+
+def bench_acct_stream(sizes=(50000, 200000)):
+    print("get_acct_summary_df streaming synthetic qacct -j records (peak memory should stay flat):")
+    for size in sizes:
+        elapsed = _best_of(lambda: get_acct_summary_df(_iter_synthetic_qacct_lines(size)), repeat=1)
+        tracemalloc.start()
+        get_acct_summary_df(_iter_synthetic_qacct_lines(size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("  {:,} records: {:.2f} s, {:.1f} us/record, peak {:.1f} MB".format(
+            size, elapsed, elapsed / size * 1e6, peak / 1e6))
+
+
+def _buffered_command_stdout_lines(command_str):
+    # The previous ingestion, which held the raw stdout, its decoded text and
+    # the split lines at once; kept for comparison.
+    command_out = subprocess.run(shlex.split(command_str), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return command_out.stdout.decode("utf8").split("\n")
+
+
+def bench_command_ingest(num_jobs=500000, num_nodes=50000):
+    print("Reading scheduler output through a pipe and parsing it (buffered vs streamed):")
+    cases = [
+        ("squeue, {:,} jobs".format(num_jobs), make_synthetic_squeue_lines(num_jobs), get_squeue_user_df),
+        ("scontrol node, {:,} nodes".format(num_nodes), make_scaled_scontrol_node_lines(num_nodes), get_scontrol_node_table),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for label, lines, parse in cases:
+            path = pathlib.Path(tmpdir) / "stdout.txt"
+            path.write_text("".join(lines))
+            del lines
+            command_str = "cat {}".format(shlex.quote(str(path)))
+            runs = [
+                ("buffered", lambda: parse(_buffered_command_stdout_lines(command_str))),
+                ("streamed", lambda: parse_command_stdout(parse, command_str=command_str)),
+            ]
+            print("  {} ({:.1f} MB of output):".format(label, path.stat().st_size / 1e6))
+            for run_label, run in runs:
+                elapsed = _best_of(run, repeat=1)
+                tracemalloc.start()
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print("    {}: {:.2f} s, peak {:.1f} MB".format(run_label, elapsed, peak / 1e6))
+
+
+def bench_command_cache(num_runs=16, latency_s=0.5):
+    # num_runs kfbatch runs start at once against one command that takes latency_s;
+    # each run has its own budget, as separate processes would.
+    print("{} simultaneous runs of a command with {:.1f} s latency:".format(num_runs, latency_s))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        counter_path = pathlib.Path(tmpdir) / "counter"
+        code = "import time; open({!r}, 'a').write('x'); time.sleep({}); print('out')".format(str(counter_path), latency_s)
+        command_str = "{} -c {}".format(shlex.quote(sys.executable), shlex.quote(code))
+        for label, cache_dir in [("without --cache_dir", ""), ("with --cache_dir", str(pathlib.Path(tmpdir) / "cache"))]:
+            counter_path.write_text("")
+
+            def run(i):
+                budget = kfbatch.stat.get_command_budget(SimpleNamespace(cache_dir=cache_dir, cache_ttl=60.0))
+                return parse_command_stdout(list, command_str=command_str, budget=budget)
+
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=num_runs) as executor:
+                list(executor.map(run, range(num_runs)))
+            elapsed = time.perf_counter() - start
+            print("  {}: command ran {}x, {:.2f} s".format(label, len(counter_path.read_text()), elapsed))
+
+
+BENCHMARKS = {
+    "qstat_fixtures": bench_qstat_fixtures,
+    "qstat_scaling": bench_qstat_scaling,
+    "qstat_xml_vs_text": bench_qstat_xml_vs_text,
+    "uge_array_slots": bench_uge_array_slots,
+    "uge_sample_merge": bench_uge_sample_merge,
+    "topology_sockets": bench_topology_sockets,
+    "acct_stream": bench_acct_stream,
+    "squeue_scaling": bench_squeue_scaling,
+    "scontrol_tokenizer": bench_scontrol_tokenizer,
+    "hostlist": bench_hostlist,
+    "slurm_node_table": bench_slurm_node_table,
+    "reservation_calendar": bench_reservation_calendar,
+    "slurm_sources": bench_slurm_sources,
+    "command_ingest": bench_command_ingest,
+    "command_cache": bench_command_cache,
+    "squeue_memory": bench_squeue_memory,
+    "squeue_counts": bench_squeue_counts,
+    "squeue_json": bench_squeue_json,
+}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+    names = argv[1:] if len(argv) > 1 else list(BENCHMARKS.keys())
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark: {}. Choose from: {}".format(name, ", ".join(BENCHMARKS.keys())), file=sys.stderr)
+            return 1
+        BENCHMARKS[name]()
+        print("")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
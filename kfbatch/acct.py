@@ -0,0 +1,228 @@
+import numpy
+import pandas
+
+from kfbatch.stat import KFBatchUsageError, _safe_int, get_command_budget, iter_command_stdout_lines
+
+QACCT_FIELDS = {
+    'qname',
+    'hostname',
+    'owner',
+    'project',
+    'department',
+    'jobnumber',
+    'qsub_time',
+    'start_time',
+    'end_time',
+    'slots',
+    'failed',
+    'exit_status',
+    'ru_wallclock',
+}
+ACCT_GROUP_FIELDS = {
+    'queue': 'qname',
+    'user': 'owner',
+    'host': 'hostname',
+    'project': 'project',
+    'department': 'department',
+}
+ACCT_CHUNK_SIZE = 50000
+# Wait times are binned on a log2 scale with 8 bins per doubling (about 9% wide)
+# from 0 s up to 2^30 s, so quantiles need a fixed amount of memory per group.
+ACCT_WAIT_BINS_PER_DOUBLING = 8
+ACCT_WAIT_NUM_BIN = 30 * ACCT_WAIT_BINS_PER_DOUBLING + 1
+ACCT_WAIT_QUANTILES = [0.5, 0.9]
+QACCT_TIME_FORMATS = ['%m/%d/%Y %H:%M:%S.%f', '%m/%d/%Y %H:%M:%S', '%a %b %d %H:%M:%S %Y']
+
+def _iter_qacct_blocks(lines, fields=QACCT_FIELDS):
+    # qacct -j prints one "key value" block per task, each opened by a line of '='.
+    # Blocks are yielded as they complete and keys outside `fields` are dropped.
+    current = {}
+    for raw_line in lines:
+        line = raw_line.strip()
+        if line.startswith('====='):
+            if current:
+                yield current
+            current = {}
+            continue
+        items = line.split(None, 1)
+        if (len(items)==0) or (items[0] not in fields):
+            continue
+        current[items[0]] = items[1].strip() if len(items)>1 else ''
+    if current:
+        yield current
+
+def _qacct_time_to_epoch(series):
+    # Never-started tasks are reported as "-/-" or as the Unix epoch; both become NaN.
+    raw = series.fillna('').astype(str).str.strip()
+    parsed = pandas.Series(pandas.NaT, index=raw.index, dtype='datetime64[ns]')
+    for time_format in QACCT_TIME_FORMATS:
+        is_missing = parsed.isna()
+        if not is_missing.any():
+            break
+        parsed.loc[is_missing] = pandas.to_datetime(raw.loc[is_missing], format=time_format, errors='coerce')
+    epoch = (parsed - pandas.Timestamp(0)).dt.total_seconds()
+    return epoch.where(epoch>0)
+
+def _wait_seconds_to_bin(wait_seconds):
+    bins = numpy.floor(numpy.log2(wait_seconds + 1.0) * ACCT_WAIT_BINS_PER_DOUBLING).astype(int)
+    return numpy.clip(bins, 0, ACCT_WAIT_NUM_BIN - 1)
+
+def _wait_bin_to_seconds(bins):
+    return numpy.power(2.0, (numpy.asarray(bins) + 0.5) / ACCT_WAIT_BINS_PER_DOUBLING) - 1.0
+
+def _new_acct_accumulator(group_cols):
+    return {
+        'group_cols': list(group_cols),
+        'keys': {},
+        'num_task': numpy.zeros(0, dtype=numpy.int64),
+        'num_failed': numpy.zeros(0, dtype=numpy.int64),
+        'slot_hours': numpy.zeros(0, dtype=float),
+        'num_wait': numpy.zeros(0, dtype=numpy.int64),
+        'wait_sum': numpy.zeros(0, dtype=float),
+        'wait_max': numpy.zeros(0, dtype=float),
+        'wait_hist': numpy.zeros((0, ACCT_WAIT_NUM_BIN), dtype=numpy.int64),
+        'first_submit': numpy.zeros(0, dtype=float),
+        'last_end': numpy.zeros(0, dtype=float),
+    }
+
+def _grow_acct_accumulator(accumulator, num_group):
+    num_old = accumulator['num_task'].shape[0]
+    if num_group<=num_old:
+        return
+    num_new = num_group - num_old
+    for key in ['num_task', 'num_failed', 'slot_hours', 'num_wait', 'wait_sum', 'wait_max']:
+        accumulator[key] = numpy.concatenate([accumulator[key], numpy.zeros(num_new, dtype=accumulator[key].dtype)])
+    accumulator['wait_hist'] = numpy.vstack([
+        accumulator['wait_hist'], numpy.zeros((num_new, ACCT_WAIT_NUM_BIN), dtype=numpy.int64),
+    ])
+    accumulator['first_submit'] = numpy.concatenate([accumulator['first_submit'], numpy.full(num_new, numpy.inf)])
+    accumulator['last_end'] = numpy.concatenate([accumulator['last_end'], numpy.full(num_new, -numpy.inf)])
+
+def _update_acct_accumulator(accumulator, records):
+    if len(records)==0:
+        return
+    group_cols = accumulator['group_cols']
+    df = pandas.DataFrame(records)
+    for col in QACCT_FIELDS:
+        if col not in df.columns:
+            df[col] = ''
+    df = df.fillna('')
+    keys = accumulator['keys']
+    group_keys = zip(*[df[ACCT_GROUP_FIELDS[col]].tolist() for col in group_cols])
+    rows = numpy.array([keys.setdefault(key, len(keys)) for key in group_keys], dtype=numpy.int64)
+    _grow_acct_accumulator(accumulator, len(keys))
+    slots = df['slots'].map(lambda value: _safe_int(value, default=1)).to_numpy()
+    failed = (df['failed'].str.split().str[0].fillna('0')!='0') | ~df['exit_status'].str.strip().isin(['', '0'])
+    submit = _qacct_time_to_epoch(df['qsub_time']).to_numpy()
+    start = _qacct_time_to_epoch(df['start_time']).to_numpy()
+    end = _qacct_time_to_epoch(df['end_time']).to_numpy()
+    wallclock = pandas.to_numeric(df['ru_wallclock'].str.replace(r's$', '', regex=True), errors='coerce').to_numpy()
+    wallclock = numpy.where(numpy.isnan(wallclock), end - start, wallclock)
+    wallclock = numpy.nan_to_num(wallclock, nan=0.0).clip(min=0.0)
+    numpy.add.at(accumulator['num_task'], rows, 1)
+    numpy.add.at(accumulator['num_failed'], rows, failed.to_numpy().astype(numpy.int64))
+    numpy.add.at(accumulator['slot_hours'], rows, slots * wallclock / 3600)
+    wait = start - submit
+    has_wait = ~numpy.isnan(wait)
+    wait_rows = rows[has_wait]
+    wait = wait[has_wait].clip(min=0.0)
+    numpy.add.at(accumulator['num_wait'], wait_rows, 1)
+    numpy.add.at(accumulator['wait_sum'], wait_rows, wait)
+    numpy.maximum.at(accumulator['wait_max'], wait_rows, wait)
+    numpy.add.at(accumulator['wait_hist'], (wait_rows, _wait_seconds_to_bin(wait)), 1)
+    has_submit = ~numpy.isnan(submit)
+    numpy.minimum.at(accumulator['first_submit'], rows[has_submit], submit[has_submit])
+    has_end = ~numpy.isnan(end)
+    numpy.maximum.at(accumulator['last_end'], rows[has_end], end[has_end])
+
+def _acct_wait_quantile_hours(wait_hist, num_wait, wait_max, quantile):
+    cumsum = wait_hist.cumsum(axis=1)
+    target = numpy.ceil(num_wait * quantile).clip(min=1)
+    bins = (cumsum < target[:, None]).sum(axis=1)
+    seconds = numpy.minimum(_wait_bin_to_seconds(bins), wait_max)
+    return numpy.where(num_wait>0, seconds / 3600, numpy.nan)
+
+def _finalize_acct_accumulator(accumulator):
+    group_cols = accumulator['group_cols']
+    columns = group_cols + ['num_task', 'num_failed', 'slot_hours', 'wait_mean_h'] + \
+        ['wait_p{:.0f}_h'.format(q * 100) for q in ACCT_WAIT_QUANTILES] + ['wait_max_h', 'tasks_per_day']
+    if len(accumulator['keys'])==0:
+        return pandas.DataFrame(columns=columns)
+    df = pandas.DataFrame(list(accumulator['keys'].keys()), columns=group_cols)
+    num_wait = accumulator['num_wait']
+    df['num_task'] = accumulator['num_task']
+    df['num_failed'] = accumulator['num_failed']
+    df['slot_hours'] = accumulator['slot_hours']
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        df['wait_mean_h'] = numpy.where(num_wait>0, accumulator['wait_sum'] / num_wait / 3600, numpy.nan)
+    for q in ACCT_WAIT_QUANTILES:
+        df['wait_p{:.0f}_h'.format(q * 100)] = _acct_wait_quantile_hours(
+            accumulator['wait_hist'], num_wait, accumulator['wait_max'], q)
+    df['wait_max_h'] = numpy.where(num_wait>0, accumulator['wait_max'] / 3600, numpy.nan)
+    span_days = (accumulator['last_end'] - accumulator['first_submit']) / 86400
+    with numpy.errstate(invalid='ignore'):
+        df['tasks_per_day'] = numpy.where(numpy.isfinite(span_days) & (span_days>0), df['num_task'] / span_days, numpy.nan)
+    return df.sort_values(by=group_cols).reset_index(drop=True).loc[:, columns]
+
+def get_acct_group_cols(acct_group_by):
+    group_cols = [col.strip() for col in str(acct_group_by).split(',') if col.strip()!='']
+    unknown = [col for col in group_cols if col not in ACCT_GROUP_FIELDS]
+    if (len(group_cols)==0) or (len(unknown)>0):
+        txt = '--acct_group_by should be a comma-separated subset of {}: {}'
+        raise KFBatchUsageError(txt.format(','.join(ACCT_GROUP_FIELDS.keys()), acct_group_by))
+    return group_cols
+
+def get_acct_summary_df(lines, group_cols=('queue', 'user'), chunk_size=ACCT_CHUNK_SIZE):
+    accumulator = _new_acct_accumulator(group_cols)
+    records = []
+    for record in _iter_qacct_blocks(lines):
+        records.append(record)
+        if len(records)>=chunk_size:
+            _update_acct_accumulator(accumulator, records)
+            records = []
+    _update_acct_accumulator(accumulator, records)
+    return _finalize_acct_accumulator(accumulator)
+
+def _format_acct_hours(value):
+    if pandas.isna(value):
+        return '-'
+    return '{:,.1f}'.format(value)
+
+def print_acct_summary(df_acct):
+    if df_acct.shape[0]==0:
+        print('No accounting records found.')
+        return
+    group_cols = [col for col in df_acct.columns if col in ACCT_GROUP_FIELDS]
+    columns = group_cols + ['tasks', 'failed', 'slot_h', 'wait_mean_h', 'wait_p50_h', 'wait_p90_h', 'wait_max_h', 'tasks/day']
+    rows = []
+    for i in df_acct.index:
+        row = {col: str(df_acct.at[i, col]) for col in group_cols}
+        row['tasks'] = '{:,}'.format(int(df_acct.at[i, 'num_task']))
+        row['failed'] = '{:,}'.format(int(df_acct.at[i, 'num_failed']))
+        row['slot_h'] = '{:,.0f}'.format(float(df_acct.at[i, 'slot_hours']))
+        for col in ['wait_mean_h', 'wait_p50_h', 'wait_p90_h', 'wait_max_h']:
+            row[col] = _format_acct_hours(df_acct.at[i, col])
+        row['tasks/day'] = _format_acct_hours(df_acct.at[i, 'tasks_per_day'])
+        rows.append(row)
+    widths = {}
+    for col in columns:
+        widths[col] = len(col)
+        for row in rows:
+            widths[col] = max(widths[col], len(row[col]))
+    print('  '.join([col.ljust(widths[col]) for col in columns]))
+    for row in rows:
+        print('  '.join([row[col].ljust(widths[col]) for col in columns]))
+    print('')
+    print('legend: wait = start_time - qsub_time, quantiles are approximate (~9% bins)')
+    print('')
+
+def acct_main(args):
+    group_cols = get_acct_group_cols(args.acct_group_by)
+    lines = iter_command_stdout_lines(command_str=args.acct_command,
+                                      example_file=args.acct_example_file,
+                                      command_name='--acct_command',
+                                      budget=get_command_budget(args))
+    df_acct = get_acct_summary_df(lines, group_cols=group_cols)
+    print_acct_summary(df_acct)
+    if args.out!='':
+        df_acct.to_csv(args.out, sep='\t', index=False)
@@ -0,0 +1,164 @@
+import bisect
+import re
+
+# SLURM hostlist expressions such as "a[001-064,070],gpu[1-4]-ib,login1" are
+# kept as integer ranges: (prefix, suffix, width, start, end), where numbers are
+# zero-padded to `width` digits. Names without a bracket are ranges of width -1.
+HOSTNAME_NUMBER_PATTERN = re.compile(r'^(.*?)([0-9]+)([^0-9]*)$')
+HOSTNAME_DIGITS_PATTERN = re.compile(r'[0-9]+')
+
+def _split_hostlist_items(expr):
+    # Commas inside brackets separate ranges, not host names.
+    items = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(expr):
+        if char=='[':
+            depth += 1
+        elif char==']':
+            depth -= 1
+        elif (char==',') and (depth==0):
+            items.append(expr[start:i])
+            start = i + 1
+    items.append(expr[start:])
+    return [ item.strip() for item in items if item.strip()!='' ]
+
+def _parse_hostlist_item(item):
+    open_pos = item.find('[')
+    if open_pos<0:
+        return [(item, '', -1, 0, 0)]
+    close_pos = item.find(']', open_pos)
+    if close_pos<0:
+        raise ValueError('Unbalanced bracket in hostlist: {}'.format(item))
+    prefix = item[:open_pos]
+    suffix = item[close_pos+1:]
+    ranges = []
+    for range_txt in item[open_pos+1:close_pos].split(','):
+        start_txt, _, end_txt = range_txt.strip().partition('-')
+        if end_txt=='':
+            end_txt = start_txt
+        if (not start_txt.isdigit()) or (not end_txt.isdigit()) or (int(end_txt)<int(start_txt)):
+            raise ValueError('Invalid range in hostlist: {}'.format(item))
+        ranges.append((int(start_txt), int(end_txt), len(start_txt)))
+    if '[' not in suffix:
+        return [ (prefix, suffix, width, start, end) for start, end, width in ranges ]
+    # Multi-dimensional names such as "rack[1-2]-node[01-04]" are unrolled along
+    # the first bracket so that every range has a single numeric field.
+    out = []
+    for start, end, width in ranges:
+        for number in range(start, end+1):
+            head = prefix + str(number).zfill(width)
+            out.extend([ (head + p, s, w, a, b) for p, s, w, a, b in _parse_hostlist_item(suffix) ])
+    return out
+
+def parse_hostlist(expr):
+    ranges = []
+    for item in _split_hostlist_items(str(expr)):
+        ranges.extend(_parse_hostlist_item(item))
+    return ranges
+
+def hostlist_size(expr):
+    return sum([ end - start + 1 for _, _, _, start, end in parse_hostlist(expr) ])
+
+def iter_hostlist(expr):
+    for prefix, suffix, width, start, end in parse_hostlist(expr):
+        if width<0:
+            yield prefix
+            continue
+        for number in range(start, end+1):
+            yield prefix + str(number).zfill(width) + suffix
+
+def is_hostlist(txt):
+    return ('[' in txt) or (',' in txt)
+
+def _split_hostname(name):
+    m = HOSTNAME_NUMBER_PATTERN.match(name)
+    if m is None:
+        return None
+    return m.group(1), m.group(2), m.group(3)
+
+def build_hostlist_index(node_names):
+    # Maps (prefix, suffix) to sorted node numbers and their positions in
+    # node_names so that a range is resolved with two bisections. A name is
+    # indexed under every digit run, since the bracket of a hostlist may stand
+    # for any of them (e.g. "gpu[1-4]-n0" or "rack1-node[01-04]").
+    by_stem = {}
+    exact = {}
+    for pos, name in enumerate(node_names):
+        exact.setdefault(name, []).append(pos)
+        for m in HOSTNAME_DIGITS_PATTERN.finditer(name):
+            stem = (name[:m.start()], name[m.end():])
+            by_stem.setdefault(stem, []).append((int(m.group(0)), m.group(0), pos))
+    index = {'exact': exact, 'stems': {}}
+    for stem, entries in by_stem.items():
+        entries.sort()
+        index['stems'][stem] = (
+            [ entry[0] for entry in entries ],
+            [ entry[1] for entry in entries ],
+            [ entry[2] for entry in entries ],
+        )
+    return index
+
+def intersect_hostlist(expr, index):
+    # Returns the positions of indexed nodes covered by `expr` without expanding
+    # the expression, in the order of the hostlist ranges.
+    positions = []
+    for prefix, suffix, width, start, end in parse_hostlist(expr):
+        if width<0:
+            positions.extend(index['exact'].get(prefix, []))
+            continue
+        stem = index['stems'].get((prefix, suffix))
+        if stem is None:
+            # Every digit run is indexed, so a missing stem means no match unless
+            # the bracket covers only part of a run (e.g. "n1[2-3]"); those
+            # names are looked up one by one.
+            if prefix[-1:].isdigit() or suffix[:1].isdigit():
+                for number in range(start, end+1):
+                    positions.extend(index['exact'].get(prefix + str(number).zfill(width) + suffix, []))
+            continue
+        numbers, digits, stem_positions = stem
+        lo = bisect.bisect_left(numbers, start)
+        hi = bisect.bisect_right(numbers, end)
+        for i in range(lo, hi):
+            if digits[i]==str(numbers[i]).zfill(width):
+                positions.append(stem_positions[i])
+    return positions
+
+def compress_hostlist(node_names):
+    # Inverse of iter_hostlist: names sharing a prefix and suffix are merged into
+    # one bracket of consecutive runs, e.g. a001,a002,a003,a007 -> a[001-003,007].
+    stems = {}
+    order = []
+    for name in dict.fromkeys(node_names):
+        split = _split_hostname(name)
+        stem = (name, None) if split is None else (split[0], split[2])
+        if stem not in stems:
+            stems[stem] = []
+            order.append(stem)
+        if split is not None:
+            stems[stem].append((int(split[1]), split[1]))
+    items = []
+    for stem in order:
+        prefix, suffix = stem
+        if suffix is None:
+            items.append(prefix)
+            continue
+        runs = []
+        for number, digits in sorted(stems[stem]):
+            if runs:
+                run = runs[-1]
+                if (number==run[1]+1) and (digits==str(number).zfill(run[2])):
+                    run[1] = number
+                    continue
+            runs.append([number, number, len(digits)])
+        if (len(runs)==1) and (runs[0][0]==runs[0][1]):
+            items.append(prefix + str(runs[0][0]).zfill(runs[0][2]) + suffix)
+            continue
+        range_txts = []
+        for start, end, width in runs:
+            if start==end:
+                range_txts.append(str(start).zfill(width))
+            else:
+                range_txts.append('{}-{}'.format(str(start).zfill(width), str(end).zfill(width)))
+        items.append('{}[{}]{}'.format(prefix, ','.join(range_txts), suffix))
+    return ','.join(items)
@@ -1,10 +1,24 @@
+import numpy
 import pandas
 
+import concurrent.futures
+import contextlib
+import csv
+import fcntl
 import getpass
+import hashlib
+import io
+import json
 import os
 import re
 import shlex
 import subprocess
+import tempfile
+import threading
+import time
+from xml.etree import ElementTree
+
+from kfbatch.hostlist import build_hostlist_index, compress_hostlist, hostlist_size, intersect_hostlist, is_hostlist
 
 class KFBatchError(Exception):
     pass
@@ -15,6 +29,11 @@ class KFBatchUsageError(KFBatchError):
 class KFBatchCommandError(KFBatchError):
     pass
 
+class KFBatchCommandTimeout(KFBatchCommandError):
+    def __init__(self, message, elapsed=0.0):
+        super().__init__(message)
+        self.elapsed = elapsed
+
 SLURM_RUNNING_STATES = {'R', 'CG'}
 SLURM_PENDING_STATES = {'PD', 'CF'}
 SLURM_ERROR_STATES = {
@@ -48,6 +67,13 @@ SLURM_STATE_NAME_TO_CODE = {
     'TIMEOUT': 'TO',
 }
 SLURM_NORMAL_NODE_STATES = {'IDLE', 'MIXED', 'ALLOCATED', 'COMPLETING'}
+# squeue, scontrol show partition/node/reservation and sprio run side by side.
+SLURM_SOURCE_THREADS = 5
+CACHE_LOCK_POLL_INTERVAL = 0.05
+# Outputs that are the same whoever runs the command, so --cache_dir shares them
+# across users. Everything else (e.g. qstat -F, which lists the caller's jobs,
+# or squeue under PrivateData=jobs) is cached per user.
+CACHE_SHARED_SCONTROL_ENTITIES = {'node', 'nodes', 'partition', 'partitions', 'reservation', 'reservations'}
 SLURM_UNAVAILABLE_NODE_FLAGS = {
     'DRAIN',
     'DRAINING',
@@ -64,6 +90,30 @@ SLURM_UNAVAILABLE_NODE_FLAGS = {
     'RESERVED',
 }
 SLURM_SQUEUE_PARSE_FIELDS = '%i\t%P\t%j\t%u\t%t\t%M\t%D\t%C\t%m\t%l\t%R'
+SLURM_SQUEUE_COLUMNS = [
+    'job_id',
+    'partition',
+    'name',
+    'user',
+    'state',
+    'elapsed_time',
+    'num_nodes',
+    'req_cpus',
+    'req_mem',
+    'time_limit',
+    'node_or_reason',
+    'pending_reason',
+    'resource_fields_complete',
+    'total_slots',
+    'task_count_estimated',
+]
+# Low-cardinality squeue columns are stored as categoricals so that the
+# equality and isin masks over them compare integer codes. Columns whose values
+# are mapped to numbers and sorted (req_mem, time_limit) stay object, since a
+# mapped categorical would sort by category code.
+SLURM_SQUEUE_CATEGORY_COLUMNS = ['partition', 'user', 'state', 'pending_reason']
+# Columns that nothing downstream reads; kept only when the job table is written out.
+SLURM_SQUEUE_DETAIL_COLUMNS = ['name', 'elapsed_time', 'node_or_reason']
 QSTAT_REQUIRED_NODE_FIELDS = {
     'queue_name',
     'node_name',
@@ -75,40 +125,31 @@ QSTAT_REQUIRED_NODE_FIELDS = {
     'arch',
     'status',
 }
+QSTAT_RESOURCE_NAMES = ['mem_req', 'mem_total', 'm_topology_inuse']
+QSTAT_RESOURCE_KEYS = {'hc:mem_req', 'hl:mem_total', 'hl:m_topology_inuse'}
 
 
-def _count_uge_task_expression(task_expression):
-    if task_expression=='':
-        return 1
-    num_tasks = 0
-    for token in task_expression.split(','):
-        token = token.strip()
-        if token=='':
-            continue
-        m = re.match(r'^([0-9]+)-([0-9]+):([0-9]+)$', token)
-        if m:
-            start = int(m.group(1))
-            end = int(m.group(2))
-            step = int(m.group(3))
-            if (step<=0) or (end<start):
-                continue
-            num_tasks += int((end - start) / step) + 1
-            continue
-        m = re.match(r'^([0-9]+)-([0-9]+)$', token)
-        if m:
-            start = int(m.group(1))
-            end = int(m.group(2))
-            if end<start:
-                continue
-            num_tasks += int(end - start) + 1
-            continue
-        if re.match(r'^[0-9]+$', token):
-            num_tasks += 1
-    if num_tasks==0:
-        return 1
-    return num_tasks
+def _count_uge_task_expressions(task_expressions):
+    # Each distinct expression is counted once; array jobs typically share a
+    # handful of expressions across thousands of rows.
+    expressions = task_expressions.fillna('').astype(str)
+    unique_expressions = pandas.Series(expressions.unique())
+    tokens = unique_expressions.str.extractall(r'(?:^|,)\s*([0-9]+)(?:-([0-9]+)(?::([0-9]+))?)?\s*(?=,|$)')
+    num_tasks = numpy.zeros(unique_expressions.shape[0], dtype=numpy.int64)
+    if tokens.shape[0]>0:
+        start = tokens[0].astype(numpy.int64).to_numpy()
+        end = pandas.to_numeric(tokens[1]).fillna(tokens[0].astype(numpy.int64)).astype(numpy.int64).to_numpy()
+        step = pandas.to_numeric(tokens[2]).fillna(1).astype(numpy.int64).to_numpy()
+        is_valid = (step>0) & (end>=start)
+        token_counts = numpy.zeros(start.shape[0], dtype=numpy.int64)
+        token_counts[is_valid] = ((end[is_valid] - start[is_valid]) // step[is_valid]) + 1
+        expression_index = tokens.index.get_level_values(0).to_numpy()
+        numpy.add.at(num_tasks, expression_index, token_counts)
+    num_tasks[num_tasks==0] = 1
+    task_counts = dict(zip(unique_expressions.tolist(), num_tasks.tolist()))
+    return expressions.map(task_counts).astype(numpy.int64)
 
-def get_qstat_df(lines):
+def _finalize_qstat_rows(rows):
     columns = [
         'queue_name',
         'node_name',
@@ -123,29 +164,72 @@ def get_qstat_df(lines):
         'hl:mem_total',
         'ncore_available',
     ]
-    lines = [ re.sub('\n$', '', l) for l in lines ]
-    lines = [ l for l in lines if l!='' ]
-    lines = [ l for l in lines if not l.startswith('queuename') ]
-    lines = [ l for l in lines if not l.startswith('---') ]
-    lines = [ l for l in lines if not l.startswith('###') ]
-    lines = [ l for l in lines if not l.startswith(' ') ]
-    lines = [ l for l in lines if not l.startswith('\n') ]
+    df = pandas.DataFrame(rows)
+    if df.shape[0]==0:
+        return pandas.DataFrame(columns=columns)
+    for col in ['ncore_resv','ncore_used','ncore_total']:
+        df[col] = df[col].astype(int)
+    for mem_col in ['hc:mem_req', 'hl:mem_total']:
+        if mem_col not in df.columns:
+            df[mem_col] = '0G'
+        df[mem_col] = df[mem_col].fillna('0G').astype(str)
+        is_empty = (df[mem_col].str.strip()=='')
+        if is_empty.sum():
+            df.loc[is_empty, mem_col] = '0G'
+    ncore_available = df['ncore_total'] - df['ncore_used'] - df['ncore_resv']
+    ncore_available = ncore_available.clip(lower=0)
+    tmp = pandas.DataFrame({'ncore_available': ncore_available.astype(int)})
+    df = pandas.concat([df, tmp], axis=1)
+    if 'hl:m_topology_inuse' in df.columns:
+        socket_free, socket_max = _topology_socket_free_cores(df['hl:m_topology_inuse'])
+        df['ncore_socket_free'] = socket_free
+        df['ncore_socket_max'] = socket_max
+    df = df.sort_values(by=['queue_name','node_name']).reset_index(drop=True)
+    return df
+
+def _topology_socket_free_cores(topologies):
+    # UGE topology strings mark each socket with S and each core with C (free)
+    # or c (bound by a job). All strings are scanned as one byte buffer so the
+    # per-socket counts come from a few array operations rather than a node loop.
+    txt = topologies.fillna('').astype(str).tolist()
+    num_node = len(txt)
+    lengths = numpy.array([ len(t) for t in txt ], dtype=numpy.int64)
+    buf = numpy.frombuffer(''.join(txt).encode('ascii', 'replace'), dtype=numpy.uint8)
+    node_id = numpy.repeat(numpy.arange(num_node), lengths)
+    is_socket = (buf==ord('S'))
+    socket_node = node_id[is_socket]
+    socket_id = numpy.cumsum(is_socket) - 1
+    is_counted = (buf==ord('C')) & (socket_id>=0)
+    is_counted[is_counted] = (socket_node[socket_id[is_counted]]==node_id[is_counted])
+    free_per_socket = numpy.bincount(socket_id[is_counted], minlength=socket_node.shape[0])
+    num_socket = numpy.bincount(socket_node, minlength=num_node)
+    socket_max = numpy.zeros(num_node, dtype=numpy.int64)
+    has_socket = (num_socket>0)
+    socket_start = numpy.cumsum(num_socket) - num_socket
+    if has_socket.any():
+        socket_max[has_socket] = numpy.maximum.reduceat(free_per_socket, socket_start[has_socket])
+    socket_free = [ '/'.join(map(str, counts)) for counts in numpy.split(free_per_socket, socket_start[1:]) ]
+    return socket_free, socket_max
+
+def get_qstat_df(lines, resource_keys=QSTAT_RESOURCE_KEYS):
+    rows = []
     node_params = {}
-    df = pandas.DataFrame()
-    for line in lines:
+    for raw_line in lines:
+        line = raw_line[:-1] if raw_line.endswith('\n') else raw_line
+        if (line=='') or line.startswith(('queuename', '---', '###', ' ', '\n')):
+            continue
         if not line.startswith('\t'):
-            if QSTAT_REQUIRED_NODE_FIELDS.issubset(set(node_params.keys())):
-                tmp = pandas.DataFrame(node_params, index=[0,])
-                df = pandas.concat([df,tmp], axis=0, ignore_index=True)
+            if QSTAT_REQUIRED_NODE_FIELDS.issubset(node_params.keys()):
+                rows.append(node_params)
             node_params = {}
-            items = [ item for item in line.split(' ') if item!='' ]
+            items = line.split()
             if len(items)<5:
                 continue
             m = re.match(r'^([0-9]+)/([0-9]+)/([0-9]+)$', items[2])
             if m is None:
                 continue
-            node_params['queue_name'] = re.sub('@.*', '', items[0])
-            node_params['node_name'] = re.sub('.*@', '', items[0])
+            node_params['queue_name'] = items[0].split('@', 1)[0]
+            node_params['node_name'] = items[0].rsplit('@', 1)[-1]
             node_params['qtype'] = items[1]
             node_params['ncore_resv'] = m.group(1)
             node_params['ncore_used'] = m.group(2)
@@ -157,32 +241,94 @@ def get_qstat_df(lines):
             else:
                 node_params['status'] = ''
         else:
-            key = re.sub('\t', '', line)
-            key = re.sub('=.*', '', key)
-            value = re.sub('.*=', '', line)
+            key = line.replace('\t', '').split('=', 1)[0]
+            if (resource_keys is not None) and (key not in resource_keys):
+                continue
+            value = line.rsplit('=', 1)[-1]
             node_params[key] = value
-    if QSTAT_REQUIRED_NODE_FIELDS.issubset(set(node_params.keys())):
-        tmp = pandas.DataFrame(node_params, index=[0,])
-        df = pandas.concat([df,tmp], axis=0, ignore_index=True)
-    if df.shape[0]==0:
-        return pandas.DataFrame(columns=columns)
-    for col in ['ncore_resv','ncore_used','ncore_total']:
-        df[col] = df[col].astype(int)
-    for mem_col in ['hc:mem_req', 'hl:mem_total']:
-        if mem_col not in df.columns:
-            df[mem_col] = '0G'
-        df[mem_col] = df[mem_col].fillna('0G').astype(str)
-        is_empty = (df[mem_col].str.strip()=='')
-        if is_empty.sum():
-            df.loc[is_empty, mem_col] = '0G'
-    ncore_available = df['ncore_total'] - df['ncore_used'] - df['ncore_resv']
-    ncore_available = ncore_available.clip(lower=0)
-    tmp = pandas.DataFrame({'ncore_available': ncore_available.astype(int)})
-    df = pandas.concat([df, tmp], axis=1)
-    df = df.sort_values(by=['queue_name','node_name']).reset_index(drop=True)
-    return df
+    if QSTAT_REQUIRED_NODE_FIELDS.issubset(node_params.keys()):
+        rows.append(node_params)
+    return _finalize_qstat_rows(rows)
+
+def get_qhost_df(lines, resource_keys=QSTAT_RESOURCE_KEYS):
+    # qhost -F <resources> -q prints host-level values once per host followed by
+    # one line per queue instance; rows are expanded to the get_qstat_df schema.
+    rows = []
+    host_params = None
+    queue_rows = []
+    for raw_line in lines:
+        line = raw_line.rstrip('\n')
+        if (line.strip()=='') or line.startswith(('HOSTNAME', '---')):
+            continue
+        if not line.startswith(' '):
+            if host_params is not None:
+                rows.extend([ dict(host_params, **queue_row) for queue_row in queue_rows ])
+            host_params = None
+            queue_rows = []
+            items = line.split()
+            if (len(items)<7) or (items[0]=='global'):
+                continue
+            ncpu = _safe_int(items[2], default=0)
+            load = pandas.to_numeric(items[6], errors='coerce')
+            np_load = '' if (ncpu<=0) or pandas.isna(load) else '{:.2f}'.format(load / ncpu)
+            host_params = {'node_name': items[0], 'arch': items[1], 'np_load': np_load}
+            continue
+        if host_params is None:
+            continue
+        m = re.match(r'^\s*(?:Host Resource\(s\):)?\s*([A-Za-z]+:[^=\s]+)=(.*)$', line)
+        if m is not None:
+            if (resource_keys is None) or (m.group(1) in resource_keys):
+                host_params[m.group(1)] = m.group(2).strip()
+            continue
+        m = re.match(r'^\s+(\S+)\s+(\S+)\s+([0-9]+)/([0-9]+)/([0-9]+)\s*(\S*)\s*$', line)
+        if m is not None:
+            queue_rows.append({
+                'queue_name': m.group(1),
+                'qtype': m.group(2),
+                'ncore_resv': m.group(3),
+                'ncore_used': m.group(4),
+                'ncore_total': m.group(5),
+                'status': m.group(6),
+            })
+    if host_params is not None:
+        rows.extend([ dict(host_params, **queue_row) for queue_row in queue_rows ])
+    return _finalize_qstat_rows(rows)
+
+def get_qstat_gc_df(lines):
+    columns = [
+        'queue_name',
+        'cqload',
+        'ncore_used',
+        'ncore_resv',
+        'ncore_available',
+        'ncore_total',
+        'ncore_aoacds',
+        'ncore_cdsue',
+    ]
+    rows = []
+    for raw_line in lines:
+        items = raw_line.split()
+        if (len(items)!=8) or (not all(item.isdigit() for item in items[2:])):
+            continue
+        rows.append({
+            'queue_name': items[0],
+            'cqload': items[1],
+            'ncore_used': int(items[2]),
+            'ncore_resv': int(items[3]),
+            'ncore_available': int(items[4]),
+            'ncore_total': int(items[5]),
+            'ncore_aoacds': int(items[6]),
+            'ncore_cdsue': int(items[7]),
+        })
+    return pandas.DataFrame(rows, columns=columns)
 
 def _memory_series_to_gib(series):
+    # Memory strings repeat heavily across nodes, so each distinct string is parsed once.
+    codes, uniques = pandas.factorize(series.fillna('').astype(str), use_na_sentinel=False)
+    values = _memory_unique_series_to_gib(pandas.Series(uniques, dtype=object)).to_numpy()
+    return pandas.Series(values[codes], index=series.index, dtype=float)
+
+def _memory_unique_series_to_gib(series):
     raw = series.fillna('').astype(str).str.strip()
     units = raw.str.extract(r'([A-Za-z]+)$', expand=False).fillna('').str.upper()
     numeric_txt = raw.str.replace(r'[A-Za-z]+$', '', regex=True)
@@ -259,6 +405,14 @@ def _slurm_time_to_minutes(value):
     total_minutes = (day_part * 24 * 60) + (hours * 60) + minutes + (seconds / 60.0)
     return float(total_minutes)
 
+def get_walltime_minutes(walltime):
+    txt = str(walltime).strip()
+    if txt=='':
+        return 0
+    if re.match(r'^([0-9]+-)?[0-9]+(:[0-9]+){0,2}$', txt) is None:
+        raise KFBatchUsageError('--walltime should be a SLURM time such as 90, 12:00:00 or 3-00:00:00: {}'.format(walltime))
+    return _slurm_time_to_minutes(txt)
+
 def _extract_slurm_pending_reason(node_or_reason):
     txt = str(node_or_reason).strip()
     m = re.match(r'^\((.*)\)$', txt)
@@ -266,43 +420,99 @@ def _extract_slurm_pending_reason(node_or_reason):
         return ''
     return m.group(1).strip()
 
-def _merge_qstat_iteration_min_availability(df, df_i):
-    key_cols = ['queue_name', 'node_name']
-    if df.shape[0]==0:
-        return df_i.copy()
-    if df_i.shape[0]==0:
-        return df
-    if (not set(key_cols).issubset(set(df.columns))) or (not set(key_cols).issubset(set(df_i.columns))):
-        return df
-    df_base = df.set_index(key_cols, drop=False).copy()
-    df_new = df_i.set_index(key_cols, drop=False)
-    common_index = df_base.index.intersection(df_new.index)
-    if len(common_index)==0:
-        return df
-    base_cores = pandas.to_numeric(df_base.loc[common_index, 'ncore_available'], errors='coerce').fillna(0)
-    new_cores = pandas.to_numeric(df_new.loc[common_index, 'ncore_available'], errors='coerce').fillna(0)
-    min_cores = pandas.concat([base_cores, new_cores], axis=1).min(axis=1)
-    df_base.loc[common_index, 'ncore_available'] = min_cores.astype(int)
-    base_mem = _memory_series_to_gib(df_base.loc[common_index, 'hc:mem_req'])
-    new_mem = _memory_series_to_gib(df_new.loc[common_index, 'hc:mem_req'])
-    min_mem = pandas.concat([base_mem, new_mem], axis=1).min(axis=1)
-    df_base.loc[common_index, 'hc:mem_req'] = min_mem.map(lambda x: '{:.3f}G'.format(float(x)))
-    df_base = df_base.reset_index(drop=True)
-    df_base = df_base.sort_values(by=key_cols).reset_index(drop=True)
-    return df_base
-
-def print_stats(df):
+def _new_availability_accumulator(df, key_cols):
+    # Running per-node statistics over repeated samples, kept as NumPy arrays
+    # aligned to the first sample's rows.
+    df = df.drop_duplicates(subset=key_cols).reset_index(drop=True)
+    cores = pandas.to_numeric(df['ncore_available'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    accumulator = {
+        'df': df,
+        'key_cols': key_cols,
+        'index': pandas.MultiIndex.from_frame(df.loc[:, key_cols]),
+        'num_sample': numpy.ones(df.shape[0], dtype=numpy.int64),
+        'cores_min': cores.copy(),
+        'cores_max': cores.copy(),
+        'cores_sum': cores.copy(),
+        'mem_min': None,
+    }
+    if 'hc:mem_req' in df.columns:
+        mem = _memory_series_to_gib(df['hc:mem_req']).to_numpy(dtype=float)
+        accumulator['mem_min'] = mem.copy()
+        accumulator['mem_max'] = mem.copy()
+        accumulator['mem_sum'] = mem.copy()
+    return accumulator
+
+def _update_availability_accumulator(accumulator, df_i):
+    key_cols = accumulator['key_cols']
+    if (df_i.shape[0]==0) or (not set(key_cols).issubset(set(df_i.columns))):
+        return False
+    positions = accumulator['index'].get_indexer(pandas.MultiIndex.from_frame(df_i.loc[:, key_cols]))
+    is_known = (positions>=0)
+    positions = positions[is_known]
+    if positions.shape[0]==0:
+        return False
+    accumulator['num_sample'][positions] += 1
+    cores = pandas.to_numeric(df_i['ncore_available'], errors='coerce').fillna(0).to_numpy(dtype=float)[is_known]
+    cores_min = numpy.minimum(accumulator['cores_min'][positions], cores)
+    changed = bool((cores_min!=accumulator['cores_min'][positions]).any())
+    accumulator['cores_min'][positions] = cores_min
+    accumulator['cores_max'][positions] = numpy.maximum(accumulator['cores_max'][positions], cores)
+    accumulator['cores_sum'][positions] += cores
+    if (accumulator['mem_min'] is not None) and ('hc:mem_req' in df_i.columns):
+        mem = _memory_series_to_gib(df_i['hc:mem_req']).to_numpy(dtype=float)[is_known]
+        mem_min = numpy.minimum(accumulator['mem_min'][positions], mem)
+        changed = changed or bool((mem_min!=accumulator['mem_min'][positions]).any())
+        accumulator['mem_min'][positions] = mem_min
+        accumulator['mem_max'][positions] = numpy.maximum(accumulator['mem_max'][positions], mem)
+        accumulator['mem_sum'][positions] += mem
+    return changed
+
+def _finalize_availability_accumulator(accumulator):
+    df = accumulator['df'].copy()
+    num_sample = accumulator['num_sample']
+    df['ncore_available'] = accumulator['cores_min'].astype(int)
+    df['ncore_available_max'] = accumulator['cores_max'].astype(int)
+    df['ncore_available_mean'] = (accumulator['cores_sum'] / num_sample).round(3)
+    if accumulator['mem_min'] is not None:
+        is_resampled = (num_sample>1)
+        if is_resampled.any():
+            mem_txt = pandas.Series(accumulator['mem_min'][is_resampled]).map('{:.3f}G'.format)
+            df.loc[is_resampled, 'hc:mem_req'] = mem_txt.to_numpy()
+        df['hc:mem_req_max_gib'] = accumulator['mem_max'].round(3)
+        df['hc:mem_req_mean_gib'] = (accumulator['mem_sum'] / num_sample).round(3)
+    df['num_sample'] = num_sample
+    return df
+
+def _format_stats_line(df, i, node_name, num_node=1):
+    queue_name = df.at[i, 'queue_name']
+    num_avail_cpu = df.at[i, 'ncore_available']
+    avail_ram = df.at[i, 'hc:mem_req']
+    ram_unit = df.at[i, 'hc:mem_req_unit']
+    node_status = df.at[i, 'status']
+    txt = '{}: {:,} cores and {:,.0f}{} RAM in {}'
+    if num_node>1:
+        txt += ' ({:,} nodes)'.format(num_node)
+    if ('ncore_socket_free' in df.columns) and (df.at[i, 'ncore_socket_free']!=''):
+        socket_max = min(int(df.at[i, 'ncore_socket_max']), int(num_avail_cpu))
+        txt += ' (<= {:,} cores on one socket)'.format(socket_max)
+    if node_status!='':
+        txt += ' with the status {}'
+    return txt.format(queue_name, num_avail_cpu, avail_ram, ram_unit, node_name, node_status)
+
+def print_stats(df, compress_nodes=False):
+    # With compress_nodes, nodes that would print identical lines are merged
+    # into one line with a hostlist expression such as a[001-064].
+    if not compress_nodes:
+        for i in df.index:
+            print(_format_stats_line(df, i, df.at[i, 'node_name']))
+        return
+    groups = {}
     for i in df.index:
-        queue_name = df.at[i, 'queue_name']
-        num_avail_cpu = df.at[i, 'ncore_available']
-        avail_ram = df.at[i, 'hc:mem_req']
-        ram_unit = df.at[i, 'hc:mem_req_unit']
-        node_name = df.at[i, 'node_name']
-        node_status = df.at[i, 'status']
-        txt = '{}: {:,} cores and {:,.0f}{} RAM in {}'
-        if node_status!='':
-            txt += ' with the status {}'
-        print(txt.format(queue_name, num_avail_cpu, avail_ram, ram_unit, node_name, node_status))
+        line_key = _format_stats_line(df, i, '')
+        groups.setdefault(line_key, []).append(i)
+    for indices in groups.values():
+        node_names = [ df.at[i, 'node_name'] for i in indices ]
+        print(_format_stats_line(df, indices[0], compress_hostlist(node_names), num_node=len(indices)))
 
 def print_resource_availability(df, args):
     queue_names = df.loc[:,'queue_name'].unique()
@@ -330,7 +540,7 @@ def print_resource_availability(df, args):
                 df_top_availability = df_top_availability.sort_values(by=col, ascending=False).reset_index(drop=True)
             else:
                 df_top_availability = df_queue.iloc[0:args.ntop,:]
-            print_stats(df=df_top_availability)
+            print_stats(df=df_top_availability, compress_nodes=args.all_tiers)
         print('')
 
 def get_user_df(lines):
@@ -344,14 +554,282 @@ def get_user_df(lines):
         return pandas.DataFrame(columns=columns + ['total_slots'])
     df_user = pandas.DataFrame(ser.str.split(' +', regex=True).tolist())
     df_user.columns = columns
+    return _add_uge_total_slots(df_user)
+
+def _add_uge_total_slots(df_user):
     df_user['slots'] = df_user['slots'].astype(int)
-    df_user['total_slots'] = 0
-    for i in df_user.index:
-        task_id = df_user.at[i,'ja_task_id']
-        num_tasks = _count_uge_task_expression(task_id)
-        df_user.at[i, 'total_slots'] = df_user.at[i, 'slots'] * num_tasks
+    df_user['total_slots'] = df_user['slots'] * _count_uge_task_expressions(df_user['ja_task_id'])
     return df_user
 
+def _xml_child_text(elem, tag, default=''):
+    child = elem.find(tag)
+    if (child is None) or (child.text is None):
+        return default
+    return child.text.strip()
+
+def _qstat_xml_queue_row(elem, resource_keys=QSTAT_RESOURCE_KEYS):
+    full_name = _xml_child_text(elem, 'name')
+    if '@' not in full_name:
+        return None
+    node_params = {
+        'queue_name': full_name.split('@', 1)[0],
+        'node_name': full_name.rsplit('@', 1)[-1],
+        'qtype': _xml_child_text(elem, 'qtype'),
+        'ncore_resv': _safe_int(_xml_child_text(elem, 'slots_resv'), default=0),
+        'ncore_used': _safe_int(_xml_child_text(elem, 'slots_used'), default=0),
+        'ncore_total': _safe_int(_xml_child_text(elem, 'slots_total'), default=0),
+        'np_load': _xml_child_text(elem, 'np_load_avg', default=_xml_child_text(elem, 'load_avg')),
+        'arch': _xml_child_text(elem, 'arch'),
+        'status': _xml_child_text(elem, 'state'),
+    }
+    for resource in elem.iter('resource'):
+        key = '{}:{}'.format(resource.get('type', ''), resource.get('name', ''))
+        if (resource_keys is not None) and (key not in resource_keys):
+            continue
+        node_params[key] = (resource.text or '').strip()
+    return node_params
+
+def _qstat_xml_job_row(elem):
+    job_time = _xml_child_text(elem, 'JAT_start_time')
+    if job_time=='':
+        job_time = _xml_child_text(elem, 'JB_submission_time')
+    job_date, _, job_clock = job_time.partition('T')
+    return {
+        'job_id': _xml_child_text(elem, 'JB_job_number'),
+        'prior': _xml_child_text(elem, 'JAT_prio'),
+        'name': _xml_child_text(elem, 'JB_name'),
+        'user': _xml_child_text(elem, 'JB_owner'),
+        'state': _xml_child_text(elem, 'state'),
+        'submit_or_start_date': job_date,
+        'submit_or_start_time': job_clock.split('.', 1)[0],
+        'slots': _safe_int(_xml_child_text(elem, 'slots'), default=1),
+        'ja_task_id': _xml_child_text(elem, 'tasks'),
+    }
+
+def get_qstat_xml_df(lines, resource_keys=QSTAT_RESOURCE_KEYS):
+    # Elements are dropped from the tree as soon as they are consumed, so memory
+    # stays bounded by one Queue-List element regardless of cluster size.
+    columns = ['job_id','prior','name','user','state','submit_or_start_date','submit_or_start_time','slots','ja_task_id']
+    rows = []
+    job_rows = []
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    parents = []
+    try:
+        for line in lines:
+            parser.feed(line)
+            for event, elem in parser.read_events():
+                if event=='start':
+                    parents.append(elem)
+                    continue
+                parents.pop()
+                if elem.tag=='job_list':
+                    job_rows.append(_qstat_xml_job_row(elem))
+                elif elem.tag=='Queue-List':
+                    node_params = _qstat_xml_queue_row(elem, resource_keys=resource_keys)
+                    if node_params is not None:
+                        rows.append(node_params)
+                else:
+                    continue
+                if parents:
+                    parents[-1].remove(elem)
+        parser.close()
+    except ElementTree.ParseError as e:
+        raise KFBatchCommandError('Failed to parse qstat XML output: {}'.format(e))
+    df = _finalize_qstat_rows(rows)
+    df_user = pandas.DataFrame(job_rows, columns=columns)
+    return df, _add_uge_total_slots(df_user)
+
+def get_qstat_job_df(lines):
+    # Plain qstat output has a queue column that is empty for pending jobs.
+    columns = ['job_id','prior','name','user','state','submit_or_start_date','submit_or_start_time','slots','ja_task_id']
+    rows = []
+    for raw_line in lines:
+        items = raw_line.split()
+        if (len(items)<8) or (not items[0].isdigit()):
+            continue
+        rest = items[7:]
+        if '@' in rest[0]:
+            rest = rest[1:]
+        if (len(rest)==0) or (not rest[0].isdigit()):
+            continue
+        rows.append(items[:7] + [rest[0], rest[1] if len(rest)>1 else ''])
+    df_user = pandas.DataFrame(rows, columns=columns)
+    return _add_uge_total_slots(df_user)
+
+def _add_uge_pending_job(totals, job):
+    key = (job['queue_name'], job['task_expression'])
+    total = totals.setdefault(key, [0, 0, 0.0])
+    total[0] += 1
+    total[1] += job['slots']
+    total[2] += job['slots'] * job['mem_gib']
+
+def _iter_uge_pending_jobs(lines):
+    # Yields one record per job from "qstat -s p -r" output, optionally with
+    # the -pri columns (nurg, npprior, ntckts, ppri) after "prior".
+    num_pri_col = 0
+    job = None
+    in_hard_resources = False
+    for raw_line in lines:
+        line = raw_line.strip()
+        if line.startswith('job-ID'):
+            num_pri_col = 4 if ('ntckts' in line.split()) else 0
+            continue
+        if (line=='') or line.startswith('---'):
+            continue
+        items = line.split()
+        if (len(items)>=8+num_pri_col) and items[0].isdigit() and re.match(r'^[0-9.]+$', items[1]):
+            if job is not None:
+                yield job
+            job = None
+            in_hard_resources = False
+            rest = items[7+num_pri_col:]
+            if '@' in rest[0]:
+                rest = rest[1:]
+            if (len(rest)==0) or (not rest[0].isdigit()):
+                continue
+            job = {
+                'job_id': items[0],
+                'user': items[3+num_pri_col],
+                'prior': float(items[1]),
+                'nurg': numpy.nan,
+                'ntckts': numpy.nan,
+                'queue_name': '',
+                'task_expression': rest[1] if len(rest)>1 else '',
+                'slots': int(rest[0]),
+                'mem_gib': 0.0,
+            }
+            if num_pri_col:
+                job['nurg'] = float(items[2])
+                job['ntckts'] = float(items[4])
+            continue
+        if job is None:
+            continue
+        m = re.match(r'^([A-Za-z][A-Za-z ()]*[A-Za-z)]):\s*(.*)$', line)
+        if m is not None:
+            label = m.group(1)
+            value = m.group(2)
+            in_hard_resources = (label=='Hard Resources')
+            if label=='Hard requested queues':
+                queue_names = []
+                for q in value.split(','):
+                    q = q.strip().split('@', 1)[0]
+                    if (q!='') and (q not in queue_names):
+                        queue_names.append(q)
+                job['queue_name'] = ','.join(queue_names)
+            if not in_hard_resources:
+                continue
+            line = value
+        if in_hard_resources and line.startswith('mem_req='):
+            job['mem_gib'] = _memory_text_to_gib(line.split()[0].split('=', 1)[1])
+    if job is not None:
+        yield job
+
+def _new_uge_pending_accumulator():
+    # Demand totals per (queue, task expression) plus one row per (requested
+    # queues, user) for the launch heuristic, kept as columns, so one pass over
+    # the pending jobs feeds both and memory does not grow with the job count.
+    return {
+        'demand': {},
+        'keys': {},
+        'prior': [],
+        'ntckts': [],
+        'slots': [],
+        'mem_gib': [],
+        'job_id': [],
+    }
+
+def _update_uge_pending_accumulator(accumulator, job):
+    _add_uge_pending_job(accumulator['demand'], job)
+    # Job IDs compare as integers so that "99" sorts before "100".
+    request = (job['slots'], job['mem_gib'], int(job['job_id']))
+    keys = accumulator['keys']
+    row = keys.setdefault((job['queue_name'], job['user']), len(keys))
+    if row==len(accumulator['prior']):
+        for col, value in zip(['prior', 'ntckts', 'slots', 'mem_gib', 'job_id'], (job['prior'], job['ntckts']) + request):
+            accumulator[col].append(value)
+        return
+    accumulator['prior'][row] = max(accumulator['prior'][row], job['prior'])
+    accumulator['ntckts'][row] = numpy.fmax(accumulator['ntckts'][row], job['ntckts'])
+    smallest = (accumulator['slots'][row], accumulator['mem_gib'][row], accumulator['job_id'][row])
+    if request<smallest:
+        accumulator['slots'][row], accumulator['mem_gib'][row], accumulator['job_id'][row] = request
+
+def _finalize_uge_pending_jobs(accumulator):
+    # One row per (queue_name, user): the highest prior and ntckts of the
+    # group and its smallest request (slots, mem_gib, job_id).
+    columns = ['job_id', 'user', 'prior', 'ntckts', 'queue_name', 'slots', 'mem_gib']
+    keys = list(accumulator['keys'].keys())
+    return pandas.DataFrame({
+        'job_id': pandas.Series(accumulator['job_id'], dtype=numpy.int64),
+        'user': pandas.Series([ key[1] for key in keys ], dtype=object),
+        'prior': pandas.Series(accumulator['prior'], dtype=float),
+        'ntckts': pandas.Series(accumulator['ntckts'], dtype=float),
+        'queue_name': pandas.Series([ key[0] for key in keys ], dtype=object),
+        'slots': pandas.Series(accumulator['slots'], dtype=numpy.int64),
+        'mem_gib': pandas.Series(accumulator['mem_gib'], dtype=float),
+    }, columns=columns)
+
+def _finalize_uge_pending_demand(accumulator):
+    columns = ['queue_name', 'pending_jobs', 'pending_tasks', 'pending_slots', 'pending_mem_gib']
+    totals = accumulator['demand']
+    if len(totals)==0:
+        return pandas.DataFrame(columns=columns)
+    df = pandas.DataFrame(
+        [ [queue_name, expression] + total for (queue_name, expression), total in totals.items() ],
+        columns=['queue_name', 'task_expression', 'pending_jobs', 'slots', 'slot_mem_gib'],
+    )
+    num_tasks = _count_uge_task_expressions(df['task_expression'])
+    df['pending_tasks'] = df['pending_jobs'] * num_tasks
+    df['pending_slots'] = df['slots'] * num_tasks
+    df['pending_mem_gib'] = df['slot_mem_gib'] * num_tasks
+    df = df.groupby('queue_name', as_index=False)[columns[1:]].sum()
+    df['queue_name'] = df['queue_name'].replace('', '(any)')
+    return df.sort_values(by='queue_name').reset_index(drop=True).loc[:, columns]
+
+def get_uge_pending_accumulator(lines):
+    # Folds "qstat -u '*' -s p -r" output while reading, so only one job is
+    # held at a time.
+    accumulator = _new_uge_pending_accumulator()
+    for job in _iter_uge_pending_jobs(lines):
+        _update_uge_pending_accumulator(accumulator, job)
+    return accumulator
+
+def get_uge_pending_demand_df(lines):
+    return _finalize_uge_pending_demand(get_uge_pending_accumulator(lines))
+
+def get_uge_pending_capacity_df(df_demand, df, exclude_abnormal_node=True):
+    df_node = df
+    if exclude_abnormal_node:
+        df_node = df.loc[(df['status']==''), :]
+    capacity = (
+        df_node
+        .groupby('queue_name', as_index=False)[['ncore_available', 'hc:mem_req']]
+        .sum()
+        .rename(columns={'ncore_available': 'available_slots', 'hc:mem_req': 'available_mem_gib'})
+    )
+    out = df_demand.merge(capacity, how='left', on='queue_name')
+    out['available_slots'] = out['available_slots'].fillna(0).astype(int)
+    out['available_mem_gib'] = out['available_mem_gib'].fillna(0.0).astype(float)
+    return out
+
+def print_uge_pending_demand(df_demand):
+    print('Reporting pending demand vs. available capacity per requested queue:')
+    if df_demand.shape[0]==0:
+        print('No pending jobs found.')
+        print('')
+        return
+    for i in df_demand.index:
+        queue_name = df_demand.at[i, 'queue_name']
+        txt = '{}: {:,} pending tasks in {:,} jobs request {:,} CPUs and {:,.0f}G RAM'
+        txt = txt.format(queue_name, int(df_demand.at[i, 'pending_tasks']),
+                         int(df_demand.at[i, 'pending_jobs']), int(df_demand.at[i, 'pending_slots']),
+                         float(df_demand.at[i, 'pending_mem_gib']))
+        if (',' not in queue_name) and (queue_name!='(any)'):
+            txt += '; {:,} CPUs and {:,.0f}G RAM available'.format(int(df_demand.at[i, 'available_slots']),
+                                                                  float(df_demand.at[i, 'available_mem_gib']))
+        print(txt)
+    print('')
+
 def _count_slurm_array_task_expression(task_expression):
     if task_expression=='':
         return 1, True
@@ -397,179 +875,171 @@ def estimate_slurm_task_count(job_id):
     is_estimated = has_ambiguous_pattern or (not has_closing_bracket)
     return num_tasks, is_estimated
 
-def get_squeue_user_df(lines):
-    columns = [
-        'job_id',
-        'partition',
-        'name',
-        'user',
-        'state',
-        'elapsed_time',
-        'num_nodes',
-        'req_cpus',
-        'req_mem',
-        'time_limit',
-        'node_or_reason',
-        'pending_reason',
-        'resource_fields_complete',
-        'total_slots',
-        'task_count_estimated',
-    ]
-    table = []
-    for raw_line in lines:
-        line = re.sub('\n$', '', raw_line)
+def _map_unique_values(values, func, dtype=object):
+    # squeue columns such as node counts, pending reasons and array suffixes
+    # repeat heavily across jobs, so each distinct value is converted once.
+    codes, uniques = pandas.factorize(pandas.Series(values, dtype=object), use_na_sentinel=False)
+    mapped = numpy.array([func(value) for value in uniques], dtype=dtype)
+    return mapped[codes]
+
+def _estimate_slurm_task_counts(job_ids):
+    # Keys keep the "_" so that ids without a suffix ('') stay distinct from "123_",
+    # and each distinct key is a valid argument of estimate_slurm_task_count.
+    keys = ['_' + job_id.split('_', 1)[1] if '_' in job_id else '' for job_id in job_ids]
+    codes, uniques = pandas.factorize(pandas.Series(keys, dtype=object), use_na_sentinel=False)
+    estimates = [ estimate_slurm_task_count(key) for key in uniques ]
+    num_tasks = numpy.array([e[0] for e in estimates], dtype=numpy.int64)[codes]
+    is_estimated = numpy.array([e[1] for e in estimates], dtype=bool)[codes]
+    return num_tasks, is_estimated
+
+def _has_padded_tsv_fields(txt):
+    # Spaces around tabs or line ends are checked with plain substring searches;
+    # any other whitespace character is rare enough to trigger stripping outright.
+    for pattern in [' \t', '\t ', ' \n', '\n ']:
+        if pattern in txt:
+            return True
+    if txt.startswith(' ') or txt.endswith(' '):
+        return True
+    return re.search(r'[^\S \t\n]', txt) is not None
+
+def _split_squeue_line(line):
+    # Slow path for lines that are not exactly SLURM_SQUEUE_PARSE_FIELDS:
+    # legacy 8-field output, literal "\\t" separators captured to files, and
+    # whitespace-aligned default squeue output.
+    if '\t' in line:
+        sep = '\t'
+    elif '\\t' in line:
+        sep = '\\t'
+    else:
+        sep = None
+    if sep is None:
+        items = re.split(r'\s+', line.strip(), maxsplit=10)
+    else:
+        items = line.split(sep)
+    if len(items)>=11:
+        fields = [item.strip() for item in items[:10]]
+        node_or_reason = items[10] if sep is None else sep.join(items[10:]).strip()
+        return fields + [node_or_reason, True]
+    if len(items)>=8:
+        fields = [item.strip() for item in items[:7]]
+        node_or_reason = items[7] if sep is None else sep.join(items[7:]).strip()
+        return fields + ['', '', '', node_or_reason, False]
+    return None
+
+def get_squeue_user_df(lines, detail_columns=True):
+    columns = get_squeue_columns(detail_columns)
+    raw_columns = SLURM_SQUEUE_COLUMNS[:11]
+    # node_or_reason is still read because pending_reason is derived from it.
+    used_raw_columns = [ col for col in raw_columns if (col in columns) or (col=='node_or_reason') ]
+    fast_lines = []
+    fast_index = []
+    slow_rows = []
+    slow_index = []
+    for i, raw_line in enumerate(lines):
+        line = raw_line[:-1] if raw_line.endswith('\n') else raw_line
         if line.strip()=='':
             continue
         if line.lstrip().startswith('JOBID '):
             continue
-        if '\t' in line:
-            items = line.split('\t')
-            if len(items)>=11:
-                resource_fields_complete = True
-                job_id = items[0].strip()
-                partition = items[1].strip()
-                name = items[2].strip()
-                user = items[3].strip()
-                state = items[4].strip()
-                elapsed_time = items[5].strip()
-                num_nodes_txt = items[6].strip()
-                req_cpus_txt = items[7].strip()
-                req_mem = items[8].strip()
-                time_limit = items[9].strip()
-                node_or_reason = '\t'.join(items[10:]).strip()
-            elif len(items)>=8:
-                resource_fields_complete = False
-                job_id = items[0].strip()
-                partition = items[1].strip()
-                name = items[2].strip()
-                user = items[3].strip()
-                state = items[4].strip()
-                elapsed_time = items[5].strip()
-                num_nodes_txt = items[6].strip()
-                req_cpus_txt = ''
-                req_mem = ''
-                time_limit = ''
-                node_or_reason = '\t'.join(items[7:]).strip()
-            else:
-                continue
-        elif '\\t' in line:
-            # Some captured files may contain literal "\t" separators.
-            items = line.split('\\t')
-            if len(items)>=11:
-                resource_fields_complete = True
-                job_id = items[0].strip()
-                partition = items[1].strip()
-                name = items[2].strip()
-                user = items[3].strip()
-                state = items[4].strip()
-                elapsed_time = items[5].strip()
-                num_nodes_txt = items[6].strip()
-                req_cpus_txt = items[7].strip()
-                req_mem = items[8].strip()
-                time_limit = items[9].strip()
-                node_or_reason = '\\t'.join(items[10:]).strip()
-            elif len(items)>=8:
-                resource_fields_complete = False
-                job_id = items[0].strip()
-                partition = items[1].strip()
-                name = items[2].strip()
-                user = items[3].strip()
-                state = items[4].strip()
-                elapsed_time = items[5].strip()
-                num_nodes_txt = items[6].strip()
-                req_cpus_txt = ''
-                req_mem = ''
-                time_limit = ''
-                node_or_reason = '\\t'.join(items[7:]).strip()
-            else:
-                continue
-        else:
-            items = re.split(r'\s+', line.strip(), maxsplit=10)
-            if len(items)>=11:
-                resource_fields_complete = True
-                job_id = items[0]
-                partition = items[1]
-                name = items[2]
-                user = items[3]
-                state = items[4]
-                elapsed_time = items[5]
-                num_nodes_txt = items[6]
-                req_cpus_txt = items[7]
-                req_mem = items[8]
-                time_limit = items[9]
-                node_or_reason = items[10]
-            elif len(items)>=8:
-                resource_fields_complete = False
-                job_id = items[0]
-                partition = items[1]
-                name = items[2]
-                user = items[3]
-                state = items[4]
-                elapsed_time = items[5]
-                num_nodes_txt = items[6]
-                req_cpus_txt = ''
-                req_mem = ''
-                time_limit = ''
-                node_or_reason = items[7]
-            else:
-                continue
-        try:
-            num_nodes = int(num_nodes_txt)
-        except ValueError:
-            num_nodes = 1
-        req_cpus = _safe_int(req_cpus_txt, default=0)
-        num_tasks, is_estimated = estimate_slurm_task_count(job_id)
-        total_slots = num_tasks
-        table.append({
-            'job_id': job_id,
-            'partition': partition,
-            'name': name,
-            'user': user,
-            'state': state,
-            'elapsed_time': elapsed_time,
-            'num_nodes': num_nodes,
-            'req_cpus': req_cpus,
-            'req_mem': req_mem,
-            'time_limit': time_limit,
-            'node_or_reason': node_or_reason,
-            'pending_reason': _extract_slurm_pending_reason(node_or_reason),
-            'resource_fields_complete': resource_fields_complete,
-            'total_slots': total_slots,
-            'task_count_estimated': is_estimated,
-        })
-    return pandas.DataFrame(table, columns=columns)
+        # Fast path: lines in the SLURM_SQUEUE_PARSE_FIELDS layout (exactly 10
+        # real tabs) are handed to the C CSV reader in one call.
+        if (line.count('\t')==10) and ('\r' not in line):
+            fast_lines.append(line)
+            fast_index.append(i)
+            continue
+        row = _split_squeue_line(line)
+        if row is not None:
+            slow_rows.append(row)
+            slow_index.append(i)
+    if len(fast_lines)+len(slow_rows)==0:
+        return pandas.DataFrame(columns=columns)
+    df_fast = pandas.DataFrame(columns=used_raw_columns, dtype=str)
+    if len(fast_lines)>0:
+        fast_txt = '\n'.join(fast_lines)
+        fast_lines = None
+        df_fast = pandas.read_csv(
+            io.StringIO(fast_txt),
+            sep='\t',
+            header=None,
+            names=raw_columns,
+            usecols=used_raw_columns,
+            dtype=str,
+            na_filter=False,
+            quoting=csv.QUOTE_NONE,
+            skip_blank_lines=False,
+            engine='c',
+        )
+        is_padded = _has_padded_tsv_fields(fast_txt)
+        fast_txt = None
+        if is_padded:
+            for col in used_raw_columns:
+                df_fast[col] = [value.strip() for value in df_fast[col].tolist()]
+    df_fast['resource_fields_complete'] = True
+    df_slow = pandas.DataFrame(slow_rows, columns=raw_columns + ['resource_fields_complete'])
+    if df_slow.shape[0]==0:
+        df = df_fast
+    elif df_fast.shape[0]==0:
+        df = df_slow
+    else:
+        # Restore the input order of rows taken by the fast and slow paths.
+        df_fast.index = numpy.array(fast_index)
+        df_slow.index = numpy.array(slow_index)
+        df = pandas.concat([df_fast, df_slow]).sort_index().reset_index(drop=True)
+    return _finalize_squeue_df(df, detail_columns=detail_columns)
+
+def get_squeue_columns(detail_columns=True):
+    if detail_columns:
+        return SLURM_SQUEUE_COLUMNS
+    return [ col for col in SLURM_SQUEUE_COLUMNS if col not in SLURM_SQUEUE_DETAIL_COLUMNS ]
+
+def _finalize_squeue_df(df, detail_columns=True):
+    # Derives the typed columns of get_squeue_user_df from the 11 raw squeue
+    # fields plus resource_fields_complete.
+    df['num_nodes'] = _map_unique_values(df['num_nodes'], lambda value: _safe_int(value, default=1), dtype=numpy.int32)
+    df['req_cpus'] = _map_unique_values(df['req_cpus'], lambda value: _safe_int(value, default=0), dtype=numpy.int32)
+    df['pending_reason'] = _map_unique_values(df['node_or_reason'], _extract_slurm_pending_reason)
+    df['resource_fields_complete'] = df['resource_fields_complete'].astype(bool)
+    num_tasks, is_estimated = _estimate_slurm_task_counts(df['job_id'].tolist())
+    df['total_slots'] = num_tasks
+    df['task_count_estimated'] = is_estimated
+    df = df.loc[:, get_squeue_columns(detail_columns)]
+    for col in SLURM_SQUEUE_CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+    return df
 
 def _split_scontrol_node_blocks(lines):
+    # Multi-line "scontrol show node" entries are joined into one line per node.
     blocks = []
-    current = ''
+    current = []
     for raw_line in lines:
         line = raw_line.strip()
         if line=='':
-            if current!='':
-                blocks.append(current.strip())
-                current = ''
-            continue
-        if ('NodeName=' in line) and (current!=''):
-            blocks.append(current.strip())
-            current = line
+            if current:
+                blocks.append(' '.join(current))
+                current = []
             continue
-        if current=='':
-            current = line
-        else:
-            current += ' ' + line
-    if current!='':
-        blocks.append(current.strip())
+        if ('NodeName=' in line) and current:
+            blocks.append(' '.join(current))
+            current = []
+        current.append(line)
+    if current:
+        blocks.append(' '.join(current))
     return blocks
 
-def _parse_key_value_fields(line):
-    items = [ item for item in line.split(' ') if item!='' ]
-    params = {}
-    for item in items:
-        if '=' not in item:
-            continue
-        key, value = item.split('=', 1)
-        params[key] = value
-    return params
+# A field starts at a capitalized "Key=" after a space (the line is given a
+# leading one); anything else, including "x=y" inside Reason= or Comment=, is
+# value text. The literal space lets the regex engine skip ahead quickly.
+SCONTROL_KEY_PATTERN = re.compile(r' ([A-Z][A-Za-z0-9_:/]*)=')
+
+def _parse_key_value_fields(line, keys=None):
+    # scontrol prints "Key=value" pairs separated by spaces, but some values
+    # contain spaces themselves (OS=, Reason=). Each value is sliced from the
+    # line up to the next key, so its inner spacing is kept. With `keys`, other
+    # keys are not stored.
+    parts = SCONTROL_KEY_PATTERN.split(' ' + line)
+    if keys is None:
+        return { key: value.strip() for key, value in zip(parts[1::2], parts[2::2]) }
+    return { key: value.strip() for key, value in zip(parts[1::2], parts[2::2]) if key in keys }
 
 def _safe_int(value, default=0):
     if value is None:
@@ -614,6 +1084,8 @@ def _slurm_state_flags(state_raw):
         flags.append(m.group(1))
     return flags
 
+SCONTROL_PARTITION_KEYS = frozenset(['PartitionName', 'State'])
+
 def get_scontrol_partition_df(lines):
     columns = ['partition_name', 'partition_state']
     rows = []
@@ -623,7 +1095,7 @@ def get_scontrol_partition_df(lines):
             continue
         if 'PartitionName=' not in line:
             continue
-        params = _parse_key_value_fields(line)
+        params = _parse_key_value_fields(line, keys=SCONTROL_PARTITION_KEYS)
         partition_name = params.get('PartitionName', '')
         partition_state = params.get('State', '')
         if partition_name=='':
@@ -676,66 +1148,208 @@ def _count_core_id_expression(core_ids):
             total += 1
     return total
 
+SCONTROL_RESERVATION_KEYS = frozenset([
+    'ReservationName', 'StartTime', 'EndTime', 'PartitionName', 'Nodes', 'NodeCnt', 'CoreCnt', 'TRES', 'ReqTRES', 'State',
+])
+SCONTROL_RESERVATION_NODE_KEYS = frozenset(['NodeName', 'CoreIDs'])
+SLURM_RESERVATION_COLUMNS = [
+    'queue_name', 'node_name', 'reservation_name', 'reserved_cores', 'reserved_mem_mb', 'start_time', 'end_time', 'is_active',
+]
+
+def _slurm_time_to_epoch(value, default):
+    # scontrol prints local times such as 2026-03-06T12:00:00; JSON gives epochs.
+    if isinstance(value, (int, float)):
+        return float(value)
+    txt = str(value).strip()
+    try:
+        return time.mktime(time.strptime(txt, '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return default
+
+def _scontrol_reservation_rows(header_params, node_params):
+    # header_params holds the ReservationName=/Nodes= fields and node_params the
+    # per-node NodeName=... CoreIDs=... entries, if scontrol printed any.
+    # Reservations that are not ACTIVE yet are kept with is_active=False.
+    rows = []
+    window = {
+        'start_time': _slurm_time_to_epoch(header_params.get('StartTime', ''), default=float('-inf')),
+        'end_time': _slurm_time_to_epoch(header_params.get('EndTime', ''), default=float('inf')),
+        'is_active': header_params.get('State', 'ACTIVE')=='ACTIVE',
+    }
+    partition_name = header_params.get('PartitionName', '').strip()
+    reservation_name = header_params.get('ReservationName', '').strip()
+    if partition_name=='':
+        return rows
+    node_count = _safe_int(header_params.get('NodeCnt', ''), default=0)
+    default_reserved_cores = max(_safe_int(header_params.get('CoreCnt', ''), default=0), 0)
+    reservation_tres = header_params.get('TRES', '')
+    if reservation_tres=='':
+        reservation_tres = header_params.get('ReqTRES', '')
+    default_reserved_mem_mb = max(_memory_text_to_mb(_extract_tres_resource_value(reservation_tres, 'mem')), 0)
+    for params in node_params:
+        node_name = params.get('NodeName', '').strip()
+        if node_name=='':
+            continue
+        reserved_cores = _count_core_id_expression(params.get('CoreIDs', ''))
+        if (reserved_cores==0) and (node_count==1):
+            reserved_cores = default_reserved_cores
+        if reserved_cores<=0:
+            continue
+        reserved_mem_mb = 0
+        if (default_reserved_mem_mb>0) and (node_count>0):
+            reserved_mem_mb = int(round(float(default_reserved_mem_mb) / float(node_count)))
+        rows.append(dict({
+            'queue_name': partition_name,
+            'node_name': node_name,
+            'reservation_name': reservation_name,
+            'reserved_cores': reserved_cores,
+            'reserved_mem_mb': reserved_mem_mb,
+        }, **window))
+    if len(node_params)>0:
+        return rows
+    # Without per-node CoreIDs, CoreCnt and TRES mem are spread evenly over the
+    # nodes. A multi-node Nodes= hostlist is kept as one row and resolved
+    # against the node table in apply_slurm_reservations.
+    node_name = header_params.get('Nodes', '').strip()
+    if (node_name=='') or (node_name=='(null)') or (default_reserved_cores<=0):
+        return rows
+    try:
+        num_hostlist_node = hostlist_size(node_name)
+    except ValueError:
+        return rows
+    if node_count<=0:
+        node_count = num_hostlist_node
+    if (node_count<=0) or (num_hostlist_node!=node_count):
+        return rows
+    rows.append(dict({
+        'queue_name': partition_name,
+        'node_name': node_name,
+        'reservation_name': reservation_name,
+        'reserved_cores': int(round(float(default_reserved_cores) / float(node_count))),
+        'reserved_mem_mb': int(round(float(default_reserved_mem_mb) / float(node_count))),
+    }, **window))
+    return rows
+
 def get_scontrol_reservation_df(lines):
-    columns = ['queue_name', 'node_name', 'reservation_name', 'reserved_cores', 'reserved_mem_mb']
     rows = []
     for block in _split_scontrol_named_blocks(lines, 'ReservationName='):
         header_params = {}
         for line in block:
             if ('=' in line) and (line.startswith('ReservationName=') or line.startswith('Nodes=')):
-                header_params.update(_parse_key_value_fields(line))
-        if header_params.get('State', 'ACTIVE') != 'ACTIVE':
-            continue
-        partition_name = header_params.get('PartitionName', '').strip()
-        reservation_name = header_params.get('ReservationName', '').strip()
-        if partition_name=='':
-            continue
-        node_count = _safe_int(header_params.get('NodeCnt', ''), default=0)
-        default_reserved_cores = max(_safe_int(header_params.get('CoreCnt', ''), default=0), 0)
-        reservation_tres = header_params.get('TRES', '')
-        if reservation_tres=='':
-            reservation_tres = header_params.get('ReqTRES', '')
-        default_reserved_mem_mb = max(_memory_text_to_mb(_extract_tres_resource_value(reservation_tres, 'mem')), 0)
-        has_explicit_node_rows = False
-        for line in block:
-            if not line.startswith('NodeName='):
-                continue
-            has_explicit_node_rows = True
-            params = _parse_key_value_fields(line)
-            node_name = params.get('NodeName', '').strip()
-            if node_name=='':
-                continue
-            reserved_cores = _count_core_id_expression(params.get('CoreIDs', ''))
-            if (reserved_cores==0) and (node_count==1):
-                reserved_cores = default_reserved_cores
-            if reserved_cores<=0:
-                continue
-            reserved_mem_mb = 0
-            if (default_reserved_mem_mb>0) and (node_count>0):
-                reserved_mem_mb = int(round(float(default_reserved_mem_mb) / float(node_count)))
-            rows.append({
-                'queue_name': partition_name,
-                'node_name': node_name,
-                'reservation_name': reservation_name,
-                'reserved_cores': reserved_cores,
-                'reserved_mem_mb': reserved_mem_mb,
-            })
-        if has_explicit_node_rows:
+                header_params.update(_parse_key_value_fields(line, keys=SCONTROL_RESERVATION_KEYS))
+        node_params = [ _parse_key_value_fields(line, keys=SCONTROL_RESERVATION_NODE_KEYS)
+                        for line in block if line.startswith('NodeName=') ]
+        rows.extend(_scontrol_reservation_rows(header_params, node_params))
+    return pandas.DataFrame(rows, columns=SLURM_RESERVATION_COLUMNS)
+
+def _expand_reservation_hostlists(df_reservation, node_names):
+    # Rows whose node_name is a hostlist expression get one row per node of the
+    # node table that the expression covers; nodes absent from the table are
+    # never materialized.
+    is_expr = df_reservation['node_name'].astype(str).map(is_hostlist)
+    if not is_expr.any():
+        return df_reservation
+    node_names = node_names.astype(str).tolist()
+    index = build_hostlist_index(node_names)
+    source_index = []
+    expanded_names = []
+    for i in df_reservation.index[is_expr]:
+        try:
+            positions = intersect_hostlist(df_reservation.at[i, 'node_name'], index)
+        except ValueError:
             continue
-        node_name = header_params.get('Nodes', '').strip()
-        if (node_count==1) and (node_name!='') and (not re.search(r'[\[\],]', node_name)) and (default_reserved_cores>0):
-            rows.append({
-                'queue_name': partition_name,
-                'node_name': node_name,
-                'reservation_name': reservation_name,
-                'reserved_cores': default_reserved_cores,
-                'reserved_mem_mb': default_reserved_mem_mb,
-            })
-    return pandas.DataFrame(rows, columns=columns)
+        covered_names = list(dict.fromkeys([ node_names[pos] for pos in positions ]))
+        source_index.extend([i] * len(covered_names))
+        expanded_names.extend(covered_names)
+    df_expanded = df_reservation.loc[source_index, :].copy()
+    df_expanded['node_name'] = expanded_names
+    return pandas.concat([df_reservation.loc[~is_expr, :], df_expanded], ignore_index=True)
 
-def apply_slurm_reservations(df_node, df_reservation):
+# The reservation calendar is indexed like the node table: the reservations of
+# keys.iloc[i] are rows offsets[i]:offsets[i+1] of start/end/cores/mem_mb,
+# sorted by start time. ACTIVE reservations start at -inf, and reservations
+# that have ended by now are dropped whatever their State. sort_key combines the
+# key code with the rank of the start time so that every key is searched at once.
+def build_reservation_calendar(df_reservation, key_cols, now):
+    df = df_reservation.copy()
+    is_active = df['is_active'].fillna(True).astype(bool).to_numpy()
+    start = pandas.to_numeric(df['start_time'], errors='coerce').fillna(float('-inf')).to_numpy(dtype=float)
+    end = pandas.to_numeric(df['end_time'], errors='coerce').fillna(float('inf')).to_numpy(dtype=float)
+    start = numpy.where(is_active, float('-inf'), start)
+    is_kept = (end>now)
+    df = df.loc[is_kept, :].reset_index(drop=True)
+    start = start[is_kept]
+    end = end[is_kept]
+    codes = df.groupby(key_cols, sort=True).ngroup().to_numpy().astype(numpy.int64)
+    keys = df.loc[:, key_cols].drop_duplicates().sort_values(by=key_cols).reset_index(drop=True)
+    start_values, start_ranks = numpy.unique(start, return_inverse=True)
+    order = numpy.lexsort((start, codes))
+    offsets = numpy.zeros(keys.shape[0] + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum(numpy.bincount(codes, minlength=keys.shape[0]))
+    return {
+        'keys': keys,
+        'offsets': offsets,
+        'start_values': start_values,
+        'sort_key': (codes * (start_values.shape[0] + 1) + start_ranks.reshape(-1))[order],
+        'start': start[order],
+        'end': end[order],
+        'cores': df['reserved_cores'].to_numpy(dtype=numpy.int64)[order],
+        'mem_mb': df['reserved_mem_mb_effective'].to_numpy(dtype=numpy.int64)[order],
+    }
+
+def _max_concurrent_reservation(key_codes, start, end, amount, num_key, window_start):
+    # Peak of the summed amounts over time per key. Every key's deltas add up to
+    # zero, so one cumulative sum over events sorted by (key, time) restarts at
+    # zero for each key. An interval ends before one that starts at the same moment.
+    peak = numpy.zeros(num_key, dtype=numpy.int64)
+    if key_codes.shape[0]==0:
+        return peak
+    codes = numpy.concatenate([key_codes, key_codes])
+    times = numpy.concatenate([numpy.maximum(start, window_start), end])
+    deltas = numpy.concatenate([amount, -amount])
+    order = numpy.lexsort((deltas, times, codes))
+    numpy.maximum.at(peak, codes[order], numpy.cumsum(deltas[order]))
+    return peak
+
+def query_reservation_calendar(calendar, window_start, window_end):
+    # Reserved cores and memory per key during [window_start, window_end): one
+    # binary search per key, then a sweep over the overlapping reservations.
+    # An empty window (window_end==window_start) sees only ACTIVE reservations.
+    keys = calendar['keys'].copy()
+    num_key = keys.shape[0]
+    offsets = calendar['offsets']
+    start_values = calendar['start_values']
+    if window_end==window_start:
+        end_rank = numpy.searchsorted(start_values, float('-inf'), side='right')
+    else:
+        end_rank = numpy.searchsorted(start_values, window_end, side='left')
+    bounds = numpy.arange(num_key, dtype=numpy.int64) * (start_values.shape[0] + 1) + end_rank
+    hi = numpy.searchsorted(calendar['sort_key'], bounds, side='left')
+    counts = hi - offsets[:-1]
+    key_codes = numpy.repeat(numpy.arange(num_key), counts)
+    rows = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts) + numpy.repeat(offsets[:-1], counts)
+    is_overlap = calendar['end'][rows]>window_start
+    key_codes = key_codes[is_overlap]
+    rows = rows[is_overlap]
+    start = calendar['start'][rows]
+    end = calendar['end'][rows]
+    keys['reservation_cores'] = _max_concurrent_reservation(
+        key_codes, start, end, calendar['cores'][rows], num_key, window_start)
+    keys['reservation_mem_mb'] = _max_concurrent_reservation(
+        key_codes, start, end, calendar['mem_mb'][rows], num_key, window_start)
+    return keys
+
+def apply_slurm_reservations(df_node, df_reservation, walltime_minutes=0, now=None):
+    # df_node is either the per-node table of get_scontrol_node_table, where a
+    # reservation applies to its node in every partition, or a (partition, node)
+    # table, where it applies to the reservation's own partition only.
+    # With walltime_minutes, capacity is what stays free for a job started now
+    # that runs that long, so upcoming reservations are subtracted as well.
     if (df_node is None) or (df_node.shape[0]==0) or (df_reservation is None) or (df_reservation.shape[0]==0):
         return df_node
+    if now is None:
+        now = time.time()
+    key_cols = ['queue_name', 'node_name'] if ('queue_name' in df_node.columns) else ['node_name']
     df = df_node.copy()
     if 'reservation_cores' not in df.columns:
         df['reservation_cores'] = 0
@@ -745,10 +1359,15 @@ def apply_slurm_reservations(df_node, df_reservation):
     if 'reserved_mem_mb' not in reservation_rows.columns:
         reservation_rows['reserved_mem_mb'] = 0
     reservation_rows['reserved_mem_mb'] = pandas.to_numeric(reservation_rows['reserved_mem_mb'], errors='coerce').fillna(0).astype(int)
-    node_shape = df.loc[:, ['queue_name', 'node_name', 'ncore_total', 'hl:mem_total']].copy()
+    for col, default in [('start_time', float('-inf')), ('end_time', float('inf')), ('is_active', True)]:
+        if col not in reservation_rows.columns:
+            reservation_rows[col] = default
+    reservation_rows = _expand_reservation_hostlists(reservation_rows, df['node_name'])
+    node_shape = df.loc[:, key_cols + ['ncore_total', 'hl:mem_total']].copy()
     node_shape['node_total_mem_mb'] = node_shape['hl:mem_total'].map(_memory_text_to_mb)
     node_shape['ncore_total'] = pandas.to_numeric(node_shape['ncore_total'], errors='coerce').fillna(0).astype(int)
-    reservation_rows = reservation_rows.merge(node_shape, how='left', on=['queue_name', 'node_name'])
+    reservation_rows = reservation_rows.loc[:, key_cols + ['reserved_cores', 'reserved_mem_mb', 'start_time', 'end_time', 'is_active']]
+    reservation_rows = reservation_rows.merge(node_shape, how='left', on=key_cols)
     reservation_rows['reserved_mem_mb_effective'] = reservation_rows['reserved_mem_mb']
     needs_estimate = (
         (reservation_rows['reserved_mem_mb_effective']<=0) &
@@ -760,13 +1379,9 @@ def apply_slurm_reservations(df_node, df_reservation):
             (reservation_rows.loc[needs_estimate, 'node_total_mem_mb'] * reservation_rows.loc[needs_estimate, 'reserved_cores']) /
             reservation_rows.loc[needs_estimate, 'ncore_total']
         ).round().astype(int)
-    grouped = (
-        reservation_rows
-        .groupby(['queue_name', 'node_name'], as_index=False)[['reserved_cores', 'reserved_mem_mb_effective']]
-        .sum()
-        .rename(columns={'reserved_cores': 'reservation_cores', 'reserved_mem_mb_effective': 'reservation_mem_mb'})
-    )
-    df = df.merge(grouped, how='left', on=['queue_name', 'node_name'], suffixes=('', '_new'))
+    calendar = build_reservation_calendar(reservation_rows, key_cols, now)
+    grouped = query_reservation_calendar(calendar, now, now + walltime_minutes * 60)
+    df = df.merge(grouped, how='left', on=key_cols, suffixes=('', '_new'))
     if 'reservation_cores_new' in df.columns:
         new_values = pandas.to_numeric(df['reservation_cores_new'], errors='coerce').fillna(0).astype(int)
         df['reservation_cores'] = pandas.to_numeric(df['reservation_cores'], errors='coerce').fillna(0).astype(int) + new_values
@@ -810,92 +1425,458 @@ def get_sprio_df(lines):
         })
     return pandas.DataFrame(rows, columns=columns)
 
-def get_scontrol_node_df(lines, partition_state_map=None):
-    columns = [
-        'queue_name',
-        'node_name',
-        'qtype',
-        'ncore_resv',
-        'ncore_used',
-        'ncore_total',
-        'ncore_available',
-        'np_load',
-        'arch',
-        'status',
-        'hl:mem_total',
-        'hc:mem_req',
-        'slurm_state',
-    ]
-    rows = []
-    node_blocks = _split_scontrol_node_blocks(lines)
-    for node_block in node_blocks:
-        if 'NodeName=' not in node_block:
-            continue
-        params = _parse_key_value_fields(node_block)
-        node_name = params.get('NodeName', '')
-        if node_name=='':
-            continue
-        partition_raw = params.get('Partitions', '')
-        partitions = [ p.strip().rstrip('*') for p in partition_raw.split(',') if p.strip()!='' ]
-        partitions = [ p for p in partitions if p not in ['(null)', 'N/A'] ]
-        if len(partitions)==0:
+SLURM_NODE_COLUMNS = [
+    'queue_name',
+    'node_name',
+    'qtype',
+    'ncore_resv',
+    'ncore_used',
+    'ncore_total',
+    'ncore_available',
+    'np_load',
+    'arch',
+    'status',
+    'hl:mem_total',
+    'hc:mem_req',
+    'slurm_state',
+]
+
+def _split_slurm_partitions(partition_raw):
+    partitions = [ p.strip().rstrip('*') for p in partition_raw.split(',') if p.strip()!='' ]
+    return [ p for p in partitions if p not in ['(null)', 'N/A'] ]
+
+SCONTROL_NODE_KEYS = frozenset([
+    'NodeName', 'Partitions', 'CPUAlloc', 'CPUEfctv', 'CPUTot', 'RealMemory', 'AllocMem', 'FreeMem', 'State', 'Arch',
+])
+# get_scontrol_node_df keeps one row per node (SLURM_NODE_TABLE_COLUMNS) and
+# records partition membership as a CSR index: the nodes of partition_names[i]
+# are partition_nodes[partition_offsets[i]:partition_offsets[i+1]].
+SLURM_NODE_TABLE_COLUMNS = [ col for col in SLURM_NODE_COLUMNS if col!='queue_name' ]
+
+def _scontrol_node_record(params, partition_filter=None):
+    # Node-level fields of one NodeName=... entry and the partitions it belongs to.
+    node_name = params.get('NodeName', '')
+    if node_name=='':
+        return None
+    partitions = []
+    for partition in _split_slurm_partitions(params.get('Partitions', '')):
+        if (partition_filter is not None) and (partition not in partition_filter):
             continue
-        ncore_total = _safe_int(params.get('CPUEfctv', ''), default=0)
-        if ncore_total<=0:
-            ncore_total = _safe_int(params.get('CPUTot', ''), default=0)
-        ncore_total = max(ncore_total, 0)
-        ncore_used = max(_safe_int(params.get('CPUAlloc', ''), default=0), 0)
-        ncore_resv = 0
-        ncore_available = max(ncore_total - ncore_used - ncore_resv, 0)
-        mem_total_mb = max(_safe_int(params.get('RealMemory', ''), default=0), 0)
-        alloc_mem_mb = _safe_int(params.get('AllocMem', ''), default=-1)
-        if alloc_mem_mb>=0:
-            # Schedulable memory is constrained by Slurm's allocated memory,
-            # not by the OS-level free page count.
-            mem_available_mb = max(mem_total_mb - alloc_mem_mb, 0)
-        else:
-            mem_available_mb = _safe_int(params.get('FreeMem', ''), default=0)
-            mem_available_mb = max(mem_available_mb, 0)
-        slurm_state = params.get('State', '')
-        state_base = _normalize_slurm_node_state(slurm_state)
-        flags = _slurm_state_flags(slurm_state)
-        has_unavailable_flag = any((flag in SLURM_UNAVAILABLE_NODE_FLAGS) for flag in flags)
-        node_status = '' if ((state_base in SLURM_NORMAL_NODE_STATES) and (not has_unavailable_flag)) else slurm_state
-        arch = params.get('Arch', '')
-        for partition in partitions:
-            partition_status = ''
-            if partition_state_map is not None:
-                partition_state = partition_state_map.get(partition, '')
-                if not _partition_state_is_up(partition_state):
-                    partition_status = 'partition_state={}'.format(partition_state)
-            status = node_status
-            if (status!='') and (partition_status!=''):
-                status = '{}|{}'.format(status, partition_status)
-            elif partition_status!='':
-                status = partition_status
-            rows.append({
-                'queue_name': partition,
-                'node_name': node_name,
-                'qtype': 'SLURM',
-                'ncore_resv': ncore_resv,
-                'ncore_used': ncore_used,
-                'ncore_total': ncore_total,
-                'ncore_available': ncore_available,
-                'np_load': '',
-                'arch': arch,
-                'status': status,
-                'hl:mem_total': '{}M'.format(mem_total_mb),
-                'hc:mem_req': '{}M'.format(mem_available_mb),
-                'slurm_state': slurm_state,
-            })
-    df = pandas.DataFrame(rows, columns=columns)
-    if df.shape[0]==0:
-        return df
+        if partition not in partitions:
+            partitions.append(partition)
+    if len(partitions)==0:
+        return None
+    ncore_total = _safe_int(params.get('CPUEfctv', ''), default=0)
+    if ncore_total<=0:
+        ncore_total = _safe_int(params.get('CPUTot', ''), default=0)
+    ncore_total = max(ncore_total, 0)
+    ncore_used = max(_safe_int(params.get('CPUAlloc', ''), default=0), 0)
+    ncore_resv = 0
+    ncore_available = max(ncore_total - ncore_used - ncore_resv, 0)
+    mem_total_mb = max(_safe_int(params.get('RealMemory', ''), default=0), 0)
+    alloc_mem_mb = _safe_int(params.get('AllocMem', ''), default=-1)
+    if alloc_mem_mb>=0:
+        # Schedulable memory is constrained by Slurm's allocated memory,
+        # not by the OS-level free page count.
+        mem_available_mb = max(mem_total_mb - alloc_mem_mb, 0)
+    else:
+        mem_available_mb = _safe_int(params.get('FreeMem', ''), default=0)
+        mem_available_mb = max(mem_available_mb, 0)
+    slurm_state = params.get('State', '')
+    state_base = _normalize_slurm_node_state(slurm_state)
+    flags = _slurm_state_flags(slurm_state)
+    has_unavailable_flag = any((flag in SLURM_UNAVAILABLE_NODE_FLAGS) for flag in flags)
+    node_status = '' if ((state_base in SLURM_NORMAL_NODE_STATES) and (not has_unavailable_flag)) else slurm_state
+    row = {
+        'node_name': node_name,
+        'qtype': 'SLURM',
+        'ncore_resv': ncore_resv,
+        'ncore_used': ncore_used,
+        'ncore_total': ncore_total,
+        'ncore_available': ncore_available,
+        'np_load': '',
+        'arch': params.get('Arch', ''),
+        'status': node_status,
+        'hl:mem_total': '{}M'.format(mem_total_mb),
+        'hc:mem_req': '{}M'.format(mem_available_mb),
+        'slurm_state': slurm_state,
+    }
+    return row, partitions
+
+def _slurm_partition_status(partition, partition_state_map=None):
+    if partition_state_map is None:
+        return ''
+    partition_state = partition_state_map.get(partition, '')
+    if _partition_state_is_up(partition_state):
+        return ''
+    return 'partition_state={}'.format(partition_state)
+
+def _build_slurm_node_table(records, partition_state_map=None):
+    records = sorted(records, key=lambda record: record[0]['node_name'])
+    df_node = pandas.DataFrame([ record[0] for record in records ], columns=SLURM_NODE_TABLE_COLUMNS)
     for col in ['ncore_resv', 'ncore_used', 'ncore_total', 'ncore_available']:
-        df[col] = df[col].astype(int)
-    df = df.sort_values(by=['queue_name', 'node_name']).reset_index(drop=True)
+        df_node[col] = df_node[col].astype(int)
+    partition_names = sorted(set([ p for record in records for p in record[1] ]))
+    partition_codes = { p: i for i, p in enumerate(partition_names) }
+    pair_partition = numpy.array([ partition_codes[p] for record in records for p in record[1] ], dtype=numpy.int64)
+    pair_node = numpy.array([ i for i, record in enumerate(records) for _ in record[1] ], dtype=numpy.int64)
+    order = numpy.lexsort((pair_node, pair_partition))
+    partition_offsets = numpy.zeros(len(partition_names) + 1, dtype=numpy.int64)
+    partition_offsets[1:] = numpy.cumsum(numpy.bincount(pair_partition, minlength=len(partition_names)))
+    return {
+        'df_node': df_node,
+        'partition_names': numpy.array(partition_names, dtype=object),
+        'partition_status': numpy.array([ _slurm_partition_status(p, partition_state_map) for p in partition_names ], dtype=object),
+        'partition_offsets': partition_offsets,
+        'partition_nodes': pair_node[order],
+    }
+
+def get_slurm_partition_view(node_table):
+    # Expands the node table to one row per (partition, node) in the
+    # SLURM_NODE_COLUMNS layout shared with the UGE queue-instance tables.
+    # A non-UP partition state is appended to the node status of its rows.
+    df_node = node_table['df_node']
+    counts = numpy.diff(node_table['partition_offsets'])
+    df = df_node.take(node_table['partition_nodes']).reset_index(drop=True)
+    df.insert(0, 'queue_name', numpy.repeat(node_table['partition_names'], counts).tolist())
+    node_status = df['status'].to_numpy(dtype=object)
+    partition_status = numpy.repeat(node_table['partition_status'], counts)
+    has_node_status = (node_status!='')
+    has_partition_status = (partition_status!='')
+    status = numpy.where(has_partition_status, partition_status, node_status)
+    is_both = has_node_status & has_partition_status
+    status[is_both] = node_status[is_both] + '|' + partition_status[is_both]
+    df['status'] = status.tolist()
     return df
 
+def get_slurm_cluster_view(node_table):
+    # The node table with one row per node for the cluster-wide "all" rollup.
+    # A node whose partitions are all non-UP is abnormal in every partition row,
+    # so it gets the status of its first such partition here as well.
+    df = node_table['df_node'].copy()
+    num_node = df.shape[0]
+    counts = numpy.diff(node_table['partition_offsets'])
+    pair_node = node_table['partition_nodes']
+    pair_status = numpy.repeat(node_table['partition_status'], counts)
+    is_pair_down = (pair_status!='')
+    num_pair = numpy.bincount(pair_node, minlength=num_node)
+    num_down = numpy.bincount(pair_node[is_pair_down], minlength=num_node)
+    is_down = (num_pair>0) & (num_down==num_pair)
+    if not is_down.any():
+        return df
+    down_nodes, first_pair = numpy.unique(pair_node[is_pair_down], return_index=True)
+    partition_status = numpy.full(num_node, '', dtype=object)
+    partition_status[down_nodes] = pair_status[is_pair_down][first_pair]
+    node_status = df['status'].to_numpy(dtype=object)
+    status = node_status.copy()
+    status[is_down] = numpy.where(node_status[is_down]!='',
+                                  node_status[is_down] + '|' + partition_status[is_down],
+                                  partition_status[is_down])
+    df['status'] = status.tolist()
+    return df
+
+def _scontrol_node_block_partitions(node_block):
+    # Reads only the Partitions=... value so that nodes outside --partition are
+    # skipped before the whole block is tokenized.
+    start = node_block.find(' Partitions=')
+    if start<0:
+        if not node_block.startswith('Partitions='):
+            return ''
+        start = 0
+    else:
+        start += 1
+    start += len('Partitions=')
+    end = node_block.find(' ', start)
+    return node_block[start:] if end<0 else node_block[start:end]
+
+def _scontrol_node_records(lines, partitions=None):
+    records = []
+    partition_filter = set(partitions) if partitions else None
+    node_blocks = _split_scontrol_node_blocks(lines)
+    for node_block in node_blocks:
+        if 'NodeName=' not in node_block:
+            continue
+        if partition_filter is not None:
+            block_partitions = _split_slurm_partitions(_scontrol_node_block_partitions(node_block))
+            if partition_filter.isdisjoint(block_partitions):
+                continue
+        params = _parse_key_value_fields(node_block, keys=SCONTROL_NODE_KEYS)
+        record = _scontrol_node_record(params, partition_filter=partition_filter)
+        if record is not None:
+            records.append(record)
+    return records
+
+def get_scontrol_node_table(lines, partition_state_map=None, partitions=None):
+    records = _scontrol_node_records(lines, partitions=partitions)
+    return _build_slurm_node_table(records, partition_state_map=partition_state_map)
+
+def get_scontrol_node_df(lines, partition_state_map=None, partitions=None):
+    node_table = get_scontrol_node_table(lines, partition_state_map=partition_state_map, partitions=partitions)
+    return get_slurm_partition_view(node_table)
+
+def command_has_json_option(command_str):
+    try:
+        command = shlex.split(command_str)
+    except ValueError:
+        return False
+    return any((token=='--json') or token.startswith('--json=') for token in command[1:])
+
+def _iter_json_array_items(lines, array_key):
+    # Decodes the elements of one top-level array (e.g. "jobs" of squeue --json)
+    # one at a time with raw_decode. Only the current element and the unread
+    # text are held; other top-level values (meta, warnings) are decoded and
+    # dropped. The buffer grows geometrically when an element is incomplete,
+    # so elements spread over many lines are still decoded in linear time.
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+    line_iter = iter(lines)
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def read_more():
+        if state['eof']:
+            return False
+        if state['pos']>0:
+            state['buf'] = state['buf'][state['pos']:]
+            state['pos'] = 0
+        chunks = []
+        target = max(65536, len(state['buf']))
+        num_char = 0
+        for line in line_iter:
+            chunks.append(line if line.endswith('\n') else line + '\n')
+            num_char += len(chunks[-1])
+            if num_char>=target:
+                break
+        else:
+            state['eof'] = True
+        state['buf'] += ''.join(chunks)
+        return len(chunks)>0
+
+    def skip_whitespace():
+        while True:
+            state['pos'] = whitespace.match(state['buf'], state['pos']).end()
+            if state['pos']<len(state['buf']):
+                return state['buf'][state['pos']]
+            if not read_more():
+                return ''
+
+    def decode_value():
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['buf'], state['pos'])
+            except json.JSONDecodeError as e:
+                if read_more():
+                    continue
+                raise KFBatchCommandError('Failed to parse JSON output: {}'.format(e))
+            if (end==len(state['buf'])) and read_more():
+                continue # a number may continue in the next chunk
+            state['pos'] = end
+            return value
+
+    def expect(char):
+        if skip_whitespace()!=char:
+            txt = 'Failed to parse JSON output: expected "{}" at character {}'
+            raise KFBatchCommandError(txt.format(char, state['pos']))
+        state['pos'] += 1
+
+    expect('{')
+    while True:
+        char = skip_whitespace()
+        if char in ['}', '']:
+            return
+        if char==',':
+            state['pos'] += 1
+            continue
+        key = decode_value()
+        expect(':')
+        if key!=array_key:
+            decode_value()
+            continue
+        expect('[')
+        while True:
+            char = skip_whitespace()
+            if char==']':
+                state['pos'] += 1
+                break
+            if char==',':
+                state['pos'] += 1
+                continue
+            if char=='':
+                raise KFBatchCommandError('Failed to parse JSON output: unterminated "{}" array'.format(array_key))
+            yield decode_value()
+
+def _slurm_json_number(value, default=None):
+    # Slurm >= 23.02 wraps numbers as {"set": ..., "infinite": ..., "number": ...}.
+    if isinstance(value, dict):
+        if value.get('infinite', False):
+            return float('inf')
+        if not value.get('set', True):
+            return default
+        value = value.get('number', default)
+    if value is None:
+        return default
+    return value
+
+def _slurm_json_text(value, sep='+'):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return sep.join([str(v) for v in value])
+    return str(value)
+
+def _format_slurm_duration(seconds):
+    # Same layout as squeue %M/%l: [D-]H:MM:SS, or M:SS under an hour.
+    seconds = max(int(seconds), 0)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days>0:
+        return '{}-{:02d}:{:02d}:{:02d}'.format(days, hours, minutes, seconds)
+    if hours>0:
+        return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+    return '{}:{:02d}'.format(minutes, seconds)
+
+def _squeue_json_job_fields(job, now):
+    job_id = str(_slurm_json_number(job.get('job_id'), default=''))
+    array_job_id = _slurm_json_number(job.get('array_job_id'), default=0)
+    array_task_id = _slurm_json_number(job.get('array_task_id'))
+    array_task_string = _slurm_json_text(job.get('array_task_string'), sep=',')
+    if array_job_id and (array_task_string!=''):
+        max_tasks = _slurm_json_number(job.get('array_max_tasks'), default=0)
+        if max_tasks:
+            array_task_string += '%{}'.format(max_tasks)
+        job_id = '{}_[{}]'.format(array_job_id, array_task_string)
+    elif array_job_id and (array_task_id is not None):
+        job_id = '{}_{}'.format(array_job_id, array_task_id)
+    state = _normalize_slurm_job_state(_slurm_json_text(job.get('job_state')).split('+')[0])
+    start_time = _slurm_json_number(job.get('start_time'), default=0)
+    elapsed_time = '0:00'
+    if (state in SLURM_RUNNING_STATES) and start_time and (start_time<now):
+        elapsed_time = _format_slurm_duration(now - start_time)
+    num_cpus = _slurm_json_number(job.get('cpus'), default='')
+    num_nodes = _slurm_json_number(job.get('node_count'), default='')
+    memory_mb = _slurm_json_number(job.get('memory_per_node'))
+    if memory_mb is None:
+        # --mem-per-cpu: req_mem is per node like squeue %m, so the per-CPU
+        # amount is scaled by the CPUs on each node.
+        memory_mb = _slurm_json_number(job.get('memory_per_cpu'))
+        if (memory_mb is not None) and (num_cpus!=''):
+            memory_mb = int(memory_mb * num_cpus / max(_safe_int(num_nodes, default=1), 1))
+    req_mem = '' if memory_mb is None else '{}M'.format(memory_mb)
+    time_limit = _slurm_json_number(job.get('time_limit'))
+    if time_limit is None:
+        time_limit = ''
+    elif time_limit==float('inf'):
+        time_limit = 'UNLIMITED'
+    else:
+        time_limit = _format_slurm_duration(time_limit * 60)
+    if state in SLURM_PENDING_STATES:
+        node_or_reason = '({})'.format(_slurm_json_text(job.get('state_reason'), sep=','))
+    else:
+        node_or_reason = _slurm_json_text(job.get('nodes'), sep=',')
+    return [
+        job_id,
+        _slurm_json_text(job.get('partition'), sep=','),
+        _slurm_json_text(job.get('name')),
+        _slurm_json_text(job.get('user_name')),
+        state,
+        elapsed_time,
+        str(num_nodes),
+        str(num_cpus),
+        req_mem,
+        time_limit,
+        node_or_reason,
+        True,
+    ]
+
+def get_squeue_json_user_df(lines, now=None, detail_columns=True):
+    # squeue --json backend: the same columns as get_squeue_user_df.
+    if now is None:
+        now = time.time()
+    rows = [ _squeue_json_job_fields(job, now) for job in _iter_json_array_items(lines, 'jobs') ]
+    if len(rows)==0:
+        return pandas.DataFrame(columns=get_squeue_columns(detail_columns))
+    df = pandas.DataFrame(rows, columns=SLURM_SQUEUE_COLUMNS[:11] + ['resource_fields_complete'])
+    return _finalize_squeue_df(df, detail_columns=detail_columns)
+
+def get_scontrol_partition_json_df(lines):
+    rows = []
+    for partition in _iter_json_array_items(lines, 'partitions'):
+        partition_name = _slurm_json_text(partition.get('name'))
+        state = partition.get('state')
+        if isinstance(partition.get('partition'), dict):
+            state = partition['partition'].get('state', state)
+        if partition_name=='':
+            continue
+        rows.append({
+            'partition_name': partition_name,
+            'partition_state': _slurm_json_text(state),
+        })
+    return pandas.DataFrame(rows, columns=['partition_name', 'partition_state'])
+
+def _scontrol_node_json_params(node):
+    # Maps a node object of scontrol --json show node onto the NodeName=... keys.
+    params = {
+        'NodeName': _slurm_json_text(node.get('name')),
+        'Partitions': _slurm_json_text(node.get('partitions'), sep=','),
+        'State': _slurm_json_text(node.get('state')),
+        'Arch': _slurm_json_text(node.get('architecture')),
+    }
+    for key, json_key in [('CPUTot', 'cpus'), ('CPUEfctv', 'effective_cpus'), ('CPUAlloc', 'alloc_cpus'),
+                          ('RealMemory', 'real_memory'), ('AllocMem', 'alloc_memory'), ('FreeMem', 'free_mem')]:
+        value = _slurm_json_number(node.get(json_key))
+        if value is not None:
+            params[key] = str(value)
+    return params
+
+def _scontrol_node_json_records(lines, partitions=None):
+    records = []
+    partition_filter = set(partitions) if partitions else None
+    for node in _iter_json_array_items(lines, 'nodes'):
+        if partition_filter is not None:
+            block_partitions = _split_slurm_partitions(_slurm_json_text(node.get('partitions'), sep=','))
+            if partition_filter.isdisjoint(block_partitions):
+                continue
+        record = _scontrol_node_record(_scontrol_node_json_params(node), partition_filter=partition_filter)
+        if record is not None:
+            records.append(record)
+    return records
+
+def get_scontrol_node_json_table(lines, partition_state_map=None, partitions=None):
+    records = _scontrol_node_json_records(lines, partitions=partitions)
+    return _build_slurm_node_table(records, partition_state_map=partition_state_map)
+
+def get_scontrol_node_json_df(lines, partition_state_map=None, partitions=None):
+    node_table = get_scontrol_node_json_table(lines, partition_state_map=partition_state_map, partitions=partitions)
+    return get_slurm_partition_view(node_table)
+
+def get_scontrol_reservation_json_df(lines, now=None):
+    # JSON reservations carry no State field; a reservation is ACTIVE between
+    # its start_time and end_time and upcoming ones are kept as not active.
+    if now is None:
+        now = time.time()
+    rows = []
+    for reservation in _iter_json_array_items(lines, 'reservations'):
+        start_time = _slurm_json_number(reservation.get('start_time'), default=0)
+        end_time = _slurm_json_number(reservation.get('end_time'), default=float('inf'))
+        header_params = {
+            'ReservationName': _slurm_json_text(reservation.get('name')),
+            'StartTime': start_time,
+            'EndTime': end_time,
+            'PartitionName': _slurm_json_text(reservation.get('partition')),
+            'Nodes': _slurm_json_text(reservation.get('node_list'), sep=','),
+            'NodeCnt': str(_slurm_json_number(reservation.get('node_count'), default='')),
+            'CoreCnt': str(_slurm_json_number(reservation.get('core_count'), default='')),
+            'TRES': _slurm_json_text(reservation.get('tres'), sep=','),
+            'State': 'ACTIVE' if (start_time<=now<end_time) else 'INACTIVE',
+        }
+        node_params = [
+            {'NodeName': _slurm_json_text(spec.get('node')), 'CoreIDs': _slurm_json_text(spec.get('core'), sep=',')}
+            for spec in (reservation.get('core_specializations') or [])
+        ]
+        rows.extend(_scontrol_reservation_rows(header_params, node_params))
+    return pandas.DataFrame(rows, columns=SLURM_RESERVATION_COLUMNS)
+
 def _normalize_slurm_job_state(state_raw):
     if state_raw is None:
         return ''
@@ -913,31 +1894,18 @@ def print_queued_job_summary(df_user, scheduler='uge', current_user=''):
             print('No jobs found in squeue output.')
             print('')
             return
-        state_codes = df_user['state'].fillna('').map(_normalize_slurm_job_state)
+        state_codes = df_user['state'].astype(object).fillna('').map(_normalize_slurm_job_state)
         is_running = state_codes.isin(SLURM_RUNNING_STATES)
         is_qwaiting = state_codes.isin(SLURM_PENDING_STATES)
         is_error = state_codes.isin(SLURM_ERROR_STATES)
-        num_running = int(df_user.loc[is_running, 'total_slots'].sum())
-        num_qwaiting = int(df_user.loc[is_qwaiting, 'total_slots'].sum())
-        num_error = int(df_user.loc[is_error, 'total_slots'].sum())
+        num_all = [int(df_user.loc[is_state, 'total_slots'].sum()) for is_state in [is_running, is_qwaiting, is_error]]
+        num_self = None
         if (current_user!='') and ('user' in df_user.columns):
-            is_self = (df_user['user'].fillna('')==current_user)
-            num_running_self = int(df_user.loc[is_running & is_self, 'total_slots'].sum())
-            num_qwaiting_self = int(df_user.loc[is_qwaiting & is_self, 'total_slots'].sum())
-            num_error_self = int(df_user.loc[is_error & is_self, 'total_slots'].sum())
-            print('jobs  self:R/Q/F={}/{}/{}  all:R/Q/F={}/{}/{}'.format(
-                num_running_self, num_qwaiting_self, num_error_self,
-                num_running, num_qwaiting, num_error,
-            ))
-        else:
-            print('# of running job tasks (estimated from squeue): {}'.format(num_running))
-            print('# of queued job tasks (estimated from squeue): {}'.format(num_qwaiting))
-            print('# of failed/cancelled job tasks (estimated from squeue): {}'.format(num_error))
+            is_self = (df_user['user'].astype(object).fillna('')==current_user)
+            num_self = [int(df_user.loc[is_state & is_self, 'total_slots'].sum())
+                        for is_state in [is_running, is_qwaiting, is_error]]
         num_estimated_rows = int(df_user['task_count_estimated'].sum())
-        if num_estimated_rows>0:
-            txt = 'note: {} row(s) had truncated/irregular SLURM array IDs; task counts are estimated.'
-            print(txt.format(num_estimated_rows))
-        print('')
+        _print_slurm_job_counts(num_all, num_self, num_estimated_rows)
         return
     is_running = df_user['state'].str.contains('r', regex=False)
     is_qwaiting = df_user['state'].str.contains('qw', regex=False)
@@ -950,6 +1918,98 @@ def print_queued_job_summary(df_user, scheduler='uge', current_user=''):
     print('# of CPUs for queued/running jobs in error: {}'.format(num_error))
     print('')
 
+def _print_slurm_job_counts(num_all, num_self, num_estimated_rows):
+    # num_all and num_self are [running, queued, failed] task counts; num_self
+    # is None when the current user is unknown.
+    if num_self is not None:
+        print('jobs  self:R/Q/F={}/{}/{}  all:R/Q/F={}/{}/{}'.format(*(list(num_self) + list(num_all))))
+    else:
+        print('# of running job tasks (estimated from squeue): {}'.format(num_all[0]))
+        print('# of queued job tasks (estimated from squeue): {}'.format(num_all[1]))
+        print('# of failed/cancelled job tasks (estimated from squeue): {}'.format(num_all[2]))
+    if num_estimated_rows>0:
+        txt = 'note: {} row(s) had truncated/irregular SLURM array IDs; task counts are estimated.'
+        print(txt.format(num_estimated_rows))
+    print('')
+
+def _iter_squeue_job_fields(lines, is_json=False):
+    # Row-at-a-time counterpart of get_squeue_user_df/get_squeue_json_user_df
+    # yielding the raw squeue fields.
+    if is_json:
+        now = time.time()
+        for job in _iter_json_array_items(lines, 'jobs'):
+            yield _squeue_json_job_fields(job, now)
+        return
+    for raw_line in lines:
+        line = raw_line[:-1] if raw_line.endswith('\n') else raw_line
+        if (line.strip()=='') or line.lstrip().startswith('JOBID '):
+            continue
+        if (line.count('\t')==10) and ('\r' not in line):
+            yield [item.strip() for item in line.split('\t')] + [True]
+            continue
+        row = _split_squeue_line(line)
+        if row is not None:
+            yield row
+
+def get_squeue_job_counts(lines, is_json=False, partitions=None, users=None):
+    # Aggregate-only squeue parser: task counts are summed per (user, state
+    # code) while the output streams by, so memory does not grow with the
+    # number of jobs and no per-job table is built.
+    task_counts = {}
+    state_codes = {}
+    num_job = 0
+    num_estimated_rows = 0
+    partition_filter = set(partitions) if partitions else None
+    user_filter = set(users) if users else None
+    for fields in _iter_squeue_job_fields(lines, is_json=is_json):
+        job_id, user, state = fields[0], fields[3], fields[4]
+        if (user_filter is not None) and (user not in user_filter):
+            continue
+        if (partition_filter is not None) and partition_filter.isdisjoint(fields[1].split(',')):
+            continue
+        if state not in state_codes:
+            state_codes[state] = _normalize_slurm_job_state(state)
+        num_tasks, is_estimated = estimate_slurm_task_count(job_id)
+        key = (user, state_codes[state])
+        task_counts[key] = task_counts.get(key, 0) + num_tasks
+        num_job += 1
+        num_estimated_rows += int(is_estimated)
+    return {'task_counts': task_counts, 'num_job': num_job, 'num_estimated_rows': num_estimated_rows}
+
+def print_squeue_job_counts(job_counts, current_user=''):
+    if job_counts['num_job']==0:
+        print('No jobs found in squeue output.')
+        print('')
+        return
+    state_sets = [SLURM_RUNNING_STATES, SLURM_PENDING_STATES, SLURM_ERROR_STATES]
+    num_all = [0, 0, 0]
+    num_self = [0, 0, 0]
+    for (user, state_code), num_tasks in job_counts['task_counts'].items():
+        for i, state_set in enumerate(state_sets):
+            if state_code in state_set:
+                num_all[i] += num_tasks
+                if user==current_user:
+                    num_self[i] += num_tasks
+    _print_slurm_job_counts(num_all, num_self if current_user!='' else None, job_counts['num_estimated_rows'])
+
+def jobs_main(args):
+    scheduler = get_scheduler_from_command(args.stat_command)
+    if scheduler!='slurm':
+        raise KFBatchUsageError('Exiting. --mode jobs supports squeue in --stat_command only: {}'.format(args.stat_command))
+    partitions = get_filter_values(getattr(args, 'partition', ''))
+    users = get_filter_values(getattr(args, 'user', ''))
+    squeue_command = get_squeue_filter_command(get_squeue_command_for_parsing(args.stat_command), partitions, users)
+    is_json = command_has_json_option(squeue_command)
+    job_counts = parse_command_stdout(
+        lambda lines: get_squeue_job_counts(lines, is_json=is_json, partitions=partitions, users=users),
+        command_str=squeue_command,
+        example_file=args.example_file,
+        command_name='--stat_command',
+        budget=get_command_budget(args),
+    )
+    print_squeue_job_counts(job_counts, current_user=get_current_user_name())
+    print_command_notes(args)
+
 def get_current_user_name():
     user_name = os.environ.get('USER', '').strip()
     if user_name!='':
@@ -977,6 +2037,11 @@ def get_slurm_launch_heuristic_df(df_node, df_job, df_prio=None, current_user=''
     if (df_node is None) or (df_node.shape[0]==0):
         return pandas.DataFrame(columns=columns)
     rows = []
+    df_self_pending = None
+    if (current_user!='') and (df_job is not None) and (df_job.shape[0]>0):
+        state_codes = df_job['state'].astype(object).fillna('').map(_normalize_slurm_job_state)
+        is_self_pending = (df_job['user']==current_user) & state_codes.isin(SLURM_PENDING_STATES)
+        df_self_pending = df_job.loc[is_self_pending, :]
     queue_names = sorted([q for q in df_node['queue_name'].dropna().unique().tolist() if not str(q).startswith('login')])
     for queue_name in queue_names:
         df_queue = df_node.loc[(df_node['queue_name']==queue_name) & (df_node['status']==''), :].copy()
@@ -1009,14 +2074,8 @@ def get_slurm_launch_heuristic_df(df_node, df_job, df_prio=None, current_user=''
         blocked_req_mem_gib = None
         blocked_time_limit = ''
         status = 'resource_only'
-        if (current_user!='') and (df_job is not None) and (df_job.shape[0]>0):
-            state_codes = df_job['state'].fillna('').map(_normalize_slurm_job_state)
-            user_pending = df_job.loc[
-                (df_job['partition']==queue_name) &
-                (df_job['user']==current_user) &
-                state_codes.isin(SLURM_PENDING_STATES),
-                :
-            ].copy()
+        if df_self_pending is not None:
+            user_pending = df_self_pending.loc[df_self_pending['partition']==queue_name, :].copy()
             if user_pending.shape[0]>0:
                 if (df_prio is not None) and (df_prio.shape[0]>0):
                     df_prio_queue = df_prio.loc[df_prio['partition']==queue_name, :].copy()
@@ -1030,7 +2089,7 @@ def get_slurm_launch_heuristic_df(df_node, df_job, df_prio=None, current_user=''
                             priority_gap = top_priority - user_best_priority
                             fairshare_gap = top_fairshare - user_best_fairshare
                 user_priority_pending = user_pending.loc[
-                    user_pending['pending_reason'].fillna('').str.contains('Priority', case=False, regex=False),
+                    user_pending['pending_reason'].astype(object).fillna('').str.contains('Priority', case=False, regex=False),
                     :
                 ].copy()
                 if user_priority_pending.shape[0]>0:
@@ -1044,7 +2103,7 @@ def get_slurm_launch_heuristic_df(df_node, df_job, df_prio=None, current_user=''
                     recommended_mem_gib = None
                     if valid_priority_pending.shape[0]>0:
                         valid_priority_pending['req_mem_gib'] = _memory_series_to_gib(valid_priority_pending['req_mem'])
-                        valid_priority_pending['time_limit_minutes'] = valid_priority_pending['time_limit'].map(_slurm_time_to_minutes)
+                        valid_priority_pending['time_limit_minutes'] = valid_priority_pending['time_limit'].astype(object).map(_slurm_time_to_minutes).astype(float)
                         valid_priority_pending = valid_priority_pending.sort_values(
                             by=['req_cpus', 'req_mem_gib', 'time_limit_minutes', 'job_id'],
                             ascending=[True, True, True, True],
@@ -1114,6 +2173,120 @@ def print_slurm_launch_heuristic(df_launch, current_user=''):
             print('  note: current user has Priority-blocked jobs, but request size is unavailable in the current squeue format')
     print('')
 
+def get_uge_launch_heuristic_df(df_node, df_pending, current_user=''):
+    # Same schema as get_slurm_launch_heuristic_df. df_pending comes from
+    # _finalize_uge_pending_jobs (one row per requested queues and user). Its
+    # rows are joined to queues once (jobs without a hard queue request compete
+    # everywhere), and every per-queue figure comes from one groupby/merge
+    # instead of a filter per queue.
+    columns = [
+        'queue_name',
+        'recommended_cores',
+        'recommended_mem_gib',
+        'top_node_name',
+        'top_node_cores',
+        'top_node_mem_gib',
+        'priority_gap',
+        'ticket_gap',
+        'blocked_req_cores',
+        'blocked_req_mem_gib',
+        'status',
+    ]
+    if (df_node is None) or (df_node.shape[0]==0):
+        return pandas.DataFrame(columns=columns)
+    df_node = df_node.loc[~df_node['queue_name'].astype(str).str.startswith('login'), :]
+    queue_names = sorted(df_node['queue_name'].dropna().unique().tolist())
+    df_launch = pandas.DataFrame({'queue_name': queue_names})
+    df_top = df_node.loc[(df_node['status']==''), ['queue_name', 'node_name', 'ncore_available', 'hc:mem_req']].copy()
+    df_top['top_node_mem_gib'] = _memory_series_to_gib(df_top['hc:mem_req'])
+    df_top = (
+        df_top
+        .sort_values(by=['queue_name', 'ncore_available', 'top_node_mem_gib', 'node_name'], ascending=[True, False, False, True])
+        .drop_duplicates(subset='queue_name')
+        .rename(columns={'node_name': 'top_node_name', 'ncore_available': 'top_node_cores'})
+        .loc[:, ['queue_name', 'top_node_name', 'top_node_cores', 'top_node_mem_gib']]
+    )
+    df_launch = df_launch.merge(df_top, how='left', on='queue_name')
+    has_node = df_launch['top_node_name'].notna()
+    df_launch['top_node_name'] = df_launch['top_node_name'].fillna('')
+    df_launch['top_node_cores'] = df_launch['top_node_cores'].fillna(0).astype(int)
+    df_launch['top_node_mem_gib'] = df_launch['top_node_mem_gib'].fillna(0.0).astype(float)
+    df_launch['recommended_cores'] = df_launch['top_node_cores'].astype(object)
+    df_launch['recommended_mem_gib'] = df_launch['top_node_mem_gib'].astype(object)
+    df_launch['status'] = numpy.where(has_node, 'resource_only', 'no_normal_nodes')
+    for col in ['priority_gap', 'ticket_gap', 'blocked_req_cores', 'blocked_req_mem_gib']:
+        df_launch[col] = None
+    if (current_user=='') or (df_pending is None) or (df_pending.shape[0]==0):
+        return df_launch.loc[:, columns]
+    df_pair = df_pending.loc[:, ['job_id', 'user', 'prior', 'ntckts', 'queue_name', 'slots', 'mem_gib']].copy()
+    df_pair['queue_name'] = df_pair['queue_name'].str.split(',')
+    df_pair = df_pair.explode('queue_name')
+    is_any = (df_pair['queue_name']=='')
+    df_any = df_pair.loc[is_any, :].drop(columns='queue_name').merge(df_launch.loc[:, ['queue_name']], how='cross')
+    df_pair = pandas.concat([df_pair.loc[~is_any, :], df_any], ignore_index=True)
+    df_pair = df_pair.loc[df_pair['queue_name'].isin(queue_names), :]
+    df_all = df_pair.groupby('queue_name').agg(top_prior=('prior', 'max'), top_ntckts=('ntckts', 'max'))
+    df_mine = df_pair.loc[(df_pair['user']==current_user), :]
+    if df_mine.shape[0]==0:
+        return df_launch.loc[:, columns]
+    df_user_best = df_mine.groupby('queue_name').agg(user_prior=('prior', 'max'), user_ntckts=('ntckts', 'max'))
+    df_smallest = (
+        df_mine
+        .sort_values(by=['queue_name', 'slots', 'mem_gib', 'job_id'])
+        .drop_duplicates(subset='queue_name')
+        .set_index('queue_name')
+        .loc[:, ['slots', 'mem_gib']]
+    )
+    df_gap = df_user_best.join(df_all, how='left').join(df_smallest, how='left')
+    df_gap['priority_gap'] = df_gap['top_prior'] - df_gap['user_prior']
+    df_gap['ticket_gap'] = df_gap['top_ntckts'] - df_gap['user_ntckts']
+    df_launch = df_launch.drop(columns=['priority_gap', 'ticket_gap']).merge(
+        df_gap.loc[:, ['priority_gap', 'ticket_gap', 'slots', 'mem_gib']], how='left', left_on='queue_name', right_index=True)
+    is_blocked = (df_launch['priority_gap']>0) & (df_launch['status']=='resource_only')
+    df_launch.loc[is_blocked, 'blocked_req_cores'] = df_launch.loc[is_blocked, 'slots'].astype(int)
+    df_launch.loc[is_blocked, 'blocked_req_mem_gib'] = df_launch.loc[is_blocked, 'mem_gib']
+    df_launch.loc[is_blocked, 'recommended_cores'] = None
+    df_launch.loc[is_blocked, 'recommended_mem_gib'] = None
+    df_launch.loc[is_blocked, 'status'] = 'priority_blocked'
+    for col in ['priority_gap', 'ticket_gap']:
+        df_launch[col] = df_launch[col].astype(object).where(df_launch[col].notna(), None)
+    return df_launch.loc[:, columns]
+
+def print_uge_launch_heuristic(df_launch, current_user=''):
+    if (df_launch is None) or (df_launch.shape[0]==0):
+        return
+    subject = 'current user'
+    if current_user!='':
+        subject = current_user
+    print('Reporting heuristic single-node launch ceilings for {} (priority-aware):'.format(subject))
+    for i in df_launch.index:
+        queue_name = df_launch.at[i, 'queue_name']
+        recommended_cores = df_launch.at[i, 'recommended_cores']
+        recommended_mem_gib = df_launch.at[i, 'recommended_mem_gib']
+        top_node_name = df_launch.at[i, 'top_node_name']
+        status = str(df_launch.at[i, 'status'])
+        print('{}:'.format(queue_name))
+        if pandas.isna(recommended_cores):
+            print('  immediate-start ceiling: n/a')
+        else:
+            print('  immediate-start ceiling: <= {:,} CPUs and {:,.0f}G RAM'.format(int(recommended_cores), float(recommended_mem_gib)))
+        if top_node_name!='':
+            print('  top free node: {} has {:,} CPUs and {:,.0f}G RAM'.format(
+                top_node_name, int(df_launch.at[i, 'top_node_cores']), float(df_launch.at[i, 'top_node_mem_gib'])))
+        blocked_req_cores = df_launch.at[i, 'blocked_req_cores']
+        if pandas.notna(blocked_req_cores):
+            print('  smallest out-prioritized pending request is {} CPUs / {:.0f}G'.format(
+                int(blocked_req_cores), float(df_launch.at[i, 'blocked_req_mem_gib'])))
+        priority_gap = df_launch.at[i, 'priority_gap']
+        if pandas.notna(priority_gap):
+            print('  priority gap: {:.5f}'.format(float(priority_gap)))
+        ticket_gap = df_launch.at[i, 'ticket_gap']
+        if pandas.notna(ticket_gap):
+            print('  ticket gap: {:.5f}'.format(float(ticket_gap)))
+        if status=='priority_blocked':
+            print('  note: higher-priority pending jobs compete for this queue; no stable immediate-start ceiling can be inferred')
+    print('')
+
 def _format_slurm_compact_time_limit(time_limit):
     txt = str(time_limit).strip()
     if txt in ['', 'nan', 'N/A', 'NOT_SET']:
@@ -1170,7 +2343,43 @@ def _format_slurm_compact_launch_row(row):
         return 'n/a'
     return '<={}c/{:.0f}G'.format(int(recommended_cores), float(recommended_mem_gib))
 
-def print_slurm_compact_summary(df, df_launch, args):
+def _slurm_compact_summary_row(label, df_queue, args, launch_row=None):
+    is_abnormal_status = (df_queue['status']!='')
+    num_abnormal_node = int(is_abnormal_status.sum())
+    num_node = int(df_queue.shape[0])
+    num_working_node = num_node - num_abnormal_node
+    ncore_total = int(df_queue.loc[:, 'ncore_total'].sum())
+    ncore_used = int(df_queue.loc[~is_abnormal_status, 'ncore_used'].sum())
+    ncore_available = int(df_queue.loc[~is_abnormal_status, 'ncore_available'].sum())
+    mem_total = float(df_queue.loc[:, 'hl:mem_total'].sum())
+    mem_available = float(df_queue.loc[~is_abnormal_status, 'hc:mem_req'].sum())
+    if args.exclude_abnormal_node:
+        df_normal = df_queue.loc[~is_abnormal_status, :].copy()
+    else:
+        df_normal = df_queue.copy()
+    if df_normal.shape[0]>0:
+        df_top_cpu = df_normal.sort_values(by=['ncore_available', 'hc:mem_req', 'node_name'], ascending=[False, False, True]).reset_index(drop=True)
+        df_top_ram = df_normal.sort_values(by=['hc:mem_req', 'ncore_available', 'node_name'], ascending=[False, False, True]).reset_index(drop=True)
+        top_cpu = _format_slurm_compact_node(df_top_cpu.at[0, 'node_name'], df_top_cpu.at[0, 'ncore_available'], df_top_cpu.at[0, 'hc:mem_req'])
+        top_ram = _format_slurm_compact_node(df_top_ram.at[0, 'node_name'], df_top_ram.at[0, 'ncore_available'], df_top_ram.at[0, 'hc:mem_req'])
+        if top_cpu==top_ram:
+            top_ram = 'same'
+    else:
+        top_cpu = '-'
+        top_ram = '-'
+    return {
+        'part': str(label),
+        'nodes': '{}/{}/{}'.format(num_working_node, num_abnormal_node, num_node),
+        'cpu(a/u/t)': '{}/{}/{}'.format(ncore_available, ncore_used, ncore_total),
+        'ram(a/t)G': '{:.0f}/{:.0f}'.format(mem_available, mem_total),
+        'topCPU': top_cpu,
+        'topRAM': top_ram,
+        'launch': _format_slurm_compact_launch_row(launch_row),
+    }
+
+def print_slurm_compact_summary(df, df_launch, args, df_cluster=None):
+    # df_cluster, if given, has one row per node and adds an "all" row in which
+    # nodes shared by several partitions are counted once.
     queue_names = [ q for q in df['queue_name'].unique().tolist() if not str(q).startswith('login') ]
     launch_rows = {}
     if (df_launch is not None) and (df_launch.shape[0]>0):
@@ -1180,38 +2389,11 @@ def print_slurm_compact_summary(df, df_launch, args):
     rows = []
     for queue_name in queue_names:
         df_queue = df.loc[(df['queue_name']==queue_name), :].reset_index(drop=True)
-        is_abnormal_status = (df_queue['status']!='')
-        num_abnormal_node = int(is_abnormal_status.sum())
-        num_node = int(df_queue.shape[0])
-        num_working_node = num_node - num_abnormal_node
-        ncore_total = int(df_queue.loc[:, 'ncore_total'].sum())
-        ncore_used = int(df_queue.loc[~is_abnormal_status, 'ncore_used'].sum())
-        ncore_available = int(df_queue.loc[~is_abnormal_status, 'ncore_available'].sum())
-        mem_total = float(df_queue.loc[:, 'hl:mem_total'].sum())
-        mem_available = float(df_queue.loc[~is_abnormal_status, 'hc:mem_req'].sum())
-        if args.exclude_abnormal_node:
-            df_normal = df_queue.loc[~is_abnormal_status, :].copy()
-        else:
-            df_normal = df_queue.copy()
-        if df_normal.shape[0]>0:
-            df_top_cpu = df_normal.sort_values(by=['ncore_available', 'hc:mem_req', 'node_name'], ascending=[False, False, True]).reset_index(drop=True)
-            df_top_ram = df_normal.sort_values(by=['hc:mem_req', 'ncore_available', 'node_name'], ascending=[False, False, True]).reset_index(drop=True)
-            top_cpu = _format_slurm_compact_node(df_top_cpu.at[0, 'node_name'], df_top_cpu.at[0, 'ncore_available'], df_top_cpu.at[0, 'hc:mem_req'])
-            top_ram = _format_slurm_compact_node(df_top_ram.at[0, 'node_name'], df_top_ram.at[0, 'ncore_available'], df_top_ram.at[0, 'hc:mem_req'])
-            if top_cpu==top_ram:
-                top_ram = 'same'
-        else:
-            top_cpu = '-'
-            top_ram = '-'
-        rows.append({
-            'part': str(queue_name),
-            'nodes': '{}/{}/{}'.format(num_working_node, num_abnormal_node, num_node),
-            'cpu(a/u/t)': '{}/{}/{}'.format(ncore_available, ncore_used, ncore_total),
-            'ram(a/t)G': '{:.0f}/{:.0f}'.format(mem_available, mem_total),
-            'topCPU': top_cpu,
-            'topRAM': top_ram,
-            'launch': _format_slurm_compact_launch_row(launch_rows.get(queue_name)),
-        })
+        rows.append(_slurm_compact_summary_row(queue_name, df_queue, args, launch_rows.get(queue_name)))
+    if (df_cluster is not None) and (len(rows)>1):
+        shown_nodes = df.loc[df['queue_name'].isin(queue_names), 'node_name']
+        df_shown = df_cluster.loc[df_cluster['node_name'].isin(shown_nodes), :].reset_index(drop=True)
+        rows.append(_slurm_compact_summary_row('all', df_shown, args))
     if len(rows)==0:
         return
     columns = ['part', 'nodes', 'cpu(a/u/t)', 'ram(a/t)G', 'topCPU', 'topRAM', 'launch']
@@ -1234,6 +2416,9 @@ def print_slurm_compact_summary(df, df_launch, args):
         ]))
     print('')
     print('legend: nodes=working/abnormal/total, cpu=available/used/total, ram=available/total')
+    walltime = str(getattr(args, 'walltime', '')).strip()
+    if walltime!='':
+        print('launch ceilings leave room for reservations that start within --walltime {}'.format(walltime))
     print('')
 
 def get_scheduler_from_command(stat_command):
@@ -1245,6 +2430,8 @@ def get_scheduler_from_command(stat_command):
         return None
     executable = os.path.basename(command[0])
     if executable=='qstat':
+        if '-xml' in command[1:]:
+            return 'uge_xml'
         return 'uge'
     if executable=='squeue':
         return 'slurm'
@@ -1303,101 +2490,765 @@ def get_squeue_command_for_parsing(stat_command):
     executable = os.path.basename(command[0])
     if executable!='squeue':
         return stat_command
+    if command_has_json_option(stat_command):
+        return stat_command
     command = _strip_squeue_parse_options(command)
     command.append('-h')
     command.extend(['-o', SLURM_SQUEUE_PARSE_FIELDS])
     return ' '.join([shlex.quote(item) for item in command])
 
-def get_command_stdout_lines(command_str, example_file='', allow_failure=False, command_name='command', quiet_failure=False):
+def get_filter_values(txt):
+    return [ value.strip() for value in str(txt).split(',') if value.strip()!='' ]
+
+def add_command_filter(command_str, executable_names, option_names, values):
+    # Pushes a --partition/--user filter down to the scheduler as "OPTION v1,v2".
+    # Commands run by other executables, or already carrying one of
+    # option_names, are left unchanged.
+    if len(values)==0:
+        return command_str
+    try:
+        command = shlex.split(command_str)
+    except ValueError:
+        return command_str
+    if (len(command)==0) or (os.path.basename(command[0]) not in executable_names):
+        return command_str
+    for token in command[1:]:
+        if any((token==name) or (name.startswith('--') and token.startswith(name + '=')) for name in option_names):
+            return command_str
+    command.extend([option_names[0], ','.join(values)])
+    return ' '.join([shlex.quote(item) for item in command])
+
+def get_squeue_filter_command(squeue_command, partitions, users):
+    command_str = add_command_filter(squeue_command, {'squeue'}, ['-p', '--partition'], partitions)
+    return add_command_filter(command_str, {'squeue'}, ['-u', '--user'], users)
+
+def get_scontrol_partition_filter_command(command_str, partitions):
+    # "scontrol show partition NAME" accepts a single name; with several
+    # partitions the full listing is fetched.
+    if len(partitions)!=1:
+        return command_str
+    try:
+        command = shlex.split(command_str)
+    except ValueError:
+        return command_str
+    if (len(command)==0) or (os.path.basename(command[0])!='scontrol'):
+        return command_str
+    for i in range(1, len(command)-1):
+        if (command[i]=='show') and (command[i+1]=='partition'):
+            if (i+2<len(command)) and (not command[i+2].startswith('-')):
+                return command_str
+            command.insert(i+2, partitions[0])
+            return ' '.join([shlex.quote(item) for item in command])
+    return command_str
+
+def filter_slurm_job_df(df_user, partitions, users):
+    # Applied after parsing for outputs that were not filtered by squeue itself,
+    # e.g. --example_file. Jobs submitted to several partitions match any of them.
+    if (df_user is None) or (df_user.shape[0]==0):
+        return df_user
+    is_kept = pandas.Series(True, index=df_user.index)
+    if len(users)>0:
+        is_kept &= df_user['user'].isin(users)
+    if len(partitions)>0:
+        partition_set = set(partitions)
+        is_kept &= df_user['partition'].map(lambda value: not partition_set.isdisjoint(str(value).split(','))).astype(bool)
+    if is_kept.all():
+        return df_user
+    return df_user.loc[is_kept, :].reset_index(drop=True)
+
+def filter_df_by_values(df, col, values):
+    if (df is None) or (len(values)==0):
+        return df
+    return df.loc[df[col].isin(values), :].reset_index(drop=True)
+
+def get_qstat_command_for_parsing(stat_command, resource_names=QSTAT_RESOURCE_NAMES):
+    try:
+        command = shlex.split(stat_command)
+    except ValueError:
+        return stat_command
+    if len(command)==0:
+        return stat_command
+    executable = os.path.basename(command[0])
+    if executable!='qstat':
+        return stat_command
+    projected = [command[0]]
+    has_resource_option = False
+    i = 1
+    while i<len(command):
+        token = command[i]
+        projected.append(token)
+        i += 1
+        if token!='-F':
+            continue
+        has_resource_option = True
+        requested = []
+        if (i<len(command)) and (not command[i].startswith('-')):
+            requested = [ r for r in command[i].split(',') if r!='' ]
+            i += 1
+        for resource_name in resource_names:
+            if resource_name not in requested:
+                requested.append(resource_name)
+        projected.append(','.join(requested))
+    if not has_resource_option:
+        projected.extend(['-F', ','.join(resource_names)])
+    return ' '.join([shlex.quote(item) for item in projected])
+
+def get_command_budget(args):
+    # --command_timeout bounds each scheduler command and --total_timeout all
+    # commands of the run, counted from the first call. Optional sources that
+    # time out are skipped and noted here for print_command_notes. The
+    # --cache_dir settings travel with the budget to every command call.
+    budget = getattr(args, 'command_budget', None)
+    if budget is None:
+        total_timeout = float(getattr(args, 'total_timeout', 0) or 0)
+        budget = {
+            'command_timeout': float(getattr(args, 'command_timeout', 0) or 0),
+            'deadline': (time.monotonic() + total_timeout) if (total_timeout>0) else None,
+            'notes': [],
+            'cache_dir': getattr(args, 'cache_dir', '') or '',
+            'cache_ttl': float(getattr(args, 'cache_ttl', 0) or 0),
+            'cache_ages': [],
+            # Running child processes, killed by cancel_commands when the run fails.
+            'processes': set(),
+            'process_lock': threading.Lock(),
+            'is_cancelled': False,
+        }
+        args.command_budget = budget
+    return budget
+
+def _get_budget_timeout(budget):
+    if budget is None:
+        return None
+    timeouts = []
+    if budget['command_timeout']>0:
+        timeouts.append(budget['command_timeout'])
+    if budget['deadline'] is not None:
+        timeouts.append(max(budget['deadline'] - time.monotonic(), 0.0))
+    if len(timeouts)==0:
+        return None
+    return min(timeouts)
+
+def _command_timeout_message(command_name, command_str, elapsed):
+    if elapsed<=0:
+        return 'Skipped {} because --total_timeout was reached: {}'.format(command_name, command_str)
+    return 'Timed out after {:.1f} s running {}: {}'.format(elapsed, command_name, command_str)
+
+def _handle_command_timeout(budget, command_name, command_str, elapsed, allow_failure):
+    if not allow_failure:
+        txt = '{}\nIncrease --command_timeout or --total_timeout if the scheduler is only slow.'
+        raise KFBatchCommandTimeout(txt.format(_command_timeout_message(command_name, command_str, elapsed)), elapsed=elapsed)
+    if elapsed<=0:
+        budget['notes'].append('{} was skipped because --total_timeout was reached.'.format(command_name))
+    else:
+        budget['notes'].append('{} timed out after {:.1f} s and was skipped.'.format(command_name, elapsed))
+    return None
+
+def _check_cancelled(budget, command_name, command_str):
+    if (budget is not None) and budget['is_cancelled']:
+        raise KFBatchCommandError('Cancelled {}: {}'.format(command_name, command_str))
+
+def cancel_commands(budget):
+    # Kills the scheduler commands still running for this run and refuses new ones.
+    if budget is None:
+        return
+    with budget['process_lock']:
+        budget['is_cancelled'] = True
+        processes = list(budget['processes'])
+    for proc in processes:
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+@contextlib.contextmanager
+def command_executor(budget, max_workers):
+    # A ThreadPoolExecutor for concurrent scheduler commands. When the block
+    # raises (e.g. the mandatory job query failed), queued tasks are cancelled
+    # and running commands are killed instead of being waited for.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        yield executor
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_commands(budget)
+        raise
+    executor.shutdown(wait=True)
+
+def print_command_notes(args):
+    budget = getattr(args, 'command_budget', None)
+    if budget is None:
+        return
+    notes = list(budget['notes'])
+    if len(budget.get('cache_ages', []))>0:
+        txt = 'scheduler output was read from --cache_dir {} and is up to {:.0f} s old (--cache_ttl {:g}).'
+        notes.append(txt.format(budget['cache_dir'], max(budget['cache_ages']), budget['cache_ttl']))
+    if len(notes)==0:
+        return
+    # Notes are added from worker threads, so they are sorted for a stable output.
+    for note in sorted(notes):
+        print('note: {}'.format(note))
+    print('')
+
+def get_command_stdout_lines(command_str, example_file='', allow_failure=False, command_name='command', quiet_failure=False,
+                             budget=None):
+    # For parsers that read the output more than once; the lines are the only
+    # copy held, without the raw bytes and the decoded text of a buffered run.
+    return parse_command_stdout(list, command_str=command_str, example_file=example_file, allow_failure=allow_failure,
+                                command_name=command_name, quiet_failure=quiet_failure, budget=budget)
+
+def parse_command_stdout(parse, command_str, example_file='', allow_failure=False, command_name='command',
+                         quiet_failure=False, budget=None):
+    # Feeds the stdout lines of a command to parse() as they arrive, so the
+    # output is never held in full. When the command fails, the parsed result is
+    # discarded and None is returned if allow_failure; errors raised by parse()
+    # itself are not treated as command failures.
+    failure = {}
+
+    def iter_lines():
+        if (example_file=='') and (budget is not None) and (budget.get('cache_dir', '')!=''):
+            source = iter_cached_command_stdout_lines
+        else:
+            source = iter_command_stdout_lines
+        try:
+            for line in source(command_str=command_str, example_file=example_file, command_name=command_name,
+                               quiet_failure=quiet_failure, budget=budget):
+                yield line
+        except KFBatchCommandError as e:
+            failure['error'] = e
+            raise
+
+    lines = iter_lines()
+    try:
+        out = parse(lines)
+        # The exit status is only known once the output has been read to the end.
+        for _ in lines:
+            pass
+    except KFBatchCommandError as e:
+        if (not allow_failure) or (failure.get('error') is not e):
+            raise
+        if isinstance(e, KFBatchCommandTimeout):
+            return _handle_command_timeout(budget, command_name, command_str, e.elapsed, allow_failure=True)
+        return None
+    return out
+
+def _get_cache_age(path, ttl):
+    # Seconds since the cached output was written, or None when it is missing or expired.
+    try:
+        age = time.time() - os.stat(path).st_mtime
+    except OSError:
+        return None
+    if (age<0) or (age>=ttl):
+        return None
+    return age
+
+def _iter_cache_file_lines(path, budget, age):
+    budget['cache_ages'].append(age)
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            yield line
+
+def _add_cache_error_note(budget, error):
+    note = '--cache_dir {} could not be used ({}); commands were run without it.'.format(budget['cache_dir'], error.strerror)
+    if note not in budget['notes']:
+        budget['notes'].append(note)
+
+def _lock_cache_entry(lock_fd, budget, command_name, command_str):
+    # Waits for the process refreshing the same entry, within the command budget.
+    timeout = _get_budget_timeout(budget)
+    start_time = time.monotonic()
+    while True:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            pass
+        _check_cancelled(budget, command_name, command_str)
+        elapsed = time.monotonic() - start_time
+        if (timeout is not None) and (elapsed>=timeout):
+            _handle_command_timeout(budget, command_name, command_str, elapsed, allow_failure=False)
+        time.sleep(CACHE_LOCK_POLL_INTERVAL)
+
+def _is_shared_cache_command(command_str):
+    try:
+        command = shlex.split(command_str)
+    except ValueError:
+        return False
+    if len(command)==0:
+        return False
+    program = os.path.basename(command[0])
+    if program=='qhost':
+        return True
+    words = [ word for word in command[1:] if not word.startswith('-') ]
+    return (program=='scontrol') and (words[:1]==['show']) and (words[1:2]!=[]) and (words[1] in CACHE_SHARED_SCONTROL_ENTITIES)
+
+def _get_cache_key(command_str):
+    # Per-user entries carry the invoking user in the hashed key so that one
+    # user's job listing is never served to another.
+    if _is_shared_cache_command(command_str):
+        key_str = command_str
+    else:
+        key_str = 'user={}\0{}'.format(getpass.getuser(), command_str)
+    return hashlib.sha256(key_str.encode('utf8')).hexdigest()[:32]
+
+def iter_cached_command_stdout_lines(command_str, example_file='', command_name='command', quiet_failure=False, budget=None):
+    # iter_command_stdout_lines behind the --cache_dir snapshot cache. Outputs
+    # are stored per command string for --cache_ttl seconds. A refresh holds
+    # the entry's lock while the command runs, so concurrent kfbatch runs wait
+    # for it and then read the new file instead of querying the scheduler
+    # themselves. The output is streamed to a temporary file that is renamed
+    # into place only after the command succeeded, so readers never see a
+    # partial file and failed outputs are never cached.
+    cache_dir = budget['cache_dir']
+    is_shared = _is_shared_cache_command(command_str)
+    key = _get_cache_key(command_str)
+    path = os.path.join(cache_dir, key + '.out')
+    age = _get_cache_age(path, budget['cache_ttl'])
+    if age is not None:
+        yield from _iter_cache_file_lines(path, budget, age)
+        return
+    lines = iter_command_stdout_lines(command_str=command_str, command_name=command_name,
+                                      quiet_failure=quiet_failure, budget=budget)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Opened read-only so that a lock file created by another user can be shared.
+        lock_fd = os.open(os.path.join(cache_dir, key + '.lock'), os.O_RDONLY | os.O_CREAT, 0o666)
+    except OSError as e:
+        _add_cache_error_note(budget, e)
+        yield from lines
+        return
+    try:
+        _lock_cache_entry(lock_fd, budget, command_name, command_str)
+        # Another run may have refreshed the entry while this one waited.
+        age = _get_cache_age(path, budget['cache_ttl'])
+        if age is not None:
+            yield from _iter_cache_file_lines(path, budget, age)
+            return
+        try:
+            tmp_fd, tmp_path = tempfile.mkstemp(prefix=key + '.', suffix='.tmp', dir=cache_dir)
+        except OSError as e:
+            _add_cache_error_note(budget, e)
+            yield from lines
+            return
+        tmp_file = open(tmp_fd, 'w', encoding='utf-8')
+        is_writing = True
+        try:
+            for line in lines:
+                if is_writing:
+                    try:
+                        tmp_file.write(line)
+                    except OSError as e:
+                        # e.g. a full /dev/shm; the output is still passed on uncached.
+                        is_writing = False
+                        _add_cache_error_note(budget, e)
+                yield line
+            if is_writing:
+                # Shared entries are readable by the other users of the cache
+                # directory; per-user entries keep mkstemp's owner-only mode.
+                if is_shared:
+                    os.fchmod(tmp_file.fileno(), 0o644)
+                tmp_file.close()
+                os.replace(tmp_path, path)
+        except OSError as e:
+            # e.g. the entry belongs to another user in a sticky directory such as /dev/shm.
+            _add_cache_error_note(budget, e)
+        finally:
+            try:
+                tmp_file.close()
+            except OSError:
+                pass
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    finally:
+        os.close(lock_fd)
+
+def iter_command_stdout_lines(command_str, example_file='', command_name='command', quiet_failure=False, budget=None):
+    # Reads stdout line by line from the pipe. stderr goes to a temporary file so
+    # a chatty command cannot block on a full pipe while stdout is being consumed,
+    # and is only read for the error message. Output is decoded as UTF-8 whatever
+    # the locale, with undecodable bytes replaced. A command that outlives the
+    # budget is killed by a timer and raises KFBatchCommandTimeout.
     if example_file != '':
         try:
-            with open(example_file) as f:
-                return f.readlines()
+            f = open(example_file, encoding='utf-8', errors='replace')
         except OSError as e:
-            if allow_failure:
-                return None
             summary = 'Failed to read example file for {}: {}'.format(command_name, example_file)
             raise KFBatchCommandError(_format_error_message(summary, str(e), quiet=quiet_failure))
+        with f:
+            for line in f:
+                yield line
+        return
     try:
         command = shlex.split(command_str)
     except ValueError as e:
-        if allow_failure:
-            return None
         summary = 'Failed to parse {}: {}'.format(command_name, command_str)
         raise KFBatchCommandError(_format_error_message(summary, str(e), quiet=quiet_failure))
     if len(command)==0:
-        if allow_failure:
-            return None
         summary = 'Failed to run {}: command is empty'.format(command_name)
         raise KFBatchCommandError(_format_error_message(summary, quiet=quiet_failure))
+    timeout = _get_budget_timeout(budget)
+    if (timeout is not None) and (timeout<=0):
+        _handle_command_timeout(budget, command_name, command_str, 0, allow_failure=False)
+    with tempfile.TemporaryFile() as stderr_file:
+        start_time = time.monotonic()
+        _check_cancelled(budget, command_name, command_str)
+        try:
+            proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, encoding='utf-8', errors='replace')
+        except OSError as e:
+            summary = 'Failed to run {}: {}'.format(command_name, command_str)
+            raise KFBatchCommandError(_format_error_message(summary, str(e), quiet=quiet_failure))
+        if budget is not None:
+            with budget['process_lock']:
+                budget['processes'].add(proc)
+                is_cancelled = budget['is_cancelled']
+            if is_cancelled:
+                proc.kill()
+        is_timed_out = threading.Event()
+        timer = None
+        if timeout is not None:
+            def kill_command():
+                is_timed_out.set()
+                proc.kill()
+            timer = threading.Timer(timeout, kill_command)
+            timer.daemon = True
+            timer.start()
+        try:
+            with proc:
+                for line in proc.stdout:
+                    yield line
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if budget is not None:
+                with budget['process_lock']:
+                    budget['processes'].discard(proc)
+        if is_timed_out.is_set():
+            _handle_command_timeout(budget, command_name, command_str, time.monotonic() - start_time, allow_failure=False)
+        if proc.returncode!=0:
+            stderr_file.seek(0)
+            command_stderr = stderr_file.read().decode('utf8', errors='replace').strip()
+            summary = 'Failed to run {}: {}'.format(command_name, command_str)
+            raise KFBatchCommandError(_format_error_message(summary, command_stderr, quiet=quiet_failure))
+
+def _divert_qstat_job_lines(lines, job_lines):
+    # Job lines ("  <job_id> ...") are set aside for get_user_df and the queue
+    # lines are passed on to get_qstat_df, which would skip the job lines anyway.
+    for line in lines:
+        if line.startswith('  '):
+            job_lines.append(line)
+            continue
+        yield line
+
+def get_qstat_sample(command_str, example_file='', scheduler='uge', with_jobs=True, budget=None):
+    def parse(lines):
+        if scheduler=='uge_xml':
+            return get_qstat_xml_df(lines)
+        if not with_jobs:
+            return get_qstat_df(lines), None
+        job_lines = []
+        df = get_qstat_df(_divert_qstat_job_lines(lines, job_lines))
+        return df, get_user_df(job_lines)
+
+    return parse_command_stdout(parse,
+                                command_str=command_str,
+                                example_file=example_file,
+                                allow_failure=False,
+                                command_name='--stat_command',
+                                budget=budget)
+
+def get_qstat_sharded_sample(command_str, queue_names, scheduler='uge', nthreads=4, with_jobs=True, budget=None):
+    # One qstat per cluster queue, fetched and parsed concurrently, so a sample
+    # takes as long as the slowest queue rather than the sum of all queues.
+    command = shlex.split(command_str)
+    shard_commands = [ ' '.join([shlex.quote(item) for item in command + ['-q', q]]) for q in queue_names ]
+    nthreads = max(1, min(nthreads, len(shard_commands)))
+    with command_executor(budget, nthreads) as executor:
+        results = list(executor.map(
+            lambda shard_command: get_qstat_sample(shard_command, scheduler=scheduler, with_jobs=with_jobs, budget=budget),
+            shard_commands,
+        ))
+    df = pandas.concat([ r[0] for r in results ], axis=0, ignore_index=True)
+    df = df.drop_duplicates(subset=['queue_name', 'node_name']).sort_values(by=['queue_name', 'node_name']).reset_index(drop=True)
+    if not with_jobs:
+        return df, None
+    df_user = pandas.concat([ r[1] for r in results ], axis=0, ignore_index=True)
+    # Pending jobs are not bound to a queue instance and can be listed by every shard.
+    is_pending = df_user['state'].fillna('').str.contains('q', regex=False)
+    is_repeated = df_user.duplicated(subset=['job_id', 'state', 'ja_task_id'])
+    df_user = df_user.loc[~(is_pending & is_repeated), :].reset_index(drop=True)
+    return df, df_user
+
+def get_uge_shard_queues(args):
+    shard_queues = getattr(args, 'qstat_shard_queues', '').strip()
+    if (shard_queues=='') or (args.example_file!=''):
+        return []
     try:
-        command_out = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except OSError as e:
-        if allow_failure:
-            return None
-        summary = 'Failed to run {}: {}'.format(command_name, command_str)
-        raise KFBatchCommandError(_format_error_message(summary, str(e), quiet=quiet_failure))
-    if command_out.returncode!=0:
-        if allow_failure:
-            return None
-        command_stderr = command_out.stderr.decode('utf8').strip()
-        summary = 'Failed to run {}: {}'.format(command_name, command_str)
-        raise KFBatchCommandError(_format_error_message(summary, command_stderr, quiet=quiet_failure))
-    command_stdout = command_out.stdout.decode('utf8')
-    return command_stdout.split('\n')
-
-def get_df(args):
+        command = shlex.split(args.stat_command)
+    except ValueError:
+        return []
+    if '-q' in command:
+        return []
+    partitions = get_filter_values(getattr(args, 'partition', ''))
+    if len(partitions)>0:
+        # --partition already names the queues; a single one is pushed down as -q.
+        return partitions if len(partitions)>1 else []
+    if shard_queues=='auto':
+        lines = get_command_stdout_lines(command_str=args.uge_queue_list_command,
+                                         allow_failure=False,
+                                         command_name='--uge_queue_list_command',
+                                         budget=get_command_budget(args))
+        return [ line.strip() for line in lines if line.strip()!='' ]
+    return [ q.strip() for q in shard_queues.split(',') if q.strip()!='' ]
+
+def collect_uge_samples(args, get_sample, key_cols):
+    # Takes up to --niter samples, at least --niter_interval seconds apart, and
+    # stops early once the running minima are unchanged for --niter_stable rounds.
+    interval = max(float(getattr(args, 'niter_interval', 0.0)), 0.0)
+    num_stable_required = max(int(getattr(args, 'niter_stable', 0)), 0)
+    num_stable = 0
+    accumulator = None
+    df_user = None
+    last_start = None
+    num_sample = 0
+    for i in range(args.niter):
+        if (last_start is not None) and (interval>0):
+            time.sleep(max(interval - (time.monotonic() - last_start), 0.0))
+        last_start = time.monotonic()
+        try:
+            df_i, df_user_i = get_sample(i)
+        except KFBatchCommandTimeout:
+            # Later samples only refine the minima, so the ones taken so far are kept.
+            if i==0:
+                raise
+            budget = get_command_budget(args)
+            budget['sampling_timed_out'] = True
+            budget['notes'].append('sampling stopped after {} of {} samples because a command timed out.'.format(num_sample, args.niter))
+            break
+        num_sample += 1
+        if i==0:
+            df_user = df_user_i
+        if (accumulator is None) or (accumulator['df'].shape[0]==0):
+            accumulator = _new_availability_accumulator(df_i, key_cols)
+            continue
+        changed = _update_availability_accumulator(accumulator, df_i)
+        if num_stable_required==0:
+            continue
+        num_stable = 0 if changed else num_stable + 1
+        if num_stable>=num_stable_required:
+            break
+    return _finalize_availability_accumulator(accumulator), df_user, num_sample
+
+def print_uge_sampling_note(args, num_sample):
+    if num_sample>=args.niter:
+        return
+    if get_command_budget(args).get('sampling_timed_out', False):
+        # Reported by print_command_notes instead.
+        return
+    txt = 'note: availability was unchanged for {} round(s); stopped after {} of {} samples.'
+    print(txt.format(getattr(args, 'niter_stable', 0), num_sample, args.niter))
+    print('')
+
+def get_uge_source(args):
+    source = getattr(args, 'uge_source', 'qstat')
+    if source=='qstat':
+        return source
+    needs_node_detail = (args.ntop>0) or (args.out!='')
+    if source=='auto':
+        if needs_node_detail or (args.example_file!=''):
+            return 'qstat'
+        return 'qhost'
+    if (source=='qstat_gc') and needs_node_detail:
+        return 'qstat'
+    return source
+
+def _fetch_squeue_job_df(args, squeue_command, partitions, users):
+    # The job table is only written to --out when node data is missing;
+    # otherwise its descriptive columns are never read.
+    detail_columns = (args.out!='')
+    if command_has_json_option(squeue_command):
+        parse = lambda lines: get_squeue_json_user_df(lines, detail_columns=detail_columns)
+    else:
+        parse = lambda lines: get_squeue_user_df(lines, detail_columns=detail_columns)
+    df_user = parse_command_stdout(parse,
+                                   command_str=squeue_command,
+                                   example_file=args.example_file,
+                                   allow_failure=False,
+                                   command_name='--stat_command',
+                                   budget=get_command_budget(args))
+    return filter_slurm_job_df(df_user, partitions, users)
+
+def _fetch_slurm_partition_state_map(args, partition_command):
+    if command_has_json_option(partition_command):
+        parse = get_scontrol_partition_json_df
+    else:
+        parse = get_scontrol_partition_df
+    df_partition = parse_command_stdout(parse,
+                                        command_str=partition_command,
+                                        example_file=args.slurm_partition_example_file,
+                                        allow_failure=True,
+                                        command_name='--slurm_partition_command',
+                                        quiet_failure=True,
+                                        budget=get_command_budget(args))
+    if (df_partition is None) or (df_partition.shape[0]==0):
+        return None
+    return df_partition.set_index('partition_name')['partition_state'].to_dict()
+
+def _fetch_slurm_node_table(args, partition_future, partitions):
+    # Returns None when the command failed. Node records are parsed from the
+    # pipe while the partition command runs; the table then waits for the
+    # partition states.
+    if command_has_json_option(args.slurm_node_command):
+        parse = lambda lines: _scontrol_node_json_records(lines, partitions=partitions)
+    else:
+        parse = lambda lines: _scontrol_node_records(lines, partitions=partitions)
+    records = parse_command_stdout(parse,
+                                   command_str=args.slurm_node_command,
+                                   example_file=args.slurm_node_example_file,
+                                   allow_failure=True,
+                                   command_name='--slurm_node_command',
+                                   budget=get_command_budget(args))
+    if records is None:
+        return None
+    return _build_slurm_node_table(records, partition_state_map=partition_future.result())
+
+def _fetch_slurm_reservation_df(args, now=None):
+    if command_has_json_option(args.slurm_reservation_command):
+        parse = lambda lines: get_scontrol_reservation_json_df(lines, now=now)
+    else:
+        parse = get_scontrol_reservation_df
+    return parse_command_stdout(parse,
+                                command_str=args.slurm_reservation_command,
+                                example_file=args.slurm_reservation_example_file,
+                                allow_failure=True,
+                                command_name='--slurm_reservation_command',
+                                quiet_failure=True,
+                                budget=get_command_budget(args))
+
+def _fetch_sprio_df(args, partitions):
+    # Priorities of every user are needed for the gaps, so only -p is pushed down.
+    prio_command = add_command_filter(args.slurm_prio_command, {'sprio'}, ['-p', '--partition'], partitions)
+    return parse_command_stdout(get_sprio_df,
+                                command_str=prio_command,
+                                example_file=args.slurm_prio_example_file,
+                                allow_failure=True,
+                                command_name='--slurm_prio_command',
+                                quiet_failure=True,
+                                budget=get_command_budget(args))
+
+def submit_slurm_sources(args, executor, with_reservation=False, with_prio=False, now=None):
+    # Starts every scheduler command of a SLURM run at once. Each future fetches
+    # and parses one command, so a run takes about as long as its slowest
+    # command. Nothing is printed from the workers; callers print in a fixed order.
+    partitions = get_filter_values(getattr(args, 'partition', ''))
+    users = get_filter_values(getattr(args, 'user', ''))
+    squeue_command = get_squeue_filter_command(get_squeue_command_for_parsing(args.stat_command), partitions, users)
+    partition_command = get_scontrol_partition_filter_command(args.slurm_partition_command, partitions)
+    sources = {}
+    sources['squeue'] = executor.submit(_fetch_squeue_job_df, args, squeue_command, partitions, users)
+    # Submitted before the node task, which waits for it, so it is always started first.
+    sources['partition'] = executor.submit(_fetch_slurm_partition_state_map, args, partition_command)
+    sources['node'] = executor.submit(_fetch_slurm_node_table, args, sources['partition'], partitions)
+    if with_reservation:
+        sources['reservation'] = executor.submit(_fetch_slurm_reservation_df, args, now)
+    if with_prio:
+        sources['prio'] = executor.submit(_fetch_sprio_df, args, partitions)
+    return sources
+
+def _get_slurm_df(args, slurm_sources):
+    current_user = get_current_user_name()
+    df_user = slurm_sources['squeue'].result()
+    print_queued_job_summary(df_user, scheduler='slurm', current_user=current_user)
+    node_table = slurm_sources['node'].result()
+    if node_table is None:
+        print('Skipping node resource summary because --slurm_node_command failed.')
+        print('')
+        return 'slurm', None, df_user
+    # SLURM nodes are returned as the node table of get_scontrol_node_table;
+    # stat_main expands it with get_slurm_partition_view.
+    if node_table['df_node'].shape[0]==0:
+        print('Skipping node resource summary because SLURM node output could not be parsed.')
+        print('Use --slurm_node_command "scontrol show node -o" or provide --slurm_node_example_file.')
+        print('')
+        return 'slurm', None, df_user
+    return 'slurm', node_table, df_user
+
+def get_df(args, slurm_sources=None):
     scheduler = get_scheduler_from_command(args.stat_command)
     if scheduler is None:
         raise KFBatchUsageError('Exiting. --stat_command does not support: {}'.format(args.stat_command))
+    partitions = get_filter_values(getattr(args, 'partition', ''))
+    users = get_filter_values(getattr(args, 'user', ''))
     if scheduler=='slurm':
-        current_user = get_current_user_name()
-        squeue_command = get_squeue_command_for_parsing(args.stat_command)
-        lines = get_command_stdout_lines(command_str=squeue_command,
-                                         example_file=args.example_file,
-                                         allow_failure=False,
-                                         command_name='--stat_command')
-        df_user = get_squeue_user_df(lines)
-        print_queued_job_summary(df_user, scheduler='slurm', current_user=current_user)
-        partition_lines = get_command_stdout_lines(command_str=args.slurm_partition_command,
-                                                   example_file=args.slurm_partition_example_file,
-                                                   allow_failure=True,
-                                                   command_name='--slurm_partition_command',
-                                                   quiet_failure=True)
-        partition_state_map = None
-        if partition_lines is not None:
-            df_partition = get_scontrol_partition_df(partition_lines)
-            if df_partition.shape[0]>0:
-                partition_state_map = df_partition.set_index('partition_name')['partition_state'].to_dict()
-        node_lines = get_command_stdout_lines(command_str=args.slurm_node_command,
-                                              example_file=args.slurm_node_example_file,
-                                              allow_failure=True,
-                                              command_name='--slurm_node_command')
-        if node_lines is None:
-            print('Skipping node resource summary because --slurm_node_command failed.')
-            print('')
-            return scheduler, None, df_user
-        df_slurm_node = get_scontrol_node_df(node_lines, partition_state_map=partition_state_map)
-        if df_slurm_node.shape[0]==0:
-            print('Skipping node resource summary because SLURM node output could not be parsed.')
-            print('Use --slurm_node_command "scontrol show node -o" or provide --slurm_node_example_file.')
-            print('')
-            return scheduler, None, df_user
-        return scheduler, df_slurm_node, df_user
+        if slurm_sources is None:
+            with command_executor(get_command_budget(args), SLURM_SOURCE_THREADS) as executor:
+                return _get_slurm_df(args, submit_slurm_sources(args, executor))
+        return _get_slurm_df(args, slurm_sources)
     if args.niter<1:
         raise KFBatchUsageError('Exiting. --niter must be >= 1 when using qstat mode.')
-    for i in range(args.niter):
-        lines = get_command_stdout_lines(command_str=args.stat_command,
-                                         example_file=args.example_file,
-                                         allow_failure=False,
-                                         command_name='--stat_command')
-        df_i = get_qstat_df(lines)
-        if i==0:
-            df = df_i
-            df_user = get_user_df(lines)
-            print_queued_job_summary(df_user, scheduler='uge')
+    budget = get_command_budget(args)
+    if (budget['cache_dir']!='') and (args.niter>1):
+        # Every sample within --cache_ttl would read the same cached output.
+        budget['notes'].append('--niter {} was reduced to 1 because --cache_dir serves one snapshot.'.format(args.niter))
+        args.niter = 1
+    uge_source = get_uge_source(args)
+    if (uge_source=='qstat') and (getattr(args, 'uge_source', 'qstat')=='qstat_gc'):
+        print('note: --uge_source qstat_gc cannot report per-node detail requested by --ntop/--out; using qstat -F.')
+        print('')
+    if uge_source!='qstat':
+        job_command = add_command_filter(args.uge_job_command, {'qstat'}, ['-u'], users)
+        df_user = parse_command_stdout(get_qstat_job_df,
+                                       command_str=job_command,
+                                       example_file=args.uge_job_example_file,
+                                       allow_failure=False,
+                                       command_name='--uge_job_command',
+                                       budget=get_command_budget(args))
+        df_user = filter_df_by_values(df_user, 'user', users)
+        print_queued_job_summary(df_user, scheduler='uge')
+        if uge_source=='qhost':
+            # qhost cannot select queues; other queue instances are dropped after parsing.
+            command_str = args.uge_qhost_command
+            example_file = args.uge_qhost_example_file
+            command_name = '--uge_qhost_command'
+            parse = get_qhost_df
+            key_cols = ['queue_name', 'node_name']
         else:
-            df = _merge_qstat_iteration_min_availability(df, df_i)
+            command_str = add_command_filter(args.uge_gc_command, {'qstat'}, ['-q'], partitions)
+            example_file = args.uge_gc_example_file
+            command_name = '--uge_gc_command'
+            parse = get_qstat_gc_df
+            key_cols = ['queue_name']
+
+        def get_sample(i):
+            df_i = parse_command_stdout(parse,
+                                        command_str=command_str,
+                                        example_file=example_file,
+                                        allow_failure=False,
+                                        command_name=command_name,
+                                        budget=get_command_budget(args))
+            return filter_df_by_values(df_i, 'queue_name', partitions), None
+
+        df, _, num_sample = collect_uge_samples(args, get_sample, key_cols)
+        print_uge_sampling_note(args, num_sample)
+        return scheduler, df, df_user
+    qstat_command = get_qstat_command_for_parsing(args.stat_command)
+    shard_queues = get_uge_shard_queues(args)
+    if len(shard_queues)==0:
+        qstat_command = add_command_filter(qstat_command, {'qstat'}, ['-q'], partitions)
+
+    def get_sample(i):
+        if len(shard_queues)>0:
+            df_i, df_user_i = get_qstat_sharded_sample(qstat_command, shard_queues, scheduler=scheduler,
+                                                       nthreads=args.qstat_shard_threads, with_jobs=(i==0),
+                                                       budget=get_command_budget(args))
+        else:
+            df_i, df_user_i = get_qstat_sample(qstat_command, example_file=args.example_file,
+                                               scheduler=scheduler, with_jobs=(i==0),
+                                               budget=get_command_budget(args))
+        df_i = filter_df_by_values(df_i, 'queue_name', partitions)
+        return df_i, filter_df_by_values(df_user_i, 'user', users)
+
+    df, df_user, num_sample = collect_uge_samples(args, get_sample, ['queue_name', 'node_name'])
+    print_queued_job_summary(df_user, scheduler='uge')
+    print_uge_sampling_note(args, num_sample)
     return scheduler, df, df_user
 
 def adjust_ram_unit(df):
@@ -1426,31 +3277,61 @@ def adjust_ram_unit(df):
         if is_unknown.sum():
             df.loc[is_unknown, col+'_unit'] = 'G'
     return df
-def print_cluster_summary(df):
+def print_cluster_summary(df, df_cluster=None):
+    # df_cluster, if given, has one row per node and is reported as "all".
     queue_names = df['queue_name'].unique()
     print('Reporting working/abnormal/total nodes, available/used/reserved/abnormal/total CPUs, and available/total RAM:')
     for queue_name in queue_names:
-        df_queue = df.loc[(df['queue_name']==queue_name),:].reset_index(drop=True)
-        is_abnormal_status = (df_queue['status']!='')
-        num_abnormal_node = is_abnormal_status.sum()
-        num_node = df_queue.shape[0]
-        num_working_node = num_node - num_abnormal_node
-        ncore_total = df_queue.loc[:,'ncore_total'].sum()
-        ncore_used = df_queue.loc[~is_abnormal_status,'ncore_used'].sum()
-        ncore_reserved = df_queue.loc[~is_abnormal_status,'ncore_resv'].sum()
-        ncore_abnormal = df_queue.loc[is_abnormal_status,'ncore_total'].sum()
-        ncore_available = df_queue.loc[~is_abnormal_status,'ncore_available'].sum()
-        mem_total = df_queue.loc[:,'hl:mem_total'].sum()
-        mem_available = df_queue.loc[~is_abnormal_status,'hc:mem_req'].sum()
-        txt = '{}: {}/{}/{} nodes, {}/{}/{}/{}/{} CPUs, and {:,.0f}/{:,.0f}G RAM'
-        print(txt.format(queue_name,
-                         num_working_node, num_abnormal_node, num_node,
-                         ncore_available, ncore_used, ncore_reserved, ncore_abnormal, ncore_total,
-                         mem_available, mem_total))
+        print(_format_cluster_summary_line(queue_name, df.loc[(df['queue_name']==queue_name),:].reset_index(drop=True)))
+    if (df_cluster is not None) and (len(queue_names)>1):
+        print(_format_cluster_summary_line('all', df_cluster))
     print('')
 
-def stat_main(args):
-    scheduler, df, df_user = get_df(args)
+def _format_cluster_summary_line(queue_name, df_queue):
+    is_abnormal_status = (df_queue['status']!='')
+    num_abnormal_node = is_abnormal_status.sum()
+    num_node = df_queue.shape[0]
+    num_working_node = num_node - num_abnormal_node
+    ncore_total = df_queue.loc[:,'ncore_total'].sum()
+    ncore_used = df_queue.loc[~is_abnormal_status,'ncore_used'].sum()
+    ncore_reserved = df_queue.loc[~is_abnormal_status,'ncore_resv'].sum()
+    ncore_abnormal = df_queue.loc[is_abnormal_status,'ncore_total'].sum()
+    ncore_available = df_queue.loc[~is_abnormal_status,'ncore_available'].sum()
+    mem_total = df_queue.loc[:,'hl:mem_total'].sum()
+    mem_available = df_queue.loc[~is_abnormal_status,'hc:mem_req'].sum()
+    txt = '{}: {}/{}/{} nodes, {}/{}/{}/{}/{} CPUs, and {:,.0f}/{:,.0f}G RAM'
+    return txt.format(queue_name,
+                      num_working_node, num_abnormal_node, num_node,
+                      ncore_available, ncore_used, ncore_reserved, ncore_abnormal, ncore_total,
+                      mem_available, mem_total)
+
+def print_cluster_queue_summary(df_gc):
+    print('Reporting available/used/reserved/total CPUs per cluster queue, and CPUs in aoACDS/cdsuE states:')
+    for i in df_gc.index:
+        txt = '{}: {}/{}/{}/{} CPUs, and {}/{} CPUs in aoACDS/cdsuE states'
+        print(txt.format(df_gc.at[i, 'queue_name'],
+                         df_gc.at[i, 'ncore_available'], df_gc.at[i, 'ncore_used'],
+                         df_gc.at[i, 'ncore_resv'], df_gc.at[i, 'ncore_total'],
+                         df_gc.at[i, 'ncore_aoacds'], df_gc.at[i, 'ncore_cdsue']))
+    print('')
+
+def stat_main(args, now=None):
+    # The --total_timeout clock starts here. now is the time reservations are
+    # compared against; every reservation of the run is judged at that moment.
+    get_command_budget(args)
+    if now is None:
+        now = time.time()
+    if get_scheduler_from_command(args.stat_command)!='slurm':
+        _stat_main(args)
+    else:
+        with command_executor(get_command_budget(args), SLURM_SOURCE_THREADS) as executor:
+            slurm_sources = submit_slurm_sources(args, executor, with_reservation=True,
+                                                 with_prio=getattr(args, 'show_launch_heuristic', False), now=now)
+            _stat_main(args, slurm_sources=slurm_sources, now=now)
+    print_command_notes(args)
+
+def _stat_main(args, slurm_sources=None, now=None):
+    scheduler, df, df_user = get_df(args, slurm_sources=slurm_sources)
     if (scheduler=='slurm') and (df is None):
         print('Skipping cluster/node resource availability.')
         print('Reason: no parsed SLURM node data was available.')
@@ -1458,31 +3339,67 @@ def stat_main(args):
         if args.out!='':
             df_user.to_csv(args.out, sep='\t', index=False)
         return
+    df_cluster = None
+    df_launch_node = None
     if scheduler=='slurm':
-        reservation_lines = get_command_stdout_lines(command_str=args.slurm_reservation_command,
-                                                     example_file=args.slurm_reservation_example_file,
-                                                     allow_failure=True,
-                                                     command_name='--slurm_reservation_command',
-                                                     quiet_failure=True)
-        if reservation_lines is not None:
-            df_reservation = get_scontrol_reservation_df(reservation_lines)
-            if df_reservation.shape[0]>0:
-                df = apply_slurm_reservations(df, df_reservation)
+        node_table = df
+        walltime_minutes = get_walltime_minutes(getattr(args, 'walltime', ''))
+        df_reservation = slurm_sources['reservation'].result()
+        if (df_reservation is not None) and (df_reservation.shape[0]>0):
+            if walltime_minutes>0:
+                df_node_walltime = apply_slurm_reservations(node_table['df_node'], df_reservation,
+                                                            walltime_minutes=walltime_minutes, now=now)
+                df_launch_node = get_slurm_partition_view(dict(node_table, df_node=df_node_walltime))
+            node_table['df_node'] = apply_slurm_reservations(node_table['df_node'], df_reservation, now=now)
+        df = get_slurm_partition_view(node_table)
+        # Nodes shared by several partitions are counted once in the cluster-wide rollup.
+        df_cluster = adjust_ram_unit(get_slurm_cluster_view(node_table))
+    if (scheduler!='slurm') and (get_uge_source(args)=='qstat_gc'):
+        print_cluster_queue_summary(df)
+        return
     df = adjust_ram_unit(df)
     if scheduler=='slurm' and args.show_launch_heuristic:
-        prio_lines = get_command_stdout_lines(command_str=args.slurm_prio_command,
-                                              example_file=args.slurm_prio_example_file,
-                                              allow_failure=True,
-                                              command_name='--slurm_prio_command',
-                                              quiet_failure=True)
-        df_prio = None
-        if prio_lines is not None:
-            df_prio = get_sprio_df(prio_lines)
+        df_prio = slurm_sources['prio'].result()
         current_user = get_current_user_name()
-        df_launch = get_slurm_launch_heuristic_df(df_node=df, df_job=df_user, df_prio=df_prio, current_user=current_user)
-        print_slurm_compact_summary(df, df_launch, args)
+        if df_launch_node is None:
+            df_launch_node = df
+        else:
+            df_launch_node = adjust_ram_unit(df_launch_node)
+        df_launch = get_slurm_launch_heuristic_df(df_node=df_launch_node, df_job=df_user, df_prio=df_prio, current_user=current_user)
+        print_slurm_compact_summary(df, df_launch, args, df_cluster=df_cluster)
     else:
-        print_cluster_summary(df)
+        print_cluster_summary(df, df_cluster=df_cluster)
         print_resource_availability(df, args)
+        show_pending_demand = getattr(args, 'show_pending_demand', False)
+        show_launch_heuristic = getattr(args, 'show_uge_launch_heuristic', False)
+        pending = None
+        if (show_pending_demand or show_launch_heuristic) and (args.example_file!='') and (args.uge_pending_example_file==''):
+            # Replays of captured output never query the live scheduler.
+            print('Skipping UGE pending jobs because --example_file is given without --uge_pending_example_file.')
+            print('')
+            show_pending_demand = False
+            show_launch_heuristic = False
+        if show_pending_demand or show_launch_heuristic:
+            # One streamed read feeds both the demand table and the heuristic.
+            pending = parse_command_stdout(get_uge_pending_accumulator,
+                                           command_str=args.uge_pending_command,
+                                           example_file=args.uge_pending_example_file,
+                                           allow_failure=True,
+                                           command_name='--uge_pending_command',
+                                           quiet_failure=True,
+                                           budget=get_command_budget(args))
+        if show_pending_demand:
+            if pending is None:
+                print('Skipping pending demand because --uge_pending_command failed.')
+                print('')
+            else:
+                df_demand = _finalize_uge_pending_demand(pending)
+                df_demand = get_uge_pending_capacity_df(df_demand, df, exclude_abnormal_node=args.exclude_abnormal_node)
+                print_uge_pending_demand(df_demand)
+        if show_launch_heuristic and (pending is not None):
+            current_user = get_current_user_name()
+            df_pending = _finalize_uge_pending_jobs(pending)
+            df_launch = get_uge_launch_heuristic_df(df_node=df, df_pending=df_pending, current_user=current_user)
+            print_uge_launch_heuristic(df_launch, current_user=current_user)
     if args.out!='':
         df.to_csv(args.out, sep='\t', index=False)
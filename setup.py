@@ -17,7 +17,7 @@ setup(
         url              = 'https://github.com/kfuku52/kfbatch.git',
         keywords         = 'phylogenetics',
         packages         = find_packages(),
-        install_requires = ['pandas',],
+        install_requires = ['numpy', 'pandas',],
         scripts          = ['kfbatch/kfbatch',],
         include_package_data = False,
 )
\ No newline at end of file
@@ -0,0 +1,98 @@
+import pathlib
+
+import numpy
+import pandas
+import pytest
+
+from kfbatch.acct import (
+    _iter_qacct_blocks,
+    _qacct_time_to_epoch,
+    get_acct_group_cols,
+    get_acct_summary_df,
+)
+from kfbatch.stat import KFBatchUsageError
+
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def _read_qacct_fixture():
+    with open(REPO_ROOT / "data" / "qacct1" / "qacct_j.txt") as f:
+        return f.readlines()
+
+
+def _qacct_block(owner, qsub_time, start_time, end_time="02/11/2023 23:00:00.000", slots=1, wallclock="3600.000s"):
+    return [
+        "=" * 62,
+        "qname        epyc.q",
+        "owner        {}".format(owner),
+        "jobname      job",
+        "qsub_time    {}".format(qsub_time),
+        "start_time   {}".format(start_time),
+        "end_time     {}".format(end_time),
+        "slots        {}".format(slots),
+        "failed       0",
+        "exit_status  0",
+        "ru_wallclock {}".format(wallclock),
+    ]
+
+
+def test_iter_qacct_blocks_keeps_only_projected_fields():
+    blocks = list(_iter_qacct_blocks(_read_qacct_fixture()))
+    assert len(blocks) == 7
+    assert blocks[0]["qname"] == "epyc.q"
+    assert blocks[0]["failed"] == "0"
+    assert blocks[2]["failed"] == "100 : assumedly after job"
+    assert "jobname" not in blocks[0]
+    assert "category" not in blocks[0]
+
+
+def test_qacct_time_to_epoch_accepts_uge_and_sge_formats():
+    series = pandas.Series(["02/11/2023 18:22:41.120", "02/11/2023 18:22:41", "Sat Feb 11 18:22:41 2023", "-/-"])
+    out = _qacct_time_to_epoch(series)
+    assert out.iloc[0] == pytest.approx(out.iloc[1] + 0.12)
+    assert out.iloc[1] == out.iloc[2]
+    assert numpy.isnan(out.iloc[3])
+
+
+def test_get_acct_summary_df_aggregates_fixture_per_queue_and_user():
+    df = get_acct_summary_df(_read_qacct_fixture()).set_index(["queue", "user"])
+    assert df.index.tolist() == [("epyc.q", "kfuku"), ("epyc.q", "tanaka"), ("intel.q", "tanaka"), ("medium.q", "kfuku")]
+    assert df.at[("epyc.q", "kfuku"), "num_task"] == 3
+    assert df.at[("epyc.q", "kfuku"), "num_failed"] == 1
+    assert df.at[("epyc.q", "kfuku"), "slot_hours"] == pytest.approx(20.0)
+    assert df.at[("epyc.q", "kfuku"), "wait_mean_h"] == pytest.approx((0.5 + 1.0 + 4.0) / 3, rel=1e-3)
+    assert df.at[("epyc.q", "kfuku"), "wait_max_h"] == pytest.approx(4.0, rel=1e-3)
+    assert df.at[("epyc.q", "kfuku"), "wait_p50_h"] == pytest.approx(1.0, rel=0.05)
+    assert df.at[("epyc.q", "tanaka"), "num_failed"] == 1
+    assert df.at[("medium.q", "kfuku"), "slot_hours"] == pytest.approx(192.0)
+    assert numpy.isnan(df.at[("intel.q", "tanaka"), "wait_mean_h"])
+    assert df.at[("intel.q", "tanaka"), "num_task"] == 1
+
+
+def test_get_acct_summary_df_does_not_depend_on_chunk_size():
+    lines = []
+    for i in range(101):
+        minute = i % 60
+        lines.extend(_qacct_block(
+            owner="user{}".format(i % 3),
+            qsub_time="02/11/2023 10:00:00.000",
+            start_time="02/11/2023 {:02d}:{:02d}:00.000".format(10 + i // 60, minute),
+            slots=1 + i % 4,
+        ))
+    df_one = get_acct_summary_df(lines, group_cols=["user"])
+    df_small = get_acct_summary_df(lines, group_cols=["user"], chunk_size=7)
+    pandas.testing.assert_frame_equal(df_one, df_small)
+    waits = numpy.array([(i // 60) * 60 + i % 60 for i in range(0, 101, 3)], dtype=float)
+    row = df_one.set_index("user").loc["user0", :]
+    assert row["num_task"] == waits.shape[0]
+    assert row["wait_p50_h"] * 60 == pytest.approx(numpy.quantile(waits, 0.5, method="inverted_cdf"), rel=0.05)
+    assert row["wait_p90_h"] * 60 == pytest.approx(numpy.quantile(waits, 0.9, method="inverted_cdf"), rel=0.05)
+
+
+def test_get_acct_group_cols_rejects_unknown_keys():
+    assert get_acct_group_cols("queue, user") == ["queue", "user"]
+    with pytest.raises(KFBatchUsageError):
+        get_acct_group_cols("queue,jobname")
+    with pytest.raises(KFBatchUsageError):
+        get_acct_group_cols("")
@@ -48,3 +48,10 @@ def test_unknown_option_returns_nonzero():
     out = _run_cli(["--this-option-does-not-exist"])
     assert out.returncode != 0
     assert "unrecognized arguments" in out.stderr
+
+
+def test_command_timeouts_are_disabled_by_default():
+    out = _run_cli(["-h"])
+    help_txt = " ".join(out.stdout.split())
+    assert "--command_timeout FLOAT default=0.0:" in help_txt
+    assert "--total_timeout FLOAT default=0.0:" in help_txt
@@ -0,0 +1,52 @@
+import pytest
+
+from kfbatch.hostlist import (
+    build_hostlist_index,
+    compress_hostlist,
+    hostlist_size,
+    intersect_hostlist,
+    iter_hostlist,
+    parse_hostlist,
+)
+
+
+def test_parse_hostlist_keeps_padded_integer_ranges():
+    assert parse_hostlist("a[001-064,070],gpu[1-2]-ib,login1") == [
+        ("a", "", 3, 1, 64),
+        ("a", "", 3, 70, 70),
+        ("gpu", "-ib", 1, 1, 2),
+        ("login1", "", -1, 0, 0),
+    ]
+    assert hostlist_size("a[001-064,070],gpu[1-2]-ib,login1") == 68
+    assert list(iter_hostlist("r[1-2]-n[01-02],x[9-10]")) == ["r1-n01", "r1-n02", "r2-n01", "r2-n02", "x9", "x10"]
+
+
+@pytest.mark.parametrize("expr", ["a[001-", "a[3-1]", "a[x-2]"])
+def test_parse_hostlist_rejects_malformed_expressions(expr):
+    with pytest.raises(ValueError):
+        parse_hostlist(expr)
+
+
+def test_intersect_hostlist_resolves_ranges_against_indexed_nodes_only():
+    node_names = ["a001", "a002", "a070", "a1", "b001", "login1", "a100"]
+    index = build_hostlist_index(node_names)
+    positions = intersect_hostlist("a[001-064,070,100-999],login1,c[1-1000000]", index)
+    assert [node_names[pos] for pos in positions] == ["a001", "a002", "a070", "a100", "login1"]
+
+
+def test_intersect_hostlist_matches_ranges_followed_by_digits():
+    node_names = ["n1-ib0", "n2-ib0", "n3-ib1", "gpu1-n0", "gpu4-n0", "gpu4-n1", "rack1-node01", "n12", "n13"]
+    index = build_hostlist_index(node_names)
+    assert [node_names[pos] for pos in intersect_hostlist("n[1-2]-ib0", index)] == ["n1-ib0", "n2-ib0"]
+    assert [node_names[pos] for pos in intersect_hostlist("gpu[1-4]-n0", index)] == ["gpu1-n0", "gpu4-n0"]
+    assert [node_names[pos] for pos in intersect_hostlist("rack[1-2]-node01", index)] == ["rack1-node01"]
+    assert [node_names[pos] for pos in intersect_hostlist("rack1-node[01-04]", index)] == ["rack1-node01"]
+    assert [node_names[pos] for pos in intersect_hostlist("n1[2-3]", index)] == ["n12", "n13"]
+
+
+def test_compress_hostlist_round_trips_with_iter_hostlist():
+    node_names = ["a003", "a001", "a002", "a007", "a099", "a100", "gpu1-ib", "gpu2-ib", "n9", "n10", "login1", "solo"]
+    expr = compress_hostlist(node_names)
+    assert expr == "a[001-003,007,099-100],gpu[1-2]-ib,n[9-10],login1,solo"
+    assert sorted(iter_hostlist(expr)) == sorted(node_names)
+    assert compress_hostlist(["a001"]) == "a001"
@@ -2,24 +2,40 @@ import os
 import pathlib
 import subprocess
 import sys
+import time
 
 import pandas
 import pytest
 
 from kfbatch.stat import (
+    get_qhost_df,
     get_qstat_df,
+    get_qstat_xml_df,
     get_scontrol_node_df,
+    get_scontrol_node_json_df,
     get_scontrol_partition_df,
+    get_scontrol_partition_json_df,
+    get_scontrol_reservation_json_df,
+    get_squeue_job_counts,
+    get_squeue_json_user_df,
     get_squeue_user_df,
+    get_user_df,
+    print_queued_job_summary,
+    print_squeue_job_counts,
 )
 
 
 REPO_ROOT = pathlib.Path(__file__).resolve().parents[1]
 CLI_PATH = REPO_ROOT / "kfbatch" / "kfbatch"
+# "now" of the data/slurm_json captures, which were taken from the same cluster
+# state as squeue_notrunc.txt (every 5th job) and scontrol_show_*_o.txt.
+SLURM_JSON_NOW = 1770000000
 
 
-def _run_cli(args):
+def _run_cli(args, extra_env=None):
     env = os.environ.copy()
+    if extra_env:
+        env.update(extra_env)
     pythonpath = str(REPO_ROOT)
     if env.get("PYTHONPATH"):
         pythonpath += os.pathsep + env["PYTHONPATH"]
@@ -80,6 +96,181 @@ def test_qstat_cli_runs_on_all_sample_snapshots(fixture_path):
     assert "Reporting working/abnormal/total nodes" in out.stdout
 
 
+def test_qstat_xml_sample_matches_text_sample():
+    with open(REPO_ROOT / "data/qstat4/qstatF.txt") as fh:
+        text_lines = fh.readlines()
+    with open(REPO_ROOT / "data/qstat4/qstatF_xml.xml") as fh:
+        xml_lines = fh.readlines()
+    df_text = get_qstat_df(text_lines)
+    df_xml, df_user_xml = get_qstat_xml_df(xml_lines)
+    cols = ["queue_name", "node_name", "ncore_available", "status", "hc:mem_req", "hl:mem_total"]
+    pandas.testing.assert_frame_equal(df_text[cols], df_xml[cols])
+    df_user_text = get_user_df(text_lines)
+    assert df_user_xml["total_slots"].tolist() == df_user_text["total_slots"].tolist()
+
+
+def test_qstat_xml_cli_runs_on_sample_snapshot():
+    out = _run_cli(
+        [
+            "--example_file",
+            "data/qstat4/qstatF_xml.xml",
+            "--stat_command",
+            "qstat -F -xml",
+            "--niter",
+            "1",
+        ]
+    )
+    assert out.returncode == 0
+    assert "# of CPUs in use for running jobs:" in out.stdout
+    assert "Reporting working/abnormal/total nodes" in out.stdout
+
+
+def test_qhost_sample_matches_qstat_sample():
+    with open(REPO_ROOT / "data/qstat1/qstatF.txt") as fh:
+        df_qstat = get_qstat_df(fh.readlines())
+    with open(REPO_ROOT / "data/qstat1/qhostFq.txt") as fh:
+        df_qhost = get_qhost_df(fh.readlines())
+    cols = ["queue_name", "node_name", "ncore_available", "status", "hc:mem_req", "hl:mem_total"]
+    pandas.testing.assert_frame_equal(df_qstat[cols], df_qhost[cols])
+
+
+@pytest.mark.parametrize(
+    "source_args",
+    [
+        ["--uge_source", "qstat_gc", "--uge_gc_example_file", "data/qstat1/qstat_gc.txt"],
+        ["--uge_source", "auto", "--uge_qhost_example_file", "data/qstat1/qhostFq.txt"],
+    ],
+)
+def test_uge_cheap_summary_sources_run_on_sample_snapshot(source_args):
+    out = _run_cli(
+        [
+            "--stat_command",
+            "qstat -F",
+            "--ntop",
+            "0",
+            "--niter",
+            "1",
+            "--uge_job_example_file",
+            "data/qstat1/qstat.txt",
+        ]
+        + source_args
+    )
+    assert out.returncode == 0
+    assert "# of CPUs in use for running jobs: 34" in out.stdout
+    assert "epyc.q: " in out.stdout
+
+
+def test_qstat_cli_reports_pending_demand():
+    out = _run_cli(
+        [
+            "--example_file",
+            "data/qstat4/qstatF.txt",
+            "--stat_command",
+            "qstat -F",
+            "--niter",
+            "1",
+            "--show_pending_demand",
+            "yes",
+            "--uge_pending_example_file",
+            "data/qstat4/qstat_pending_r.txt",
+        ]
+    )
+    assert out.returncode == 0
+    assert "Reporting pending demand vs. available capacity per requested queue:" in out.stdout
+    assert "epyc.q: 10,425 pending tasks in 2 jobs request 41,700 CPUs and 166,800G RAM" in out.stdout
+
+
+def test_qstat_cli_reports_uge_launch_heuristic():
+    out = _run_cli(
+        [
+            "--example_file",
+            "data/qstat4/qstatF.txt",
+            "--stat_command",
+            "qstat -F",
+            "--niter",
+            "1",
+            "--show_uge_launch_heuristic",
+            "yes",
+            "--uge_pending_example_file",
+            "data/qstat4/qstat_pending_pri_r.txt",
+        ],
+        extra_env={"USER": "tanaka"},
+    )
+    assert out.returncode == 0
+    assert "Reporting heuristic single-node launch ceilings for tanaka (priority-aware):" in out.stdout
+    assert "  priority gap: 0.01992" in out.stdout
+    assert "  smallest out-prioritized pending request is 1 CPUs / 0G" in out.stdout
+
+
+def test_qstat_cli_reports_pending_demand_and_uge_launch_heuristic_together():
+    out = _run_cli(
+        [
+            "--example_file",
+            "data/qstat4/qstatF.txt",
+            "--stat_command",
+            "qstat -F",
+            "--niter",
+            "1",
+            "--show_pending_demand",
+            "yes",
+            "--show_uge_launch_heuristic",
+            "yes",
+            "--uge_pending_example_file",
+            "data/qstat4/qstat_pending_pri_r.txt",
+        ],
+        extra_env={"USER": "tanaka"},
+    )
+    assert out.returncode == 0
+    assert "epyc.q: 10,425 pending tasks in 2 jobs request 41,700 CPUs and 166,800G RAM" in out.stdout
+    assert "  priority gap: 0.01992" in out.stdout
+    assert "  smallest out-prioritized pending request is 1 CPUs / 0G" in out.stdout
+
+
+def test_qstat_cli_example_file_does_not_run_live_pending_command(tmp_path):
+    marker = tmp_path / "pending_command_ran"
+    base_args = [
+        "--example_file",
+        "data/qstat4/qstatF.txt",
+        "--stat_command",
+        "qstat -F",
+        "--niter",
+        "1",
+        "--uge_pending_command",
+        "touch {}".format(marker),
+    ]
+    out = _run_cli(base_args)
+    assert out.returncode == 0
+    assert "launch ceilings" not in out.stdout
+    assert "UGE pending jobs" not in out.stdout
+    out = _run_cli(base_args + ["--show_pending_demand", "yes", "--show_uge_launch_heuristic", "yes"])
+    assert out.returncode == 0
+    assert "Skipping UGE pending jobs because --example_file is given without --uge_pending_example_file." in out.stdout
+    assert not marker.exists()
+
+
+def test_acct_cli_writes_summary_tsv(tmp_path):
+    out_file = tmp_path / "acct.tsv"
+    out = _run_cli(
+        [
+            "--mode",
+            "acct",
+            "--acct_example_file",
+            "data/qacct1/qacct_j.txt",
+            "--acct_group_by",
+            "queue",
+            "--out",
+            str(out_file),
+        ]
+    )
+    assert out.returncode == 0
+    assert out.stdout.splitlines()[0].split() == [
+        "queue", "tasks", "failed", "slot_h", "wait_mean_h", "wait_p50_h", "wait_p90_h", "wait_max_h", "tasks/day",
+    ]
+    df = pandas.read_csv(out_file, sep="\t")
+    assert df["queue"].tolist() == ["epyc.q", "intel.q", "medium.q"]
+    assert df["num_task"].tolist() == [5, 1, 1]
+
+
 def test_slurm_sample_parsing_invariants():
     with open(REPO_ROOT / "squeue_notrunc.txt") as fh:
         squeue_lines = fh.readlines()
@@ -102,6 +293,131 @@ def test_slurm_sample_parsing_invariants():
     assert (df_login["status"].str.contains("partition_state=INACTIVE", regex=False)).all()
 
 
+def test_slurm_json_backend_matches_text_backend():
+    with open(REPO_ROOT / "squeue_notrunc.txt") as fh:
+        squeue_lines = fh.readlines()[::5]
+    with open(REPO_ROOT / "data" / "slurm_json" / "squeue.json") as fh:
+        df_json = get_squeue_json_user_df(fh, now=SLURM_JSON_NOW)
+    df_text = get_squeue_user_df(squeue_lines)
+    shared_cols = [
+        "job_id", "partition", "name", "user", "state", "elapsed_time", "num_nodes",
+        "node_or_reason", "pending_reason", "total_slots", "task_count_estimated",
+    ]
+    pandas.testing.assert_frame_equal(df_json.loc[:, shared_cols], df_text.loc[:, shared_cols])
+    assert df_json["resource_fields_complete"].all()
+    assert (df_json["req_cpus"] > 0).all()
+    # The fixture generator gives every job 4000M per CPU; job 14700703 requests it
+    # with memory_per_cpu and must get the same per-node amount as memory_per_node jobs.
+    assert (df_json["req_mem"] == (df_json["req_cpus"] * 4000).map("{}M".format)).all()
+    assert df_json.loc[df_json["job_id"] == "14700703_[70-100%10]", "req_mem"].tolist() == ["16000M"]
+    with open(REPO_ROOT / "scontrol_show_partition_o.txt") as fh:
+        df_partition_text = get_scontrol_partition_df(fh)
+    with open(REPO_ROOT / "data" / "slurm_json" / "scontrol_show_partition.json") as fh:
+        df_partition_json = get_scontrol_partition_json_df(fh)
+    pandas.testing.assert_frame_equal(df_partition_json, df_partition_text)
+    partition_state_map = df_partition_text.set_index("partition_name")["partition_state"].to_dict()
+    with open(REPO_ROOT / "scontrol_show_node_o.txt") as fh:
+        df_node_text = get_scontrol_node_df(fh, partition_state_map=partition_state_map)
+    with open(REPO_ROOT / "data" / "slurm_json" / "scontrol_show_node.json") as fh:
+        df_node_json = get_scontrol_node_json_df(fh, partition_state_map=partition_state_map)
+    pandas.testing.assert_frame_equal(df_node_json, df_node_text)
+
+
+def test_slurm_json_reservations_use_start_and_end_time():
+    with open(REPO_ROOT / "data" / "slurm_json" / "scontrol_show_reservation.json") as fh:
+        df = get_scontrol_reservation_json_df(fh, now=SLURM_JSON_NOW)
+    assert df["reservation_name"].tolist() == ["maint_a018", "single_a019", "future_a020"]
+    assert df["is_active"].tolist() == [True, True, False]
+    assert df["start_time"].tolist() == [1769996400, 1769999940, 1770003600]
+    assert df["reserved_cores"].tolist() == [32, 16, 64]
+    assert df["reserved_mem_mb"].tolist()[:2] == [64000, 0]
+
+
+def test_slurm_cli_selects_json_backend_from_commands():
+    out = _run_cli(
+        [
+            "--example_file",
+            "data/slurm_json/squeue.json",
+            "--stat_command",
+            "squeue --json",
+            "--slurm_node_command",
+            "scontrol --json show node",
+            "--slurm_node_example_file",
+            "data/slurm_json/scontrol_show_node.json",
+            "--slurm_partition_command",
+            "scontrol --json show partition",
+            "--slurm_partition_example_file",
+            "data/slurm_json/scontrol_show_partition.json",
+            "--slurm_reservation_command",
+            "scontrol --json show reservation",
+            "--slurm_reservation_example_file",
+            "data/slurm_json/scontrol_show_reservation.json",
+        ]
+    )
+    assert out.returncode == 0, out.stderr
+    assert "jobs  self:R/Q/F=" in out.stdout
+    assert "cpu(a/u/t)" in out.stdout
+
+
+def test_slurm_cli_walltime_subtracts_upcoming_reservations_from_launch_ceiling(tmp_path):
+    start = time.localtime(time.time() + 3600)
+    end = time.localtime(time.time() + 7200)
+    reservation_file = tmp_path / "reservation.txt"
+    reservation_file.write_text(
+        "ReservationName=maint StartTime={} EndTime={} Duration=01:00:00\n"
+        "Nodes=a[001-049] NodeCnt=49 CoreCnt=9408 PartitionName=epyc Flags=MAINT State=INACTIVE\n".format(
+            time.strftime("%Y-%m-%dT%H:%M:%S", start), time.strftime("%Y-%m-%dT%H:%M:%S", end)
+        )
+    )
+    args = [
+        "--example_file",
+        "squeue_notrunc.txt",
+        "--stat_command",
+        "squeue",
+        "--slurm_node_example_file",
+        "scontrol_show_node_o.txt",
+        "--slurm_partition_example_file",
+        "scontrol_show_partition_o.txt",
+        "--slurm_reservation_example_file",
+        str(reservation_file),
+    ]
+    def epyc_row(stdout):
+        return [line for line in stdout.splitlines() if line.startswith("epyc ")][0].split()
+    out_now = _run_cli(args)
+    assert out_now.returncode == 0, out_now.stderr
+    out_short = _run_cli(args + ["--walltime", "30:00"])
+    assert out_short.returncode == 0, out_short.stderr
+    out_long = _run_cli(args + ["--walltime", "1-00:00:00"])
+    assert out_long.returncode == 0, out_long.stderr
+    assert epyc_row(out_short.stdout) == epyc_row(out_now.stdout)
+    assert epyc_row(out_long.stdout)[:-1] == epyc_row(out_now.stdout)[:-1]
+    assert epyc_row(out_now.stdout)[-1] != "<=0c/0G"
+    assert epyc_row(out_long.stdout)[-1] == "<=0c/0G"
+    assert "within --walltime 1-00:00:00" in out_long.stdout
+
+
+def test_slurm_cli_skips_timed_out_sprio_with_note():
+    out = _run_cli(
+        [
+            "--example_file",
+            "squeue_notrunc.txt",
+            "--stat_command",
+            "squeue",
+            "--slurm_node_example_file",
+            "scontrol_show_node_o.txt",
+            "--slurm_partition_example_file",
+            "scontrol_show_partition_o.txt",
+            "--slurm_prio_command",
+            "{} -c 'import time; time.sleep(30)'".format(sys.executable),
+            "--command_timeout",
+            "0.5",
+        ]
+    )
+    assert out.returncode == 0, out.stderr
+    assert "cpu(a/u/t)" in out.stdout
+    assert "note: --slurm_prio_command timed out after" in out.stdout
+
+
 def test_slurm_cli_writes_valid_tsv(tmp_path):
     out_file = tmp_path / "slurm.tsv"
     out = _run_cli(
@@ -185,3 +501,32 @@ def test_qstat_cli_writes_valid_tsv(tmp_path):
     assert df.shape[0] > 0
     expected_cols = {"queue_name", "node_name", "ncore_available", "hc:mem_req", "hl:mem_total"}
     assert expected_cols.issubset(set(df.columns))
+
+
+@pytest.mark.parametrize("current_user", ["", "tanaka"])
+def test_squeue_job_counts_match_dataframe_summary(capsys, current_user):
+    with open(REPO_ROOT / "squeue_notrunc.txt") as fh:
+        lines = fh.readlines()
+    print_queued_job_summary(get_squeue_user_df(lines), scheduler="slurm", current_user=current_user)
+    expected = capsys.readouterr().out
+    print_squeue_job_counts(get_squeue_job_counts(iter(lines)), current_user=current_user)
+    assert capsys.readouterr().out == expected
+    with open(REPO_ROOT / "data" / "slurm_json" / "squeue.json") as fh:
+        print_queued_job_summary(get_squeue_json_user_df(fh), scheduler="slurm", current_user=current_user)
+    expected = capsys.readouterr().out
+    with open(REPO_ROOT / "data" / "slurm_json" / "squeue.json") as fh:
+        print_squeue_job_counts(get_squeue_job_counts(fh, is_json=True), current_user=current_user)
+    assert capsys.readouterr().out == expected
+
+
+def test_jobs_mode_cli_prints_only_job_counts():
+    out = _run_cli(
+        ["--mode", "jobs", "--example_file", "squeue_notrunc.txt", "--stat_command", "squeue"],
+        extra_env={"USER": "tanaka"},
+    )
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.startswith("jobs  self:R/Q/F=")
+    assert "part " not in out.stdout
+    out = _run_cli(["--mode", "jobs", "--stat_command", "qstat -F"])
+    assert out.returncode == 1
+    assert "--mode jobs supports squeue" in out.stderr
@@ -1,4 +1,7 @@
 import shlex
+import sys
+import threading
+import time
 from types import SimpleNamespace
 
 import pandas
@@ -6,14 +9,24 @@ import pytest
 
 import kfbatch.stat as stat_module
 from kfbatch.stat import (
+    estimate_slurm_task_count,
     KFBatchCommandError,
+    KFBatchCommandTimeout,
     KFBatchUsageError,
     SLURM_SQUEUE_PARSE_FIELDS,
     adjust_ram_unit,
     apply_slurm_reservations,
+    command_has_json_option,
+    get_command_budget,
     get_command_stdout_lines,
+    add_command_filter,
     get_df,
+    get_qhost_df,
+    get_qstat_command_for_parsing,
     get_qstat_df,
+    get_qstat_gc_df,
+    get_qstat_job_df,
+    get_qstat_xml_df,
     get_scheduler_from_command,
     get_scontrol_reservation_df,
     get_slurm_launch_heuristic_df,
@@ -21,10 +34,25 @@ from kfbatch.stat import (
     print_slurm_compact_summary,
     print_queued_job_summary,
     print_slurm_launch_heuristic,
+    print_resource_availability,
     get_user_df,
+    get_uge_launch_heuristic_df,
+    get_uge_pending_capacity_df,
+    get_uge_pending_accumulator,
+    get_uge_pending_demand_df,
     get_scontrol_node_df,
+    get_scontrol_node_table,
+    get_scontrol_partition_filter_command,
+    get_slurm_cluster_view,
+    get_slurm_partition_view,
     get_squeue_command_for_parsing,
+    get_squeue_json_user_df,
     get_squeue_user_df,
+    get_uge_source,
+    get_walltime_minutes,
+    iter_command_stdout_lines,
+    parse_command_stdout,
+    print_command_notes,
 )
 
 
@@ -33,6 +61,11 @@ def test_get_scheduler_from_command_accepts_full_path():
     assert get_scheduler_from_command("/opt/sge/bin/qstat -F") == "uge"
 
 
+def test_get_scheduler_from_command_detects_qstat_xml():
+    assert get_scheduler_from_command("qstat -F -xml") == "uge_xml"
+    assert get_scheduler_from_command("qstat -F") == "uge"
+
+
 def test_get_squeue_command_for_parsing_adds_required_flags():
     command = get_squeue_command_for_parsing("squeue")
     tokens = shlex.split(command)
@@ -60,6 +93,51 @@ def test_get_squeue_command_for_parsing_overrides_short_o_attached():
     assert SLURM_SQUEUE_PARSE_FIELDS in tokens
 
 
+def test_command_has_json_option_and_json_squeue_command_is_kept():
+    assert command_has_json_option("squeue --json")
+    assert command_has_json_option("scontrol --json show node")
+    assert command_has_json_option("squeue --json=v0.0.41 -u kfuku")
+    assert not command_has_json_option("squeue -o %i")
+    assert not command_has_json_option("'")
+    assert get_squeue_command_for_parsing("squeue --json -u kfuku") == "squeue --json -u kfuku"
+
+
+def test_get_squeue_json_user_df_decodes_elements_split_across_lines():
+    lines = [
+        '{"meta": {"plugin": {"data_parser": "data_parser/v0.0.41"}}, "jobs": [',
+        '{"job_id": 101, "array_job_id": {"set": true, "infinite": false, "number": 0},',
+        ' "job_state": ["RUNNING"], "partition": "epyc", "name": "wrap", "user_name": "kfuku",',
+        ' "start_time": {"set": true, "infinite": false, "number": 1000}, "node_count": {"set": true, "infinite": false, "number": 1},',
+        ' "cpus": {"set": true, "infinite": false, "number": 4}, "memory_per_node": {"set": true, "infinite": false, "number": 8000},',
+        ' "time_limit": {"set": true, "infinite": false, "number": 90}, "nodes": "a018"},',
+        '{"job_id": 150, "array_job_id": 140, "array_task_string": "1-10", "array_max_tasks": 2,',
+        ' "job_state": "PENDING", "partition": "epyc", "name": "arr", "user_name": "other", "state_reason": "Priority",',
+        ' "node_count": 1, "cpus": 1, "memory_per_cpu": 500, "time_limit": {"set": true, "infinite": true, "number": 0}},',
+        '{"job_id": 160, "job_state": "PENDING", "partition": "epyc", "name": "mpi", "user_name": "other",',
+        ' "state_reason": "Resources", "node_count": 2, "cpus": 8,',
+        ' "memory_per_node": {"set": false, "infinite": false, "number": 0},',
+        ' "memory_per_cpu": {"set": true, "infinite": false, "number": 1000}, "time_limit": 60}',
+        '], "warnings": [], "errors": []}',
+    ]
+    df = get_squeue_json_user_df(lines, now=1000 + 3725)
+    assert df["job_id"].tolist() == ["101", "140_[1-10%2]", "160"]
+    assert df["state"].tolist() == ["R", "PD", "PD"]
+    assert df["elapsed_time"].tolist() == ["1:02:05", "0:00", "0:00"]
+    assert df["req_cpus"].tolist() == [4, 1, 8]
+    # memory_per_cpu is scaled to a per-node amount, like memory_per_node and squeue %m.
+    assert df["req_mem"].tolist() == ["8000M", "500M", "4000M"]
+    assert df["time_limit"].tolist() == ["1:30:00", "UNLIMITED", "1:00:00"]
+    assert df["node_or_reason"].tolist() == ["a018", "(Priority)", "(Resources)"]
+    assert df["pending_reason"].tolist() == ["", "Priority", "Resources"]
+    assert df["total_slots"].tolist() == [1, 10, 1]
+    assert df["resource_fields_complete"].tolist() == [True, True, True]
+
+
+def test_get_squeue_json_user_df_raises_on_truncated_json():
+    with pytest.raises(KFBatchCommandError):
+        get_squeue_json_user_df(['{"jobs": [{"job_id": 1}, {"job_id"'])
+
+
 def test_get_squeue_command_for_parsing_preserves_non_format_filters():
     command = get_squeue_command_for_parsing("squeue -u kfuku -p epyc --format=%i")
     tokens = shlex.split(command)
@@ -71,6 +149,17 @@ def test_get_squeue_command_for_parsing_preserves_non_format_filters():
     assert SLURM_SQUEUE_PARSE_FIELDS in tokens
 
 
+def test_get_qstat_command_for_parsing_projects_resources():
+    resources = "mem_req,mem_total,m_topology_inuse"
+    assert shlex.split(get_qstat_command_for_parsing("qstat -F")) == ["qstat", "-F", resources]
+    tokens = shlex.split(get_qstat_command_for_parsing("qstat -F -xml"))
+    assert tokens == ["qstat", "-F", resources, "-xml"]
+    tokens = shlex.split(get_qstat_command_for_parsing("qstat -F slots,mem_total -q epyc.q"))
+    assert tokens == ["qstat", "-F", "slots,mem_total,mem_req,m_topology_inuse", "-q", "epyc.q"]
+    tokens = shlex.split(get_qstat_command_for_parsing("qstat -q epyc.q"))
+    assert tokens == ["qstat", "-q", "epyc.q", "-F", resources]
+
+
 def test_get_command_stdout_lines_empty_command_allow_failure():
     out = get_command_stdout_lines("", allow_failure=True, quiet_failure=True)
     assert out is None
@@ -101,6 +190,169 @@ def test_get_command_stdout_lines_malformed_command_raises():
         get_command_stdout_lines("'", allow_failure=False, quiet_failure=True)
 
 
+SLOW_COMMAND = "{} -c 'import time; print(1, flush=True); time.sleep(30)'".format(shlex.quote(sys.executable))
+# 2026-03-06T18:00:00Z, inside the reservations of the scontrol fixtures below
+# (2026-03-06T12:00:00 to 2026-03-07T12:00:00 local time) in any time zone.
+RESERVATION_FIXTURE_NOW = 1772820000
+
+
+def test_get_command_stdout_lines_skips_timed_out_optional_source_with_note(capsys):
+    args = SimpleNamespace(command_timeout=0.2, total_timeout=0)
+    budget = get_command_budget(args)
+    out = get_command_stdout_lines(SLOW_COMMAND, allow_failure=True, command_name="--slurm_prio_command", budget=budget)
+    assert out is None
+    assert len(budget["notes"]) == 1
+    assert budget["notes"][0].startswith("--slurm_prio_command timed out after 0.")
+    print_command_notes(args)
+    assert capsys.readouterr().out.startswith("note: --slurm_prio_command timed out after")
+
+
+def test_get_command_stdout_lines_raises_timeout_for_mandatory_source():
+    budget = get_command_budget(SimpleNamespace(command_timeout=0.2, total_timeout=0))
+    with pytest.raises(KFBatchCommandTimeout, match="Timed out after .* running --stat_command"):
+        get_command_stdout_lines(SLOW_COMMAND, allow_failure=False, command_name="--stat_command", budget=budget)
+
+
+def test_command_budget_total_timeout_skips_commands_once_exhausted():
+    budget = get_command_budget(SimpleNamespace(command_timeout=0, total_timeout=0.2))
+    out = get_command_stdout_lines(SLOW_COMMAND, allow_failure=True, command_name="--slurm_node_command", budget=budget)
+    assert out is None
+    out = get_command_stdout_lines("echo hi", allow_failure=True, command_name="--slurm_prio_command", budget=budget)
+    assert out is None
+    assert budget["notes"][-1] == "--slurm_prio_command was skipped because --total_timeout was reached."
+    with pytest.raises(KFBatchCommandTimeout, match="Skipped --stat_command"):
+        get_command_stdout_lines("echo hi", allow_failure=False, command_name="--stat_command", budget=budget)
+
+
+def test_iter_command_stdout_lines_kills_command_after_timeout():
+    budget = get_command_budget(SimpleNamespace(command_timeout=0.3, total_timeout=0))
+    lines = []
+    with pytest.raises(KFBatchCommandTimeout):
+        for line in iter_command_stdout_lines(SLOW_COMMAND, command_name="--stat_command", budget=budget):
+            lines.append(line)
+    assert lines == ["1\n"]
+
+
+def test_iter_command_stdout_lines_decodes_utf8_whatever_the_locale(monkeypatch, tmp_path):
+    monkeypatch.setenv("LC_ALL", "C")
+    code = "import sys; sys.stdout.buffer.write(b'n\\xc3\\xa9ud\\n\\xffbad\\n')"
+    command = "{} -c {}".format(shlex.quote(sys.executable), shlex.quote(code))
+    assert list(iter_command_stdout_lines(command)) == ["néud\n", "�bad\n"]
+    example_file = tmp_path / "example.txt"
+    example_file.write_bytes(b"n\xc3\xa9ud\n\xffbad\n")
+    assert list(iter_command_stdout_lines("", example_file=str(example_file))) == ["néud\n", "�bad\n"]
+
+
+def test_parse_command_stdout_receives_lines_while_the_command_runs():
+    command = "{} -c 'import time; print(1, flush=True); time.sleep(0.5); print(2)'".format(shlex.quote(sys.executable))
+    arrivals = []
+
+    def parse(lines):
+        for line in lines:
+            arrivals.append((line, time.monotonic()))
+        return len(arrivals)
+
+    assert parse_command_stdout(parse, command_str=command) == 2
+    assert [line for line, _ in arrivals] == ["1\n", "2\n"]
+    assert arrivals[1][1] - arrivals[0][1] > 0.3
+
+
+def test_parse_command_stdout_discards_output_of_failed_optional_command():
+    command = "{} -c 'import sys; print(1); sys.exit(\"boom\")'".format(shlex.quote(sys.executable))
+    assert parse_command_stdout(list, command_str=command, allow_failure=True) is None
+    with pytest.raises(KFBatchCommandError, match="boom"):
+        parse_command_stdout(list, command_str=command, allow_failure=False)
+    # Errors of the parser itself are not mistaken for a failed command.
+    with pytest.raises(KFBatchCommandError, match="Failed to parse JSON"):
+        parse_command_stdout(get_squeue_json_user_df, command_str="echo '{\"jobs\": ['", allow_failure=True)
+
+
+def _counting_command(counter_path, sleep_s=0.0):
+    # Prints "out" after sleep_s seconds and appends one byte to counter_path per run.
+    code = "import time; open({!r}, 'a').write('x'); time.sleep({}); print('out')".format(str(counter_path), sleep_s)
+    return "{} -c {}".format(shlex.quote(sys.executable), shlex.quote(code))
+
+
+def _cache_budget(cache_dir, cache_ttl=60.0):
+    return get_command_budget(SimpleNamespace(command_timeout=10, total_timeout=0, cache_dir=str(cache_dir), cache_ttl=cache_ttl))
+
+
+def test_cached_command_output_is_reused_within_ttl(tmp_path, capsys):
+    counter_path = tmp_path / "counter"
+    command = _counting_command(counter_path)
+    args = SimpleNamespace(command_timeout=10, total_timeout=0, cache_dir=str(tmp_path / "cache"), cache_ttl=0.5)
+    first_budget = _cache_budget(tmp_path / "cache", cache_ttl=0.5)
+    assert parse_command_stdout(list, command_str=command, budget=first_budget) == ["out\n"]
+    assert first_budget["cache_ages"] == []
+    second_budget = get_command_budget(args)
+    assert parse_command_stdout(list, command_str=command, budget=second_budget) == ["out\n"]
+    assert counter_path.read_text() == "x"
+    assert len(second_budget["cache_ages"]) == 1
+    print_command_notes(args)
+    assert "read from --cache_dir {} and is up to 0 s old".format(args.cache_dir) in capsys.readouterr().out
+    time.sleep(0.6)
+    assert parse_command_stdout(list, command_str=command, budget=_cache_budget(tmp_path / "cache", cache_ttl=0.5)) == ["out\n"]
+    assert counter_path.read_text() == "xx"
+
+
+def test_cached_command_refresh_is_shared_by_concurrent_runs(tmp_path):
+    counter_path = tmp_path / "counter"
+    command = _counting_command(counter_path, sleep_s=0.5)
+    barrier = threading.Barrier(3, timeout=5)
+    outputs = []
+
+    def run():
+        budget = _cache_budget(tmp_path)
+        barrier.wait()
+        outputs.append(parse_command_stdout(list, command_str=command, budget=budget))
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert outputs == [["out\n"]] * 3
+    assert counter_path.read_text() == "x"
+
+
+def test_cached_job_listings_are_not_shared_between_users(tmp_path, monkeypatch):
+    counter_path = tmp_path / "counter"
+    command = _counting_command(counter_path)
+    cache_dir = tmp_path / "cache"
+    for user in ["alice", "bob", "alice"]:
+        monkeypatch.setattr(stat_module.getpass, "getuser", lambda: user)
+        assert parse_command_stdout(list, command_str=command, budget=_cache_budget(cache_dir)) == ["out\n"]
+    assert counter_path.read_text() == "xx"
+    modes = [path.stat().st_mode & 0o777 for path in cache_dir.glob("*.out")]
+    assert modes == [0o600, 0o600]
+
+
+def test_cached_node_listings_are_shared_between_users(tmp_path, monkeypatch):
+    counter_path = tmp_path / "counter"
+    qhost = tmp_path / "bin" / "qhost"
+    qhost.parent.mkdir()
+    qhost.write_text("#!/bin/sh\nprintf x >> {}\necho out\n".format(shlex.quote(str(counter_path))))
+    qhost.chmod(0o755)
+    cache_dir = tmp_path / "cache"
+    for user in ["alice", "bob"]:
+        monkeypatch.setattr(stat_module.getpass, "getuser", lambda: user)
+        assert parse_command_stdout(list, command_str=str(qhost), budget=_cache_budget(cache_dir)) == ["out\n"]
+    assert counter_path.read_text() == "x"
+    assert [path.stat().st_mode & 0o777 for path in cache_dir.glob("*.out")] == [0o644]
+    assert stat_module._is_shared_cache_command("scontrol --json show node")
+    assert stat_module._is_shared_cache_command("/usr/bin/scontrol show partition -o")
+    assert not stat_module._is_shared_cache_command("scontrol show job")
+    assert not stat_module._is_shared_cache_command("squeue --noheader")
+    assert not stat_module._is_shared_cache_command("qstat -F")
+
+
+def test_failed_command_output_is_not_cached(tmp_path):
+    command = "{} -c 'import sys; print(1); sys.exit(1)'".format(shlex.quote(sys.executable))
+    budget = _cache_budget(tmp_path)
+    assert parse_command_stdout(list, command_str=command, allow_failure=True, budget=budget) is None
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [".lock"]
+
+
 def test_get_squeue_user_df_parses_literal_backslash_t():
     lines = [
         r"14817340_[106-239%239]\tepyc\tpepHsapE115\tktamagawa\tPD\t0:00\t1\t(Priority)",
@@ -124,6 +376,14 @@ def test_get_squeue_user_df_marks_truncated_array_as_estimated():
     assert bool(df.at[0, "task_count_estimated"]) is True
 
 
+def test_estimate_slurm_task_count_reads_array_suffixes():
+    assert estimate_slurm_task_count("123") == (1, False)
+    assert estimate_slurm_task_count("123_7") == (1, False)
+    assert estimate_slurm_task_count("123_[1-4,8%2]") == (5, False)
+    assert estimate_slurm_task_count("123_[1-4") == (4, True)
+    assert estimate_slurm_task_count("123_") == (1, True)
+
+
 def test_get_squeue_user_df_parses_extended_slurm_fields():
     lines = [
         "15243876\tepyc\twrap\tkfuku\tPD\t0:00\t1\t1\t1G\t00:05:00\t(Priority)",
@@ -148,6 +408,48 @@ def test_get_squeue_user_df_marks_legacy_slurm_fields_as_incomplete():
     assert bool(df.at[0, "resource_fields_complete"]) is False
 
 
+def test_get_squeue_user_df_fast_path_matches_per_line_parsing_and_keeps_order():
+    lines = [
+        "101\tepyc\twrap\tkfuku\tR\t1:00\t1\t4\t8G\t1-00:00:00\tnode01\n",
+        "102\tepyc\twrap\tkfuku\tPD\t0:00\t1\t(Priority)\n",
+        "103_[1-10%2]\tepyc\twrap\tother\tPD\t0:00\tx\t\t\t\t( Resources )\n",
+        "\n",
+        "  JOBID PARTITION NAME USER ST TIME NODES NODELIST(REASON)\n",
+        "104 short wrap other R 2:00 2 node[01-02]\n",
+        " 105_7\t epyc\twrap \tkfuku\tR\t1:00\t1\t2\t4G\t01:00:00\tnode02\n",
+    ]
+    df = get_squeue_user_df(lines)
+    assert df["job_id"].tolist() == ["101", "102", "103_[1-10%2]", "104", "105_7"]
+    for i, line in enumerate([lines[0], lines[1], lines[2], lines[5], lines[6]]):
+        row = get_squeue_user_df([line]).iloc[0, :]
+        assert row.tolist() == df.iloc[i, :].tolist()
+    assert df["resource_fields_complete"].tolist() == [True, False, True, False, True]
+    assert df["num_nodes"].tolist() == [1, 1, 1, 2, 1]
+    assert df["req_cpus"].tolist() == [4, 0, 0, 0, 2]
+    assert df["pending_reason"].tolist() == ["", "Priority", "Resources", "", ""]
+    assert df["total_slots"].tolist() == [1, 1, 10, 1, 1]
+    assert df.at[4, "partition"] == "epyc"
+    assert df.at[4, "name"] == "wrap"
+
+
+def test_get_squeue_user_df_compact_table_uses_categories_and_drops_detail_columns():
+    lines = [
+        "101\tepyc\twrap\tkfuku\tR\t1:00\t1\t4\t8G\t1-00:00:00\tnode01\n",
+        "102\tepyc\twrap\tkfuku\tPD\t0:00\t1\t(Priority)\n",
+        "103_[1-10%2]\tepyc\twrap\tother\tPD\t0:00\t1\t2\t4G\t01:00:00\t(Resources)\n",
+    ]
+    df_full = get_squeue_user_df(lines)
+    df = get_squeue_user_df(lines, detail_columns=False)
+    assert "name" in df_full.columns
+    assert [col for col in ["name", "elapsed_time", "node_or_reason"] if col in df.columns] == []
+    for col in ["partition", "user", "state", "pending_reason"]:
+        assert isinstance(df[col].dtype, pandas.CategoricalDtype)
+        assert df[col].astype(str).tolist() == df_full[col].astype(str).tolist()
+    assert df["req_cpus"].dtype == "int32"
+    assert df["pending_reason"].tolist() == ["", "Priority", "Resources"]
+    assert df["total_slots"].tolist() == [1, 1, 10]
+
+
 def test_get_scontrol_node_df_skips_nodes_without_partition_and_marks_reserved():
     lines = [
         "NodeName=n1 Arch=x86_64 CPUAlloc=4 CPUEfctv=16 CPUTot=16 RealMemory=32000 FreeMem=16000 State=IDLE Partitions=p1",
@@ -214,6 +516,136 @@ def test_get_scontrol_node_df_uses_schedulable_memory_over_free_mem():
     assert df.at[0, "hc:mem_req"] == "4000M"
 
 
+def test_parse_key_value_fields_keeps_values_with_spaces_and_projects_keys():
+    line = (
+        "NodeName=a001 CoresPerSocket=1  CPUAlloc=0 OS=Linux 6.8.0-51-generic #52-Ubuntu SMP Thu Dec  5 2024  "
+        "RealMemory=1547683 State=DOWN+DRAIN Reason=Not responding [slurm@2026-02-08T15:40:28] "
+        "CfgTRES=cpu=192,mem=1547683M AllocTRES= Partitions=login"
+    )
+    params = stat_module._parse_key_value_fields(line)
+    assert params["OS"] == "Linux 6.8.0-51-generic #52-Ubuntu SMP Thu Dec  5 2024"
+    assert params["Reason"] == "Not responding [slurm@2026-02-08T15:40:28]"
+    assert params["CfgTRES"] == "cpu=192,mem=1547683M"
+    assert params["AllocTRES"] == ""
+    assert params["Partitions"] == "login"
+    projected = stat_module._parse_key_value_fields(line, keys={"NodeName", "State", "Partitions"})
+    assert projected == {"NodeName": "a001", "State": "DOWN+DRAIN", "Partitions": "login"}
+    # "key=value" text inside a value neither ends it nor overwrites a real field.
+    line = "NodeName=a002 State=IDLE+DRAIN Reason=bad dimm slot=3 state=failed  [root@2026-02-08] Partitions=epyc"
+    params = stat_module._parse_key_value_fields(line, keys={"NodeName", "State", "Reason", "Partitions"})
+    assert params == {
+        "NodeName": "a002",
+        "State": "IDLE+DRAIN",
+        "Reason": "bad dimm slot=3 state=failed  [root@2026-02-08]",
+        "Partitions": "epyc",
+    }
+    blocks = stat_module._split_scontrol_node_blocks([
+        "NodeName=n1 Arch=x86_64\n",
+        "   OS=Linux 6.8.0 #1 SMP\n",
+        "   State=IDLE Partitions=p1\n",
+        "\n",
+        "NodeName=n2 State=MIXED\n",
+        "   Partitions=p2\n",
+    ])
+    assert blocks == [
+        "NodeName=n1 Arch=x86_64 OS=Linux 6.8.0 #1 SMP State=IDLE Partitions=p1",
+        "NodeName=n2 State=MIXED Partitions=p2",
+    ]
+
+
+def test_get_scontrol_node_table_keeps_one_row_per_node_with_partition_index():
+    lines = [
+        "NodeName=n2 CPUAlloc=8 CPUTot=16 RealMemory=32000 AllocMem=8000 State=MIXED Partitions=all,p1",
+        "NodeName=n1 CPUAlloc=4 CPUTot=16 RealMemory=32000 AllocMem=0 State=MIXED Partitions=p1,all",
+        "NodeName=n3 CPUAlloc=0 CPUTot=8 RealMemory=16000 AllocMem=0 State=IDLE Partitions=all,p2",
+    ]
+    node_table = get_scontrol_node_table(lines, partition_state_map={"all": "UP", "p1": "UP", "p2": "DOWN"})
+    assert node_table["df_node"]["node_name"].tolist() == ["n1", "n2", "n3"]
+    assert "queue_name" not in node_table["df_node"].columns
+    assert node_table["partition_names"].tolist() == ["all", "p1", "p2"]
+    assert node_table["partition_offsets"].tolist() == [0, 3, 5, 6]
+    assert node_table["partition_nodes"].tolist() == [0, 1, 2, 0, 1, 2]
+    df = get_slurm_partition_view(node_table)
+    assert df["queue_name"].tolist() == ["all", "all", "all", "p1", "p1", "p2"]
+    assert df["node_name"].tolist() == ["n1", "n2", "n3", "n1", "n2", "n3"]
+    assert df["status"].tolist() == ["", "", "", "", "", "partition_state=DOWN"]
+    df_reservation = pandas.DataFrame(
+        {
+            "queue_name": ["p1"],
+            "node_name": ["n1"],
+            "reservation_name": ["r1"],
+            "reserved_cores": [4],
+            "reserved_mem_mb": [8000],
+        }
+    )
+    node_table["df_node"] = apply_slurm_reservations(node_table["df_node"], df_reservation)
+    df = get_slurm_partition_view(node_table)
+    # A reserved core is unavailable through every partition of its node.
+    assert df.loc[df["node_name"] == "n1", "ncore_available"].tolist() == [8, 8]
+    assert df.loc[df["node_name"] == "n1", "hc:mem_req"].tolist() == ["24000M", "24000M"]
+
+
+def test_print_resource_availability_compresses_tied_nodes_with_all_tiers(capsys):
+    df = pandas.DataFrame(
+        {
+            "queue_name": ["epyc"] * 5,
+            "node_name": ["a003", "a001", "a002", "a010", "a011"],
+            "ncore_available": [64, 64, 64, 64, 8],
+            "hc:mem_req": [256.0, 256.0, 256.0, 128.0, 256.0],
+            "hc:mem_req_unit": ["G"] * 5,
+            "status": [""] * 5,
+        }
+    )
+    args = SimpleNamespace(exclude_abnormal_node=False, ntop=2, all_tiers=True)
+    print_resource_availability(df, args)
+    out = capsys.readouterr().out
+    assert "epyc: 64 cores and 256G RAM in a[001-003] (3 nodes)" in out
+    assert "epyc: 64 cores and 128G RAM in a010" in out
+    args.all_tiers = False
+    print_resource_availability(df, args)
+    out = capsys.readouterr().out
+    assert "epyc: 64 cores and 256G RAM in a003" in out
+    assert "nodes)" not in out
+
+
+def test_print_slurm_compact_summary_adds_deduplicated_cluster_row(capsys):
+    lines = [
+        "NodeName=n1 CPUAlloc=4 CPUTot=16 RealMemory=32000 AllocMem=0 State=MIXED Partitions=p1,all",
+        "NodeName=n2 CPUAlloc=0 CPUTot=16 RealMemory=32000 AllocMem=0 State=DOWN Partitions=p1,all",
+        "NodeName=n3 CPUAlloc=0 CPUTot=8 RealMemory=16000 AllocMem=0 State=IDLE Partitions=all,login",
+    ]
+    node_table = get_scontrol_node_table(lines)
+    df = adjust_ram_unit(get_slurm_partition_view(node_table))
+    df_cluster = adjust_ram_unit(node_table["df_node"].copy())
+    args = SimpleNamespace(exclude_abnormal_node=True)
+    print_slurm_compact_summary(df, None, args, df_cluster=df_cluster)
+    out = capsys.readouterr().out
+    rows = {line.split()[0]: line.split() for line in out.splitlines() if line.strip() != ""}
+    assert rows["all"][1:3] == ["2/1/3", "20/4/40"]
+    assert rows["p1"][1:3] == ["1/1/2", "12/4/32"]
+    assert "login" not in rows
+
+
+def test_slurm_cluster_row_counts_nodes_of_down_partitions_as_abnormal(capsys):
+    lines = [
+        "NodeName=n1 CPUAlloc=4 CPUTot=16 RealMemory=32000 AllocMem=0 State=MIXED Partitions=p1",
+        "NodeName=n2 CPUAlloc=0 CPUTot=16 RealMemory=32000 AllocMem=0 State=IDLE Partitions=p1,old",
+        "NodeName=n3 CPUAlloc=0 CPUTot=8 RealMemory=16000 AllocMem=0 State=IDLE Partitions=old",
+        "NodeName=n4 CPUAlloc=0 CPUTot=8 RealMemory=16000 AllocMem=0 State=DOWN Partitions=old,off",
+    ]
+    node_table = get_scontrol_node_table(lines, partition_state_map={"p1": "UP", "old": "INACTIVE", "off": "DOWN"})
+    df_cluster = get_slurm_cluster_view(node_table)
+    assert df_cluster["status"].tolist() == ["", "", "partition_state=INACTIVE", "DOWN|partition_state=DOWN"]
+    assert node_table["df_node"]["status"].tolist() == ["", "", "", "DOWN"]
+    df = adjust_ram_unit(get_slurm_partition_view(node_table))
+    args = SimpleNamespace(exclude_abnormal_node=True)
+    print_slurm_compact_summary(df, None, args, df_cluster=adjust_ram_unit(df_cluster))
+    out = capsys.readouterr().out
+    rows = {line.split()[0]: line.split() for line in out.splitlines() if line.strip() != ""}
+    assert rows["all"][1:3] == ["2/2/4", "28/4/48"]
+    assert rows["p1"][1:3] == ["2/0/2", "28/4/32"]
+
+
 def test_get_scontrol_reservation_df_counts_explicit_core_ids_and_single_node_fallback():
     lines = [
         "ReservationName=r1 StartTime=2026-03-06T12:00:00 EndTime=2026-03-07T12:00:00 Duration=1-00:00:00",
@@ -231,6 +663,87 @@ def test_get_scontrol_reservation_df_counts_explicit_core_ids_and_single_node_fa
     assert int(df.loc[df["node_name"] == "a021", "reserved_cores"].iloc[0]) == 6
 
 
+def test_apply_slurm_reservations_resolves_multi_node_hostlist_reservations():
+    lines = [
+        "ReservationName=big StartTime=2026-03-06T12:00:00 EndTime=2026-03-07T12:00:00 Duration=1-00:00:00",
+        "Nodes=a[001-064,070] NodeCnt=65 CoreCnt=520 PartitionName=epyc Flags=IGNORE_JOBS State=ACTIVE TRES=cpu=520,mem=1300G",
+    ]
+    df_reservation = get_scontrol_reservation_df(lines)
+    assert df_reservation["node_name"].tolist() == ["a[001-064,070]"]
+    assert int(df_reservation.at[0, "reserved_cores"]) == 8
+    assert int(df_reservation.at[0, "reserved_mem_mb"]) == 20000
+    df_node = pandas.DataFrame(
+        {
+            "node_name": ["a001", "a064", "a065", "a070"],
+            "ncore_resv": [0, 0, 0, 0],
+            "ncore_available": [32, 32, 32, 4],
+            "ncore_total": [32, 32, 32, 32],
+            "hl:mem_total": ["64000M"] * 4,
+            "hc:mem_req": ["64000M"] * 4,
+            "status": [""] * 4,
+        }
+    )
+    out = apply_slurm_reservations(df_node, df_reservation, now=RESERVATION_FIXTURE_NOW)
+    assert out["ncore_available"].tolist() == [24, 24, 32, 0]
+    assert out["hc:mem_req"].tolist() == ["44000M", "44000M", "64000M", "44000M"]
+    # An ACTIVE reservation whose EndTime has passed no longer holds resources.
+    out = apply_slurm_reservations(df_node, df_reservation, now=RESERVATION_FIXTURE_NOW + 7 * 86400)
+    assert out["ncore_available"].tolist() == [32, 32, 32, 4]
+
+
+def test_apply_slurm_reservations_subtracts_peak_reservation_within_walltime():
+    now = 1_800_000_000
+    hour = 3600
+    df_node = pandas.DataFrame(
+        {
+            "node_name": ["a001", "a002"],
+            "ncore_resv": [0, 0],
+            "ncore_available": [32, 32],
+            "ncore_total": [32, 32],
+            "hl:mem_total": ["64000M", "64000M"],
+            "hc:mem_req": ["64000M", "64000M"],
+            "status": ["", ""],
+        }
+    )
+    df_reservation = pandas.DataFrame(
+        {
+            "queue_name": ["epyc"] * 5,
+            "node_name": ["a001", "a001", "a001", "a001", "a002"],
+            "reservation_name": ["active", "soon", "later", "ended", "soon2"],
+            "reserved_cores": [8, 16, 32, 32, 4],
+            "reserved_mem_mb": [8000, 16000, 32000, 32000, 4000],
+            "start_time": [now - hour, now + hour, now + 10 * hour, now - 9 * hour, now + 4 * hour],
+            "end_time": [now + 2 * hour, now + 5 * hour, now + 11 * hour, now - hour, now + 5 * hour],
+            "is_active": [True, False, False, False, False],
+        }
+    )
+    def available(walltime_minutes):
+        out = apply_slurm_reservations(df_node, df_reservation, walltime_minutes=walltime_minutes, now=now)
+        return out["ncore_available"].tolist(), out["hc:mem_req"].tolist()
+    assert available(0) == ([24, 32], ["56000M", "64000M"])
+    assert available(3 * 60) == ([8, 32], ["40000M", "64000M"])
+    assert available(12 * 60) == ([0, 28], ["32000M", "60000M"])
+
+
+def test_get_scontrol_reservation_df_keeps_inactive_reservations_with_times():
+    lines = [
+        "ReservationName=maint StartTime=2030-01-01T08:00:00 EndTime=2030-01-01T20:00:00 Duration=12:00:00",
+        "Nodes=a[001-002] NodeCnt=2 CoreCnt=64 PartitionName=epyc Flags=MAINT State=INACTIVE",
+    ]
+    df = get_scontrol_reservation_df(lines)
+    assert df["is_active"].tolist() == [False]
+    assert df.at[0, "end_time"] - df.at[0, "start_time"] == 12 * 3600
+    assert int(df.at[0, "reserved_cores"]) == 32
+
+
+def test_get_walltime_minutes_validates_slurm_time_format():
+    assert get_walltime_minutes("") == 0
+    assert get_walltime_minutes("90") == 90
+    assert get_walltime_minutes("3-00:00:00") == 3 * 24 * 60
+    with pytest.raises(KFBatchUsageError):
+        get_walltime_minutes("3 days")
+
+
 def test_apply_slurm_reservations_subtracts_partial_reservations_and_estimated_memory():
     df_node = pandas.DataFrame(
         {
@@ -341,6 +854,28 @@ def test_get_slurm_launch_heuristic_returns_na_when_priority_blocks_even_tiny_jo
     assert int(out.at[0, "top_node_cores"]) == 67
 
 
+def test_get_slurm_launch_heuristic_sorts_blocked_time_limits_by_minutes():
+    lines = [
+        "201\tepyc\twrap\tkfuku\tPD\t0:00\t1\t1\t1G\t1-00:00:00\t(Priority)\n",
+        "202\tepyc\twrap\tkfuku\tPD\t0:00\t1\t1\t1G\t10:00\t(Priority)\n",
+        "203\tepyc\twrap\tkfuku\tPD\t0:00\t1\t1\t1G\t2:00:00\t(Priority)\n",
+        "204\tepyc\twrap\tother\tPD\t0:00\t1\t1\t1G\t\t(Priority)\n",
+    ]
+    df_job = get_squeue_user_df(lines, detail_columns=False)
+    df_node = pandas.DataFrame(
+        {
+            "queue_name": ["epyc"],
+            "node_name": ["a001"],
+            "status": [""],
+            "ncore_available": [4],
+            "hc:mem_req": ["16G"],
+        }
+    )
+    out = get_slurm_launch_heuristic_df(df_node=df_node, df_job=df_job, current_user="kfuku")
+    assert out.at[0, "status"] == "priority_blocked"
+    assert out.at[0, "blocked_time_limit"] == "10:00"
+
+
 def test_get_slurm_launch_heuristic_returns_na_without_zero_sized_request_for_legacy_rows():
     df_node = pandas.DataFrame(
         {
@@ -391,6 +926,17 @@ def test_get_user_df_counts_uge_range_without_step():
     assert int(df.at[0, "total_slots"]) == 6
 
 
+def test_get_user_df_ignores_invalid_task_tokens():
+    lines = [
+        "  125 0.111 test user qw 02/12/2026 12:00:00 2 20-10,5-9:0,abc",
+        "  126 0.111 test user qw 02/12/2026 12:00:00 3 1-10:3,x1,12",
+        "  127 0.111 test user qw 02/12/2026 12:00:00 3 1-10:3,x1,12",
+    ]
+    df = get_user_df(lines)
+    # no valid token counts as a single task; 1-10:3 -> 1,4,7,10 plus 12
+    assert df["total_slots"].tolist() == [2, 15, 15]
+
+
 def test_get_user_df_handles_no_job_lines():
     df = get_user_df(["queuename qtype", "----"])
     assert df.shape[0] == 0
@@ -410,6 +956,33 @@ def test_get_qstat_df_includes_last_node():
     assert df.at[0, "node_name"] == "node01"
 
 
+def test_get_qstat_df_keeps_per_node_values_across_many_nodes():
+    lines = [
+        "queuename                      qtype resv/used/tot. np_load  arch          states\n",
+        "---------------------------------------------------------------------------------\n",
+        "medium.q@m02                   BP    0/28/80        0.24     lx-amd64      \n",
+        "\thl:mem_total=2.952T\n",
+        "\thc:mem_req=8.000G\n",
+        "---------------------------------------------------------------------------------\n",
+        "medium.q@m05                   BP    0/15/80        1.91     lx-amd64      a\n",
+        "\thl:mem_total=1.000T\n",
+        "\thl:m_socket=4\n",
+        "  16633111 0.25044 QLOGIN     kfuku        r     10/12/2022 17:19:58     1        \n",
+        "---------------------------------------------------------------------------------\n",
+        "epyc.q@at152                   BP    0/61/128       0.08     lx-amd64      \n",
+        "\thc:mem_req=251.346G\n",
+    ]
+    df = get_qstat_df(lines)
+    assert df["node_name"].tolist() == ["at152", "m02", "m05"]
+    assert df["status"].tolist() == ["", "", "a"]
+    assert df["ncore_available"].tolist() == [67, 52, 65]
+    assert df["hc:mem_req"].tolist() == ["251.346G", "8.000G", "0G"]
+    assert df["hl:mem_total"].tolist() == ["0G", "2.952T", "1.000T"]
+    assert "hl:m_socket" not in df.columns
+    df_all = get_qstat_df(lines, resource_keys=None)
+    assert df_all.loc[df_all["node_name"] == "m05", "hl:m_socket"].iloc[0] == "4"
+
+
 def test_get_qstat_df_skips_malformed_header_lines():
     lines = [
         "this is malformed",
@@ -452,6 +1025,221 @@ def test_get_qstat_df_clips_negative_available_and_fills_missing_memory():
     assert df.at[0, "hl:mem_total"] == "8.000G"
 
 
+def test_get_qstat_xml_df_streams_queue_and_job_lists():
+    lines = [
+        "<?xml version='1.0'?>\n",
+        "<job_info>\n",
+        "  <queue_info>\n",
+        "    <Queue-List>\n",
+        "      <name>epyc.q@node01</name><qtype>BP</qtype>\n",
+        "      <slots_used>1</slots_used><slots_resv>0</slots_resv><slots_total>4</slots_total>\n",
+        "      <load_avg>0.10</load_avg><arch>lx-amd64</arch>\n",
+        '      <resource name="mem_total" type="hl">8.000G</resource>\n',
+        '      <resource name="mem_req" type="hc">4.000G</resource>\n',
+        '      <job_list state="running"><JB_job_number>1</JB_job_number><JAT_prio>0.5</JAT_prio>\n',
+        "        <JB_name>a</JB_name><JB_owner>kfuku</JB_owner><state>r</state>\n",
+        "        <JAT_start_time>2026-02-12T12:00:00.000</JAT_start_time><slots>1</slots></job_list>\n",
+        "    </Queue-List>\n",
+        "    <Queue-List>\n",
+        "      <name>epyc.q@node02</name><qtype>BP</qtype>\n",
+        "      <slots_used>0</slots_used><slots_resv>0</slots_resv><slots_total>4</slots_total>\n",
+        "      <load_avg>0.00</load_avg><arch>lx-amd64</arch><state>d</state>\n",
+        "    </Queue-List>\n",
+        "  </queue_info>\n",
+        "  <job_info>\n",
+        '    <job_list state="pending"><JB_job_number>2</JB_job_number><JAT_prio>0.4</JAT_prio>\n',
+        "      <JB_name>b</JB_name><JB_owner>kfuku</JB_owner><state>qw</state>\n",
+        "      <JB_submission_time>2026-02-12T12:00:00.000</JB_submission_time>\n",
+        "      <slots>4</slots><tasks>1,2,4-8:2</tasks></job_list>\n",
+        "  </job_info>\n",
+        "</job_info>\n",
+    ]
+    df, df_user = get_qstat_xml_df(lines)
+    assert df["node_name"].tolist() == ["node01", "node02"]
+    assert df["ncore_available"].tolist() == [3, 4]
+    assert df["status"].tolist() == ["", "d"]
+    assert df["hc:mem_req"].tolist() == ["4.000G", "0G"]
+    assert df_user["state"].tolist() == ["r", "qw"]
+    assert df_user["total_slots"].tolist() == [1, 20]
+
+
+def test_get_qstat_xml_df_raises_on_malformed_xml():
+    with pytest.raises(KFBatchCommandError):
+        get_qstat_xml_df(["<job_info><queue_info>", "</job_info>"])
+
+
+def test_get_qstat_df_counts_free_cores_per_socket():
+    lines = [
+        "epyc.q@node01 BP 0/3/8 0.10 lx-amd64",
+        "\thl:m_topology_inuse=SCCccSccCC",
+        "epyc.q@node02 BP 0/2/6 0.10 lx-amd64",
+        "\thl:m_topology_inuse=SCTTcttSCTTCTTCTT",
+        "epyc.q@node03 BP 0/0/4 0.10 lx-amd64",
+    ]
+    df = get_qstat_df(lines)
+    assert df["ncore_socket_free"].tolist() == ["2/2", "1/3", ""]
+    assert df["ncore_socket_max"].tolist() == [2, 3, 0]
+
+
+def test_get_qhost_df_expands_host_values_to_queue_instances():
+    lines = [
+        "HOSTNAME                ARCH         NCPU NSOC NCOR NTHR  LOAD  MEMTOT  MEMUSE  SWAPTO  SWAPUS",
+        "----------------------------------------------------------------------------------------------",
+        "global                  -               -    -    -    -     -       -       -       -       -",
+        "node01                  lx-amd64        4    1    4    4  2.00    8.0G    1.0G    0.0     0.0",
+        "    Host Resource(s):      hl:mem_total=8.000G",
+        "                           hc:mem_req=4.000G",
+        "                           hl:m_socket=1",
+        "   epyc.q               BP    0/1/4",
+        "   short.q              BP    0/0/4         d",
+    ]
+    df = get_qhost_df(lines)
+    assert df["queue_name"].tolist() == ["epyc.q", "short.q"]
+    assert df["node_name"].tolist() == ["node01", "node01"]
+    assert df["ncore_available"].tolist() == [3, 4]
+    assert df["status"].tolist() == ["", "d"]
+    assert df["hc:mem_req"].tolist() == ["4.000G", "4.000G"]
+    assert df["np_load"].tolist() == ["0.50", "0.50"]
+    assert "hl:m_socket" not in df.columns
+
+
+def test_get_qstat_gc_df_parses_cluster_queue_totals():
+    lines = [
+        "CLUSTER QUEUE                   CQLOAD   USED    RES  AVAIL  TOTAL aoACDS  cdsuE",
+        "--------------------------------------------------------------------------------",
+        "epyc.q                            0.17   1037     32   2131   3200      0      0",
+        "medium.q                          1.16    478    101     64    800    480      0",
+    ]
+    df = get_qstat_gc_df(lines)
+    assert df["queue_name"].tolist() == ["epyc.q", "medium.q"]
+    assert df["ncore_available"].tolist() == [2131, 64]
+    assert df["ncore_aoacds"].tolist() == [0, 480]
+
+
+def test_get_qstat_job_df_handles_running_and_pending_rows():
+    lines = [
+        "job-ID     prior   name       user         state submit/start at     queue                          jclass                         slots ja-task-ID",
+        "------------------------------------------------------------------------------------------------------------------------------------------------",
+        " 23445365 0.26983 gfe_geneFa kfuku        r     02/11/2023 20:15:40 medium.q@m02                                                      4 42",
+        " 23518670 0.25562 gfe_cdsAnn kfuku        qw    02/14/2023 01:26:05                                                                  16 1,2",
+        " 23518671 0.25562 QLOGIN     kfuku        qw    02/14/2023 01:26:05                                                                   2",
+    ]
+    df = get_qstat_job_df(lines)
+    assert df["job_id"].tolist() == ["23445365", "23518670", "23518671"]
+    assert df["total_slots"].tolist() == [4, 32, 2]
+
+
+def test_get_uge_source_prefers_cheap_source_only_for_summary_output():
+    args = SimpleNamespace(uge_source="auto", ntop=3, out="", example_file="")
+    assert get_uge_source(args) == "qstat"
+    args = SimpleNamespace(uge_source="auto", ntop=0, out="", example_file="")
+    assert get_uge_source(args) == "qhost"
+    args = SimpleNamespace(uge_source="auto", ntop=0, out="", example_file="qstatF.txt")
+    assert get_uge_source(args) == "qstat"
+    args = SimpleNamespace(uge_source="qstat_gc", ntop=0, out="table.tsv", example_file="")
+    assert get_uge_source(args) == "qstat"
+    args = SimpleNamespace(uge_source="qstat_gc", ntop=0, out="", example_file="")
+    assert get_uge_source(args) == "qstat_gc"
+
+
+def test_get_uge_pending_demand_df_aggregates_hard_requests_per_queue():
+    lines = [
+        "job-ID     prior   name       user         state submit/start at     queue   slots ja-task-ID",
+        "-----------------------------------------------------------------------------------------------",
+        " 101 0.50000 a          kfuku        qw    02/11/2023 18:22:41       4 1-10:1",
+        "       Full jobname:     a",
+        "       Hard Resources:   h_rt=01:00:00 (0.000000)",
+        "                         mem_req=2G (0.000000)",
+        "       Soft Resources:   ",
+        "       Hard requested queues: epyc.q@node01,epyc.q@node02",
+        " 102 0.40000 b          other        qw    02/11/2023 18:22:41       1 ",
+        "       Hard Resources:   mem_req=500M (0.000000)",
+        "       Hard requested queues: epyc.q",
+        " 103 0.30000 c          other        qw    02/11/2023 18:22:41       2 ",
+    ]
+    df = get_uge_pending_demand_df(lines)
+    assert df["queue_name"].tolist() == ["(any)", "epyc.q"]
+    assert df["pending_jobs"].tolist() == [1, 2]
+    assert df["pending_tasks"].tolist() == [1, 11]
+    assert df["pending_slots"].tolist() == [2, 41]
+    assert df["pending_mem_gib"].tolist() == [0.0, 80.5]
+    df_node = pandas.DataFrame(
+        {
+            "queue_name": ["epyc.q", "epyc.q"],
+            "status": ["", "d"],
+            "ncore_available": [3, 8],
+            "hc:mem_req": [4.0, 16.0],
+        }
+    )
+    out = get_uge_pending_capacity_df(df, df_node)
+    assert out["available_slots"].tolist() == [0, 3]
+    assert out["available_mem_gib"].tolist() == [0.0, 4.0]
+
+
+def test_get_uge_launch_heuristic_df_joins_user_jobs_against_queue_competition():
+    lines = [
+        "job-ID     prior   nurg    npprior ntckts  ppri name       user         state submit/start at     queue   slots ja-task-ID",
+        "-------------------------------------------------------------------------------------------------------------------------",
+        " 101 0.30000 0.50000 0.50000 0.20000     0 a          other        qw    02/11/2023 18:22:41       4 ",
+        "       Hard Resources:   mem_req=2G (0.000000)",
+        "       Hard requested queues: epyc.q",
+        " 102 0.25000 0.50000 0.50000 0.05000     0 b          kfuku        qw    02/11/2023 18:22:41       8 1-4:1",
+        "       Hard Resources:   mem_req=4G (0.000000)",
+        " 103 0.28000 0.50000 0.50000 0.10000     0 c          kfuku        qw    02/11/2023 18:22:41       2 ",
+        "       Hard Resources:   mem_req=1G (0.000000)",
+        "       Hard requested queues: intel.q",
+    ]
+    df_pending = stat_module._finalize_uge_pending_jobs(get_uge_pending_accumulator(lines))
+    assert df_pending["user"].tolist() == ["other", "kfuku", "kfuku"]
+    assert df_pending["ntckts"].tolist() == [0.2, 0.05, 0.1]
+    assert get_uge_pending_demand_df(lines)["pending_slots"].tolist() == [32, 4, 2]
+    df_node = pandas.DataFrame(
+        {
+            "queue_name": ["epyc.q", "epyc.q", "intel.q", "gpu.q", "login.q"],
+            "node_name": ["at001", "at002", "it001", "g001", "l001"],
+            "status": ["", "", "", "d", ""],
+            "ncore_available": [16, 32, 20, 8, 4],
+            "hc:mem_req": [64.0, 32.0, 128.0, 16.0, 8.0],
+        }
+    )
+    out = get_uge_launch_heuristic_df(df_node=df_node, df_pending=df_pending, current_user="kfuku").set_index("queue_name")
+    assert out.index.tolist() == ["epyc.q", "gpu.q", "intel.q"]
+    assert out.at["epyc.q", "status"] == "priority_blocked"
+    assert pandas.isna(out.at["epyc.q", "recommended_cores"])
+    assert out.at["epyc.q", "top_node_name"] == "at002"
+    assert out.at["epyc.q", "priority_gap"] == pytest.approx(0.05)
+    assert out.at["epyc.q", "ticket_gap"] == pytest.approx(0.15)
+    assert out.at["epyc.q", "blocked_req_cores"] == 8
+    assert out.at["epyc.q", "blocked_req_mem_gib"] == 4.0
+    assert out.at["intel.q", "status"] == "resource_only"
+    assert out.at["intel.q", "recommended_cores"] == 20
+    assert out.at["intel.q", "priority_gap"] == 0
+    assert out.at["gpu.q", "status"] == "no_normal_nodes"
+    assert out.at["gpu.q", "recommended_cores"] == 0
+
+
+def test_uge_pending_accumulator_keeps_one_row_per_queue_and_user():
+    lines = [
+        "job-ID     prior   name       user         state submit/start at     queue   slots ja-task-ID",
+        "-----------------------------------------------------------------------------------------------",
+        " 100 0.50000 a          kfuku        qw    02/11/2023 18:22:41       2 ",
+        "       Hard requested queues: epyc.q",
+        " 99 0.40000 b          kfuku        qw    02/11/2023 18:22:41       2 ",
+        "       Hard requested queues: epyc.q",
+        " 101 0.60000 c          kfuku        qw    02/11/2023 18:22:41       4 ",
+        "       Hard requested queues: epyc.q",
+        " 102 0.70000 d          other        qw    02/11/2023 18:22:41       1 ",
+    ]
+    pending = get_uge_pending_accumulator(lines)
+    df = stat_module._finalize_uge_pending_jobs(pending)
+    assert df["queue_name"].tolist() == ["epyc.q", ""]
+    assert df["user"].tolist() == ["kfuku", "other"]
+    assert df["prior"].tolist() == [0.6, 0.7]
+    # Ties on size are broken by the numerically smallest job ID.
+    assert df["job_id"].tolist() == [99, 102]
+    assert df["slots"].tolist() == [2, 1]
+
+
 def test_adjust_ram_unit_converts_mib_to_gib_consistently():
     df = pandas.DataFrame(
         {
@@ -588,12 +1376,12 @@ def test_get_df_qstat_merges_memory_numerically(monkeypatch):
     line_sets = [first_lines, second_lines]
     call_index = {"i": 0}
 
-    def fake_get_command_stdout_lines(**kwargs):
+    def fake_iter_command_stdout_lines(**kwargs):
         i = call_index["i"]
         call_index["i"] += 1
         return line_sets[i]
 
-    monkeypatch.setattr(stat_module, "get_command_stdout_lines", fake_get_command_stdout_lines)
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
     args = SimpleNamespace(stat_command="qstat -F", niter=2, example_file="")
     scheduler, df, _ = get_df(args)
     assert scheduler == "uge"
@@ -611,14 +1399,310 @@ def test_get_df_qstat_handles_empty_later_iteration(monkeypatch):
     line_sets = [first_lines, second_lines]
     call_index = {"i": 0}
 
-    def fake_get_command_stdout_lines(**kwargs):
+    def fake_iter_command_stdout_lines(**kwargs):
         i = call_index["i"]
         call_index["i"] += 1
         return line_sets[i]
 
-    monkeypatch.setattr(stat_module, "get_command_stdout_lines", fake_get_command_stdout_lines)
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
     args = SimpleNamespace(stat_command="qstat -F", niter=2, example_file="")
     scheduler, df, _ = get_df(args)
     assert scheduler == "uge"
     assert df.shape[0] == 1
     assert int(df.at[0, "ncore_available"]) == 2
+
+
+def test_get_df_qstat_collects_queue_shards_concurrently(monkeypatch):
+    shard_lines = {
+        "epyc.q": [
+            "epyc.q@node01 BP 0/1/4 0.10 lx-amd64",
+            "\thc:mem_req=4G",
+            "\thl:mem_total=8G",
+            "  11 0.5 a kfuku r 02/12/2026 12:00:00 1",
+            "  12 0.5 b kfuku qw 02/12/2026 12:00:00 2 1-3",
+        ],
+        "short.q": [
+            "short.q@node02 BP 0/0/2 0.10 lx-amd64",
+            "\thc:mem_req=2G",
+            "\thl:mem_total=4G",
+            "  12 0.5 b kfuku qw 02/12/2026 12:00:00 2 1-3",
+        ],
+    }
+    barrier = threading.Barrier(2, timeout=5)
+    commands = []
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        tokens = shlex.split(kwargs["command_str"])
+        commands.append(tokens)
+        barrier.wait()
+        return shard_lines[tokens[tokens.index("-q") + 1]]
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    args = SimpleNamespace(
+        stat_command="qstat -F",
+        niter=1,
+        example_file="",
+        qstat_shard_queues="epyc.q,short.q",
+        qstat_shard_threads=2,
+    )
+    scheduler, df, df_user = get_df(args)
+    assert scheduler == "uge"
+    assert len(commands) == 2
+    assert all(tokens[:3] == ["qstat", "-F", "mem_req,mem_total,m_topology_inuse"] for tokens in commands)
+    assert df["node_name"].tolist() == ["node01", "node02"]
+    assert df["ncore_available"].tolist() == [3, 2]
+    assert df_user["job_id"].tolist() == ["11", "12"]
+    assert df_user["total_slots"].tolist() == [1, 6]
+
+
+def test_add_command_filter_pushes_values_into_matching_commands_only():
+    assert add_command_filter("squeue --json", {"squeue"}, ["-p", "--partition"], ["epyc", "rome"]) == (
+        "squeue --json -p epyc,rome"
+    )
+    assert add_command_filter("squeue --partition=short", {"squeue"}, ["-p", "--partition"], ["epyc"]) == (
+        "squeue --partition=short"
+    )
+    assert add_command_filter("/usr/bin/qstat -F", {"qstat"}, ["-q"], ["epyc.q"]) == "/usr/bin/qstat -F -q epyc.q"
+    assert add_command_filter("qhost -q", {"qstat"}, ["-q"], ["epyc.q"]) == "qhost -q"
+    assert add_command_filter("sprio", {"sprio"}, ["-p"], []) == "sprio"
+    assert get_scontrol_partition_filter_command("scontrol show partition -o", ["epyc"]) == (
+        "scontrol show partition epyc -o"
+    )
+    assert get_scontrol_partition_filter_command("scontrol show partition -o", ["epyc", "rome"]) == (
+        "scontrol show partition -o"
+    )
+    assert get_scontrol_partition_filter_command("scontrol show partition short", ["epyc"]) == (
+        "scontrol show partition short"
+    )
+
+
+def test_get_df_slurm_pushes_down_partition_and_user_and_filters_nodes_early(monkeypatch):
+    outputs = {
+        "squeue": [
+            "101\tepyc\twrap\tkfuku\tR\t1:00\t1\t4\t8G\t1-00:00:00\tn1\n",
+            "102\trome\twrap\tkfuku\tPD\t0:00\t1\t4\t8G\t1-00:00:00\t(Priority)\n",
+        ],
+        "scontrol show partition": ["PartitionName=epyc State=UP\n"],
+        "scontrol show node": [
+            "NodeName=n1 CPUAlloc=4 CPUTot=16 RealMemory=32000 AllocMem=0 State=MIXED Partitions=epyc,all\n",
+            "NodeName=n2 CPUAlloc=0 CPUTot=16 RealMemory=32000 AllocMem=0 State=IDLE Partitions=rome\n",
+        ],
+    }
+    commands = []
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        commands.append(kwargs["command_str"])
+        for prefix, lines in outputs.items():
+            if kwargs["command_str"].startswith(prefix):
+                return lines
+        return None
+
+    parsed_blocks = []
+    parse_key_value_fields = stat_module._parse_key_value_fields
+
+    def counting_parse_key_value_fields(line, keys=None):
+        parsed_blocks.append(line)
+        return parse_key_value_fields(line, keys=keys)
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    monkeypatch.setattr(stat_module, "_parse_key_value_fields", counting_parse_key_value_fields)
+    args = SimpleNamespace(
+        stat_command="squeue",
+        example_file="",
+        out="",
+        partition="epyc",
+        user="kfuku",
+        slurm_partition_command="scontrol show partition -o",
+        slurm_partition_example_file="",
+        slurm_node_command="scontrol show node -o",
+        slurm_node_example_file="",
+    )
+    scheduler, node_table, df_user = get_df(args)
+    df = get_slurm_partition_view(node_table)
+    assert scheduler == "slurm"
+    # The three commands run concurrently, so their order is not fixed.
+    assert len(commands) == 3
+    squeue_command = [command for command in commands if command.startswith("squeue")][0]
+    assert shlex.split(squeue_command)[-4:] == ["-p", "epyc", "-u", "kfuku"]
+    assert "scontrol show partition epyc -o" in commands
+    assert "scontrol show node -o" in commands
+    # The squeue output was not filtered by the fake command; the job table is.
+    assert df_user["job_id"].tolist() == ["101"]
+    assert df["queue_name"].tolist() == ["epyc"]
+    assert df["node_name"].tolist() == ["n1"]
+    assert [block.split()[0] for block in parsed_blocks if block.startswith("NodeName=")] == ["NodeName=n1"]
+
+
+def test_stat_main_slurm_runs_all_scheduler_commands_concurrently(monkeypatch, capsys):
+    outputs = {
+        "squeue": ["101\tepyc\twrap\tkfuku\tPD\t0:00\t1\t4\t8G\t1-00:00:00\t(Priority)\n"],
+        "scontrol show partition": ["PartitionName=epyc State=UP\n"],
+        "scontrol show node": [
+            "NodeName=n1 CPUAlloc=4 CPUTot=16 RealMemory=32000 AllocMem=0 State=MIXED Partitions=epyc\n",
+        ],
+        "scontrol show reservation": [
+            "ReservationName=r1 StartTime=2026-03-06T12:00:00 EndTime=2026-03-07T12:00:00 Duration=1-00:00:00\n",
+            "Nodes=n1 NodeCnt=1 CoreCnt=2 PartitionName=epyc State=ACTIVE\n",
+        ],
+        "sprio": [
+            "JOBID PARTITION PRIORITY SITE AGE FAIRSHARE JOBSIZE PARTITION\n",
+            "101 epyc 1000 0 10 900 10 80\n",
+        ],
+    }
+    # Every command blocks until all five have started.
+    barrier = threading.Barrier(len(outputs), timeout=5)
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        barrier.wait()
+        for prefix, lines in outputs.items():
+            if kwargs["command_str"].startswith(prefix):
+                return lines
+        return None
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    monkeypatch.setattr(stat_module, "get_current_user_name", lambda: "kfuku")
+    args = SimpleNamespace(
+        stat_command="squeue",
+        example_file="",
+        out="",
+        partition="",
+        user="",
+        walltime="",
+        ntop=3,
+        slurm_partition_command="scontrol show partition -o",
+        slurm_partition_example_file="",
+        slurm_node_command="scontrol show node -o",
+        slurm_node_example_file="",
+        slurm_reservation_command="scontrol show reservation",
+        slurm_reservation_example_file="",
+        slurm_prio_command="sprio",
+        slurm_prio_example_file="",
+        exclude_abnormal_node=True,
+        show_launch_heuristic=True,
+    )
+    stat_module.stat_main(args, now=RESERVATION_FIXTURE_NOW)
+    out = capsys.readouterr().out
+    assert out.index("jobs  self:R/Q/F=0/1/0") < out.index("part ")
+    # 16 CPUs, 4 allocated and 2 reserved; the launch column comes from sprio.
+    assert "epyc  1/0/1  10/4/16" in out
+    assert "gap=0" in out
+
+
+def test_stat_main_slurm_kills_optional_commands_when_squeue_fails():
+    args = SimpleNamespace(
+        stat_command="squeue",
+        example_file="/tmp/this_file_should_not_exist_for_kfbatch_tests",
+        out="",
+        partition="",
+        user="",
+        walltime="",
+        ntop=3,
+        slurm_partition_command=SLOW_COMMAND,
+        slurm_partition_example_file="",
+        slurm_node_command=SLOW_COMMAND,
+        slurm_node_example_file="",
+        slurm_reservation_command=SLOW_COMMAND,
+        slurm_reservation_example_file="",
+        slurm_prio_command=SLOW_COMMAND,
+        slurm_prio_example_file="",
+        exclude_abnormal_node=True,
+        show_launch_heuristic=True,
+    )
+    start = time.monotonic()
+    with pytest.raises(KFBatchCommandError, match="Failed to read example file for --stat_command"):
+        stat_module.stat_main(args)
+    # The optional commands sleep for 30 s unless they are killed.
+    assert time.monotonic() - start < 10
+    assert args.command_budget["is_cancelled"]
+
+
+def test_get_df_qstat_pushes_down_partition_as_queue_option(monkeypatch):
+    commands = []
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        commands.append(shlex.split(kwargs["command_str"]))
+        return [
+            "epyc.q@node01 BP 0/1/4 0.10 lx-amd64",
+            "\thc:mem_req=4G",
+            "short.q@node02 BP 0/0/2 0.10 lx-amd64",
+            "\thc:mem_req=2G",
+            "  11 0.5 a kfuku r 02/12/2026 12:00:00 1",
+            "  12 0.5 b other qw 02/12/2026 12:00:00 1 1-2",
+        ]
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    args = SimpleNamespace(stat_command="qstat -F", niter=1, example_file="", partition="epyc.q", user="kfuku",
+                           qstat_shard_queues="auto")
+    _, df, df_user = get_df(args)
+    assert commands == [["qstat", "-F", "mem_req,mem_total,m_topology_inuse", "-q", "epyc.q"]]
+    assert df["queue_name"].tolist() == ["epyc.q"]
+    assert df_user["job_id"].tolist() == ["11"]
+
+
+def test_get_df_qstat_stops_sampling_once_availability_is_stable(monkeypatch, capsys):
+    line_sets = [
+        ["epyc.q@node01 BP 0/2/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G"],
+        ["epyc.q@node01 BP 0/3/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G"],
+        ["epyc.q@node01 BP 0/1/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G"],
+        ["epyc.q@node01 BP 0/0/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G"],
+    ] + [["epyc.q@node01 BP 0/4/4 0.10 lx-amd64", "\thc:mem_req=0G", "\thl:mem_total=8G"]] * 6
+    call_index = {"i": 0}
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        i = call_index["i"]
+        call_index["i"] += 1
+        return line_sets[i]
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    args = SimpleNamespace(stat_command="qstat -F", niter=10, example_file="", niter_interval=0.0, niter_stable=2)
+    _, df, _ = get_df(args)
+    # minimum changes at sample 2, then stays at 1 core for samples 3 and 4
+    assert call_index["i"] == 4
+    assert int(df.at[0, "ncore_available"]) == 1
+    assert "stopped after 4 of 10 samples" in capsys.readouterr().out
+
+
+def test_get_df_qstat_keeps_samples_taken_before_a_timeout(monkeypatch, capsys):
+    lines = ["epyc.q@node01 BP 0/2/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G"]
+    call_index = {"i": 0}
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        call_index["i"] += 1
+        if call_index["i"] == 3:
+            raise KFBatchCommandTimeout("Timed out after 1.0 s running --stat_command: qstat -F")
+        return lines
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    args = SimpleNamespace(stat_command="qstat -F", niter=5, example_file="", niter_interval=0.0, niter_stable=0)
+    _, df, _ = get_df(args)
+    assert df["num_sample"].tolist() == [2]
+    assert "availability was unchanged" not in capsys.readouterr().out
+    assert args.command_budget["notes"] == ["sampling stopped after 2 of 5 samples because a command timed out."]
+
+
+def test_get_df_qstat_reports_per_node_dispersion(monkeypatch):
+    line_sets = [
+        ["epyc.q@node01 BP 0/1/4 0.10 lx-amd64", "\thc:mem_req=4G", "\thl:mem_total=8G",
+         "epyc.q@node02 BP 0/0/4 0.10 lx-amd64", "\thc:mem_req=8G", "\thl:mem_total=8G"],
+        ["epyc.q@node01 BP 0/3/4 0.10 lx-amd64", "\thc:mem_req=2000M", "\thl:mem_total=8G"],
+        ["epyc.q@node01 BP 0/2/4 0.10 lx-amd64", "\thc:mem_req=6G", "\thl:mem_total=8G",
+         "epyc.q@node02 BP 0/0/4 0.10 lx-amd64", "\thc:mem_req=8G", "\thl:mem_total=8G"],
+    ]
+    call_index = {"i": 0}
+
+    def fake_iter_command_stdout_lines(**kwargs):
+        i = call_index["i"]
+        call_index["i"] += 1
+        return line_sets[i]
+
+    monkeypatch.setattr(stat_module, "iter_command_stdout_lines", fake_iter_command_stdout_lines)
+    args = SimpleNamespace(stat_command="qstat -F", niter=3, example_file="")
+    _, df, _ = get_df(args)
+    assert df["node_name"].tolist() == ["node01", "node02"]
+    assert df["ncore_available"].tolist() == [1, 4]
+    assert df["ncore_available_max"].tolist() == [3, 4]
+    assert df["ncore_available_mean"].tolist() == [2.0, 4.0]
+    assert df["hc:mem_req"].tolist() == ["2.000G", "8.000G"]
+    assert df["hc:mem_req_max_gib"].tolist() == [6.0, 8.0]
+    assert df["hc:mem_req_mean_gib"].tolist() == [4.0, 8.0]
+    assert df["num_sample"].tolist() == [3, 2]